@@ -1,21 +1,38 @@
-import json
+import asyncio
 import bugsnag
+import functools
 import logging
+from contextlib import asynccontextmanager
+from typing import Any, Optional, Tuple
 
-from asgiref.sync import async_to_sync
 from bugsnag.handlers import BugsnagHandler
 from dotenv import load_dotenv
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
 from chatbot_api.assistant import AssistantBison
+from chatbot_api.streaming import ChatResponse, stream_tokens
 from pipeline import (
-    create_all_user_context,
-    make_all_response_decisions,
-    take_all_actions,
+    ActorEngine,
+    IntegrationSet,
+    JobQueue,
+    RequestBody,
+    UserContext,
+    acreate_all_user_context,
+    amake_all_response_decisions,
 )
 from pipeline.config import load_config
+from pipeline.idempotency import create_idempotency_store
+from pipeline.metrics import render_metrics, time_stage
+from pipeline.tracing import (
+    create_tracer,
+    current_span,
+    set_tracer,
+    span,
+    start_trace,
+    use_span,
+)
 
 # NOTE: Load dotenv before importing any code from other files for globals
 # TODO: Probably make this unnecessary with better abstractions
@@ -36,8 +53,41 @@ handler = BugsnagHandler()
 handler.setLevel(logging.ERROR)
 logger.addHandler(handler)
 
+# One instance of each configured integration, shared by every request in this worker
+integrations = IntegrationSet(config)
+
+# Runs the ResponseActors off the request path, after the response has streamed
+actor_engine = ActorEngine(config, integrations)
+
+# Answers redeliveries of a webhook from the first delivery, None if disabled
+idempotency_store = create_idempotency_store(config)
+
+# Samples the requests to trace, None if tracing is disabled
+tracer = create_tracer(config)
+set_tracer(tracer)
+
+# Generates the responses to requests that were acknowledged early, see fast_ack_enabled
+conversation_queue = JobQueue(
+    "conversations", config.fast_ack_workers, config.fast_ack_queue_size
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await integrations.startup()
+    await actor_engine.start()
+    await conversation_queue.start()
+    yield
+    await conversation_queue.stop(config.actor_drain_timeout_seconds)
+    await actor_engine.stop(config.actor_drain_timeout_seconds)
+    await integrations.shutdown()
+    if tracer is not None:
+        await asyncio.to_thread(tracer.shutdown)
+
+
 # Define the FastAPI application
 app = FastAPI(
+    lifespan=lifespan,
     title="AI Chatbot Starter",
     description="An LLM-powered Chatbot for Documentation",
     summary="Build an LLM-powered Chatbot for a given documentation set",
@@ -80,20 +130,150 @@ def index():
     return {"ok": True, "message": "App is running"}
 
 
+# Prometheus scrapes this route
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+# Remember the exchange and hand the response to the ResponseActors
+async def finish_response(
+    conv_info: Any,
+    user_context: UserContext,
+    txt_response: str,
+    responses_from_vs: str,
+    context: str,
+    idempotency_key: Optional[str],
+) -> None:
+    # Remember the exchange for follow up questions in this conversation
+    await assistant.asave_turn(
+        user_context.session_id, user_context.user_question, txt_response
+    )
+
+    # Take action based on the response from the bot, without holding the
+    # stream open while they run
+    await actor_engine.submit(
+        conv_info=conv_info,
+        text_response=txt_response,
+        responses_from_vs=responses_from_vs,
+        context=context,
+        idempotency_key=idempotency_key,
+    )
+
+
+# Create the user context and start the LLM response. Retrieval only needs the
+# question, so if the decision already knows it, retrieval runs alongside the
+# UserContextCreators rather than after them. The "prepare" stage spans both, and is
+# shorter than the user_context, embedding and vector_search stages added up when the
+# overlap pays off
+async def start_response(
+    conv_info: Any, user_question: Optional[str]
+) -> Tuple[UserContext, ChatResponse, str, str]:
+    with time_stage("prepare", config.llm_provider.value), span("app.start_response"):
+        return await _start_response(conv_info, user_question)
+
+
+async def _start_response(
+    conv_info: Any, user_question: Optional[str]
+) -> Tuple[UserContext, ChatResponse, str, str]:
+    retrieval = None
+    if user_question is not None:
+        retrieval = asyncio.create_task(assistant.aprefetch(user_question))
+        # It may end up unused, e.g. on a response cache hit, don't log its errors
+        retrieval.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    try:
+        user_context = await acreate_all_user_context(
+            config=config, conv_info=conv_info, integrations=integrations
+        )
+        # A UserContextCreator rewrote the question, what was retrieved doesn't fit
+        if retrieval is not None and user_context.user_question != user_question:
+            retrieval.cancel()
+            retrieval = None
+
+        bot_response, responses_from_vs, context = await assistant.aget_response(
+            user_input=user_context.user_question,
+            persona=user_context.persona,
+            user_context=user_context.context_str,
+            session_id=user_context.session_id,
+            retrieval=retrieval,
+        )
+    finally:
+        if retrieval is not None:
+            retrieval.cancel()
+
+    return user_context, bot_response, responses_from_vs, context
+
+
+# Returns the response of an earlier delivery of the request, waiting for it if it's
+# still in flight, or None if this request should generate the response
+async def claim_request(idempotency_key: Optional[str]) -> Optional[str]:
+    if idempotency_key is None or idempotency_store is None:
+        return None
+    return await idempotency_store.acquire(idempotency_key)
+
+
+# Record the response to a claimed request, None if it failed and should be retried
+async def settle_request(
+    idempotency_key: Optional[str], txt_response: Optional[str]
+) -> None:
+    if idempotency_key is None or idempotency_store is None:
+        return
+    if txt_response is None:
+        await idempotency_store.release(idempotency_key)
+    else:
+        await idempotency_store.complete(idempotency_key, txt_response)
+
+
+# Generate and deliver a response in the background, for fast_ack_enabled
+async def answer_conversation(
+    conv_info: Any, user_question: Optional[str], idempotency_key: Optional[str]
+) -> None:
+    # An earlier delivery of this request has been, or is being, answered already
+    if await claim_request(idempotency_key) is not None:
+        return
+
+    try:
+        user_context, bot_response, responses_from_vs, context = await start_response(
+            conv_info, user_question
+        )
+        txt_response = "".join([text async for text in stream_tokens(bot_response)])
+    except Exception as e:
+        await settle_request(idempotency_key, None)
+        bugsnag.notify(e)
+        raise
+
+    await settle_request(idempotency_key, txt_response)
+    await finish_response(
+        conv_info,
+        user_context,
+        txt_response,
+        responses_from_vs,
+        context,
+        idempotency_key,
+    )
+
+
 # Intercom posts webhooks to this route when a conversation is created or replied to
 @app.post("/chat")
-def conversations(request: Request):
+async def conversations(request: Request):
+    # Sampled requests are traced, as part of the caller's trace if it sent one
+    trace = start_trace("app.conversations", request.headers.get("traceparent"))
+    with use_span(trace, end_on_exit=True):
+        return await respond(request)
+
+
+async def respond(request: Request):
     try:
-        # Process the request body in a synchronous fashion
-        request_body = async_to_sync(request.body)()
-        data_str = request_body.decode("utf-8")
-        request_body = json.loads(data_str)
+        # Read the body without tying up a threadpool thread
+        request_body = RequestBody(await request.body())
 
         # Based on the body, create a ResponseDecision object
-        response_decision = make_all_response_decisions(
+        response_decision = await amake_all_response_decisions(
             config=config,
             request_body=request_body,
             request_headers=request.headers,
+            integrations=integrations,
         )
 
         # Exit early if we don't want to continue on to LLM for response
@@ -103,33 +283,71 @@ def conversations(request: Request):
                 status_code=response_decision.response_code,
             )
 
-        # Assemble context for assistant query from relevant sources based on conversation
-        user_context = create_all_user_context(
-            config=config,
-            conv_info=response_decision.conversation_info,
-        )
+        # Acknowledge right away and leave the rest to the conversation queue
+        if config.fast_ack_enabled:
+            job = functools.partial(
+                answer_conversation,
+                response_decision.conversation_info,
+                response_decision.user_question,
+                response_decision.idempotency_key,
+            )
+            if not conversation_queue.submit(job):
+                return JSONResponse(
+                    content={"ok": False, "message": "Too many pending requests."},
+                    status_code=503,
+                )
+            return JSONResponse(
+                content={"ok": True, "message": "Request accepted."},
+                status_code=202,
+            )
 
-        # Call the assistant to retrieve a response
-        bot_response, responses_from_vs, context = assistant.get_response(
-            user_input=user_context.user_question,
-            persona=user_context.persona,
-            user_context=user_context.context_str,
-        )
+        # Answer redeliveries of a request with the response to the first delivery
+        idempotency_key = response_decision.idempotency_key
+        previous_response = await claim_request(idempotency_key)
+        if previous_response is not None:
+            return PlainTextResponse(
+                previous_response, media_type="text/event-stream", status_code=201
+            )
 
-        def stream_data():
-            txt_response = ""
-            for text in bot_response.response_gen:
-                txt_response += text
-                yield text
-
-            # Take action based on the response from the bot
-            take_all_actions(
-                config=config,
-                conv_info=response_decision.conversation_info,
-                text_response=txt_response,
-                responses_from_vs=responses_from_vs,
-                context=context,
+        try:
+            # Assemble context for assistant query from relevant sources based on
+            # conversation, and call the assistant to retrieve a response
+            (
+                user_context,
+                bot_response,
+                responses_from_vs,
+                context,
+            ) = await start_response(
+                response_decision.conversation_info, response_decision.user_question
             )
+        except Exception:
+            await settle_request(idempotency_key, None)
+            raise
+
+        # The response streams after the request's span has ended
+        trace = current_span()
+
+        async def stream_data():
+            with use_span(trace), span("app.stream_response"):
+                txt_response = ""
+                try:
+                    async for text in stream_tokens(bot_response):
+                        txt_response += text
+                        yield text
+                except BaseException:
+                    # Includes the client disconnecting mid stream
+                    await settle_request(idempotency_key, None)
+                    raise
+
+                await settle_request(idempotency_key, txt_response)
+                await finish_response(
+                    response_decision.conversation_info,
+                    user_context,
+                    txt_response,
+                    responses_from_vs,
+                    context,
+                    idempotency_key,
+                )
 
         return StreamingResponse(
             stream_data(),
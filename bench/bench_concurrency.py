@@ -0,0 +1,158 @@
+"""
+Load test for concurrent /chat streams on a single uvicorn worker. Runs the async
+/chat route next to a copy of the previous sync route (threadpool bound, blocking
+response_gen) against the same stub assistant, and reports how many streams were
+in flight at once and the resulting latencies.
+
+Usage:
+    PYTHONPATH=. python bench/bench_concurrency.py --concurrency 200 --ttft 1.0
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+from fastapi import Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from bench.stubs import (
+    StubAssistant,
+    StubEmbeddings,
+    StubLLM,
+    StubVectorStore,
+    load_stub_app,
+    make_corpus,
+    stub_config,
+)
+from pipeline import (
+    RequestBody,
+    create_all_user_context,
+    make_all_response_decisions,
+)
+
+
+def add_sync_route(app_module) -> None:
+    """Registers the previous sync implementation of POST /chat as /chat-sync"""
+    config, assistant = app_module.config, app_module.assistant
+
+    def conversations_sync(request: Request):
+        from asgiref.sync import async_to_sync
+
+        request_body = RequestBody(async_to_sync(request.body)())
+        response_decision = make_all_response_decisions(
+            config=config, request_body=request_body, request_headers=request.headers
+        )
+        if response_decision.should_return_early:
+            return JSONResponse(
+                content=response_decision.response_dict,
+                status_code=response_decision.response_code,
+            )
+        user_context = create_all_user_context(
+            config=config, conv_info=response_decision.conversation_info
+        )
+        bot_response, _, _ = assistant.get_response(
+            user_input=user_context.user_question,
+            persona=user_context.persona,
+            user_context=user_context.context_str,
+        )
+
+        def stream_data():
+            for text in bot_response.response_gen:
+                yield text
+
+        return StreamingResponse(
+            stream_data(), media_type="text/event-stream", status_code=201
+        )
+
+    app_module.app.add_api_route("/chat-sync", conversations_sync, methods=["POST"])
+
+
+async def run_load(url: str, concurrency: int, timeout: float) -> dict:
+    in_flight, max_in_flight, timeouts = 0, 0, 0
+    ttfts, totals = [], []
+
+    async def stream(client: httpx.AsyncClient, i: int) -> None:
+        nonlocal in_flight, max_in_flight
+        start = time.perf_counter()
+        async with client.stream("POST", url, json={"question": f"What is SAI? {i}"}) as r:
+            first = True
+            async for _ in r.aiter_text():
+                if first:
+                    ttfts.append(time.perf_counter() - start)
+                    in_flight += 1
+                    max_in_flight = max(max_in_flight, in_flight)
+                    first = False
+        in_flight -= 1
+        totals.append(time.perf_counter() - start)
+
+    async def one(client: httpx.AsyncClient, i: int) -> None:
+        nonlocal timeouts
+        try:
+            await asyncio.wait_for(stream(client, i), timeout)
+        except asyncio.TimeoutError:
+            timeouts += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(client, i) for i in range(concurrency)))
+        wall = time.perf_counter() - start
+
+    quantile = lambda xs, q: statistics.quantiles(xs or [0, 0], n=100)[q - 1]  # noqa: E731
+    return {
+        "wall_s": wall,
+        "timeouts": timeouts,
+        "max_streams_in_flight": max_in_flight,
+        "ttft_p50_s": quantile(ttfts, 50),
+        "ttft_p95_s": quantile(ttfts, 95),
+        "total_p50_s": quantile(totals, 50),
+        "total_p95_s": quantile(totals, 95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--ttft", type=float, default=1.0)
+    parser.add_argument("--tokens-per-second", type=float, default=20.0)
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds per request")
+    parser.add_argument("--routes", nargs="+", default=["/chat-sync", "/chat"])
+    parser.add_argument("--port", type=int, default=5599)
+    args = parser.parse_args()
+
+    embeddings = StubEmbeddings()
+    vectorstore = StubVectorStore()
+    vectorstore.add(make_corpus(embeddings, 200))
+    vectorstore.latency, embeddings.delay = 0.02, 0.02
+
+    config = stub_config(response_actor_cls=[])
+    llm = StubLLM(ttft=args.ttft, tokens_per_second=args.tokens_per_second)
+    app_module = load_stub_app(
+        config, StubAssistant(config, llm, embeddings, vectorstore)
+    )
+    add_sync_route(app_module)
+
+    server = uvicorn.Server(
+        uvicorn.Config(app_module.app, port=args.port, log_level="warning")
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    for route in args.routes:
+        url = f"http://127.0.0.1:{args.port}{route}"
+        results = asyncio.run(run_load(url, args.concurrency, args.timeout))
+        print(f"{route:<10} " + " ".join(f"{k}={v:.2f}" for k, v in results.items()))
+
+    # Stalled sync streams leave non-daemon llama-index writer threads behind
+    sys.stdout.flush()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
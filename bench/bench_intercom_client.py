@@ -0,0 +1,180 @@
+"""
+Compares Intercom API call latency against a local stub server over TLS: a bare
+requests call per API call, as the Intercom integrations used to make, against the
+pooled IntercomClient, sync and async. The stub answers after `--latency` seconds,
+so the difference is connection setup, mostly the TCP and TLS handshakes.
+
+Usage:
+    PYTHONPATH=. python bench/bench_intercom_client.py --calls 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import warnings
+
+import requests
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from urllib3.exceptions import InsecureRequestWarning
+
+from bench.stubs import stub_config
+from integrations.intercom import IntercomClient
+
+
+def make_stub_intercom(latency: float) -> Starlette:
+    async def contact(request):
+        await asyncio.sleep(latency)
+        return JSONResponse({"type": "contact", "id": request.path_params["id"]})
+
+    async def reply(request):
+        await asyncio.sleep(latency)
+        return JSONResponse({"type": "conversation", "id": request.path_params["id"]})
+
+    return Starlette(
+        routes=[
+            Route("/contacts/{id}", contact, methods=["GET"]),
+            Route("/conversations/{id}", reply, methods=["GET"]),
+            Route("/conversations/{id}/reply", reply, methods=["POST"]),
+        ]
+    )
+
+
+def make_certificate(directory: str):
+    keyfile = os.path.join(directory, "key.pem")
+    certfile = os.path.join(directory, "cert.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1"]
+        + ["-subj", "/CN=127.0.0.1", "-keyout", keyfile, "-out", certfile],
+        check=True,
+        capture_output=True,
+    )
+    return keyfile, certfile
+
+
+def summarize(name: str, latencies, wall: float) -> None:
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:<26} p50={quantiles[49] * 1e3:7.2f}ms p95={quantiles[94] * 1e3:7.2f}ms"
+        f" wall={wall:6.2f}s"
+    )
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+async def atimed(coro_fn):
+    start = time.perf_counter()
+    await coro_fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--port", type=int, default=5598)
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", InsecureRequestWarning)
+
+    directory = tempfile.mkdtemp()
+    keyfile, certfile = make_certificate(directory)
+    server = uvicorn.Server(
+        uvicorn.Config(
+            make_stub_intercom(args.latency),
+            port=args.port,
+            log_level="warning",
+            ssl_keyfile=keyfile,
+            ssl_certfile=certfile,
+        )
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    base_url = f"https://127.0.0.1:{args.port}"
+    config = stub_config(
+        intercom_api_url=base_url,
+        intercom_token="token",
+        intercom_max_connections=args.concurrency,
+    )
+    headers = {"Authorization": "Bearer token"}
+
+    # Sequential calls, as a single request makes them
+    start = time.perf_counter()
+    latencies = [
+        timed(
+            lambda: requests.get(
+                f"{base_url}/contacts/{i}", headers=headers, verify=False
+            ).json()
+        )
+        for i in range(args.calls)
+    ]
+    summarize("requests, sequential", latencies, time.perf_counter() - start)
+
+    client = IntercomClient(config)
+    client._client_kwargs["verify"] = False  # The stub's certificate is self-signed
+    start = time.perf_counter()
+    latencies = [
+        timed(lambda: client.request("GET", f"/contacts/{i}").json())
+        for i in range(args.calls)
+    ]
+    summarize("IntercomClient, sequential", latencies, time.perf_counter() - start)
+
+    # Concurrent calls, as the actors of many responses make them
+    async def concurrent_requests():
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one(i):
+            async with semaphore:
+                return await atimed(
+                    lambda: asyncio.to_thread(
+                        lambda: requests.post(
+                            f"{base_url}/conversations/{i}/reply",
+                            json={"body": "An answer."},
+                            headers=headers,
+                            verify=False,
+                        ).json()
+                    )
+                )
+
+        return await asyncio.gather(*(one(i) for i in range(args.calls)))
+
+    async def concurrent_client():
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def reply(i):
+            response = await client.arequest(
+                "POST", f"/conversations/{i}/reply", json={"body": "An answer."}
+            )
+            return response.json()
+
+        async def one(i):
+            async with semaphore:
+                return await atimed(lambda: reply(i))
+
+        latencies = await asyncio.gather(*(one(i) for i in range(args.calls)))
+        await client.aclose()
+        return latencies
+
+    for name, run in [
+        ("requests, concurrent", concurrent_requests),
+        ("IntercomClient, concurrent", concurrent_client),
+    ]:
+        start = time.perf_counter()
+        latencies = asyncio.run(run())
+        summarize(name, latencies, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Measures BM25Index build time, size on disk and query latency as the corpus grows.
+Chunks are drawn from a Zipf-distributed vocabulary, like natural text, with a
+product code in one chunk out of ten, and queries mix a few words with a code.
+
+Usage:
+    PYTHONPATH=. python bench/bench_lexical_index.py --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+from llama_index.core.schema import TextNode
+
+from chatbot_api.lexical_index import BM25Index
+
+
+def make_texts(
+    count: int, words: int, vocabulary: List[str], rng: np.random.Generator
+) -> List[str]:
+    ranks = np.minimum(rng.zipf(1.1, size=(count, words)), len(vocabulary)) - 1
+    texts = [" ".join(vocabulary[rank] for rank in row) for row in ranks]
+    for i in range(0, count, 10):
+        texts[i] += f" Error SKU-{rng.integers(100000):05d}."
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--words", type=int, default=100, help="words per chunk")
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--dir", help="where to build the indexes, default /tmp")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vocabulary = [f"word{i}" for i in range(args.vocabulary)]
+    for size in args.sizes:
+        path = tempfile.mkdtemp(dir=args.dir)
+        try:
+            index = BM25Index(path)
+            start = time.perf_counter()
+            for batch in range(0, size, args.batch_size):
+                count = min(args.batch_size, size - batch)
+                texts = make_texts(count, args.words, vocabulary, rng)
+                index.add(
+                    [
+                        TextNode(id_=str(i), text=text)
+                        for i, text in enumerate(texts, batch)
+                    ]
+                )
+            add_seconds = time.perf_counter() - start
+            index.save()
+            save_seconds = time.perf_counter() - start - add_seconds
+
+            queries = [
+                " ".join(text.split()[:3] + [f"SKU-{rng.integers(100000):05d}"])
+                for text in make_texts(args.queries, 20, vocabulary, rng)
+            ]
+            timings = []
+            for query in queries:
+                start = time.perf_counter()
+                index.search(query, args.k)
+                timings.append(time.perf_counter() - start)
+
+            cuts = statistics.quantiles(timings, n=100)
+            disk = sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+            postings = len(np.load(index._file("postings", 1), mmap_mode="r"))
+            print(
+                f"chunks={size:>8} postings={postings:>10} disk={disk / 2**20:8.1f}MiB "
+                f"add={add_seconds:6.1f}s save={save_seconds:5.1f}s "
+                f"p50={cuts[49] * 1000:6.2f}ms p95={cuts[94] * 1000:6.2f}ms "
+                f"p99={cuts[98] * 1000:6.2f}ms"
+            )
+            del index
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main()
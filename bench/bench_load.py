@@ -0,0 +1,347 @@
+"""
+Load test for the /chat pipeline. Boots app.py in a separate process against the stub
+LLM, embeddings and vector store, with configurable delays and token rate, and
+replays the questions in tests/test_questions.txt as the example payload
+(tests/test_request.json) or as signed Intercom webhooks
+(tests/test_request_intercom.json), whose Intercom API calls go to a local stub.
+
+Requests are sent at a fixed rate with --qps, or by --concurrency clients back to
+back. The report has p50/p95/p99 of the time to first token and of the total time,
+the token rate of each stream, and the server's CPU and RSS, read from /proc. With
+--baseline, the run fails if any of them regressed more than --threshold against
+the committed results, which --update-baseline rewrites. The committed baseline
+was recorded with the default arguments, so compare against it with those.
+
+Usage:
+    PYTHONPATH=. python bench/bench_load.py --workload questions intercom \\
+        --requests 200 --concurrency 20 --baseline bench/baselines/load.json
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import uvicorn
+
+from bench.bench_intercom_client import make_stub_intercom
+from bench.stubs import (
+    StubAssistant,
+    StubEmbeddings,
+    StubLLM,
+    StubVectorStore,
+    count_tokens,
+    load_stub_app,
+    make_corpus,
+    stub_config,
+)
+
+INTERCOM_SECRET = "bench-secret"
+TESTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "tests")
+
+# Metric name: True if higher is better
+BASELINE_METRICS = {
+    "ttft_p50_s": False,
+    "ttft_p95_s": False,
+    "ttft_p99_s": False,
+    "total_p50_s": False,
+    "total_p95_s": False,
+    "total_p99_s": False,
+    "tokens_per_s_p50": True,
+    "cpu_percent": False,
+    "rss_peak_mib": False,
+}
+
+
+def workload_config(workload: str, intercom_url: str) -> Dict[str, Any]:
+    """Config overrides for the server: only the pipeline is measured, not caches"""
+    overrides: Dict[str, Any] = {
+        "response_cache_enabled": False,
+        "embedding_cache_enabled": False,
+        "idempotency_enabled": False,
+    }
+    if workload == "intercom":
+        overrides.update(
+            response_decider_cls=["IntercomResponseDecider"],
+            user_context_creator_cls=["IntercomUserContextCreator"],
+            response_actor_cls=["IntercomResponseActor"],
+            bot_intercom_id="bot",
+            intercom_token="token",
+            intercom_client_secret=INTERCOM_SECRET,
+            intercom_api_url=intercom_url,
+        )
+    return overrides
+
+
+def serve(args: argparse.Namespace, overrides: Dict[str, Any], ready) -> None:
+    """Runs the app with stub backends, in the process the parent measures"""
+    embeddings = StubEmbeddings(delay=args.embed_latency)
+    vectorstore = StubVectorStore(latency=args.vs_latency)
+    vectorstore.add(make_corpus(embeddings, args.docs))
+
+    config = stub_config(**overrides)
+    llm = StubLLM(ttft=args.ttft, tokens_per_second=args.tokens_per_second)
+    app_module = load_stub_app(
+        config, StubAssistant(config, llm, embeddings, vectorstore)
+    )
+    server = uvicorn.Server(
+        uvicorn.Config(app_module.app, port=args.port, log_level="warning")
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    ready.set()
+    threading.Event().wait()
+
+
+def load_questions() -> List[str]:
+    with open(os.path.join(TESTS_DIR, "test_questions.txt")) as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def make_requests(workload: str, count: int) -> List[Tuple[bytes, Dict[str, str]]]:
+    """The bodies and headers to send, cycling through the test questions"""
+    questions = load_questions()
+    name = "test_request_intercom" if workload == "intercom" else "test_request"
+    with open(os.path.join(TESTS_DIR, f"{name}.json")) as file:
+        template = json.load(file)
+
+    requests = []
+    for i in range(count):
+        payload = json.loads(json.dumps(template))
+        question = questions[i % len(questions)]
+        headers = {"Content-Type": "application/json"}
+        if workload == "intercom":
+            item = payload["data"]["item"]
+            item["type"] = "conversation"
+            item["id"] = f"{item['id']}-{i}"
+            for part in [item["source"]] + item["conversation_parts"][
+                "conversation_parts"
+            ]:
+                part["body"] = f"<p>{question}</p>"
+            raw = json.dumps(payload).encode("utf-8")
+            digest = hmac.new(INTERCOM_SECRET.encode("utf-8"), raw, hashlib.sha1)
+            headers["X-Hub-Signature"] = f"sha1={digest.hexdigest()}"
+        else:
+            payload["question"] = question
+            raw = json.dumps(payload).encode("utf-8")
+        requests.append((raw, headers))
+    return requests
+
+
+def read_process_stats(pid: int) -> Dict[str, float]:
+    """CPU seconds and RSS of a process, from /proc, so Linux only"""
+    with open(f"/proc/{pid}/stat") as file:
+        fields = file.read().rsplit(")", 1)[1].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    memory = {}
+    with open(f"/proc/{pid}/status") as file:
+        for line in file:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                memory[key] = int(value.split()[0]) / 1024
+    return {
+        "cpu_s": cpu_seconds,
+        "rss_mib": memory["VmRSS"],
+        "rss_peak_mib": memory["VmHWM"],
+    }
+
+
+async def run_load(
+    url: str,
+    requests: List[Tuple[bytes, Dict[str, str]]],
+    concurrency: int,
+    qps: Optional[float],
+    timeout: float,
+) -> Dict[str, Any]:
+    ttfts, totals, token_rates = [], [], []
+    errors = 0
+
+    async def one(client: httpx.AsyncClient, body: bytes, headers: Dict[str, str]):
+        nonlocal errors
+        start = time.perf_counter()
+        first_token, text = None, ""
+        try:
+            async with client.stream("POST", url, content=body, headers=headers) as r:
+                async for chunk in r.aiter_text():
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                    text += chunk
+                if r.status_code != 201 or first_token is None:
+                    errors += 1
+                    return
+        except httpx.HTTPError:
+            errors += 1
+            return
+
+        end = time.perf_counter()
+        ttfts.append(first_token - start)
+        totals.append(end - start)
+        if end > first_token:
+            token_rates.append(count_tokens(text) / (end - first_token))
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        start = time.perf_counter()
+        if qps is not None:
+            # Open loop: arrivals don't wait for earlier responses
+            tasks = []
+            for i, (body, headers) in enumerate(requests):
+                await asyncio.sleep(max(start + i / qps - time.perf_counter(), 0))
+                tasks.append(asyncio.create_task(one(client, body, headers)))
+            await asyncio.gather(*tasks)
+        else:
+            pending = iter(requests)
+
+            async def worker():
+                for body, headers in pending:
+                    await one(client, body, headers)
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+
+    return {
+        "wall_s": wall,
+        "requests_per_s": len(totals) / wall,
+        "errors": errors,
+        **quantiles("ttft", ttfts),
+        **quantiles("total", totals),
+        "tokens_per_s_p50": statistics.median(token_rates or [0.0]),
+    }
+
+
+def quantiles(name: str, values: List[float]) -> Dict[str, float]:
+    cuts = statistics.quantiles(values or [0.0, 0.0], n=100)
+    return {
+        f"{name}_p50_s": cuts[49],
+        f"{name}_p95_s": cuts[94],
+        f"{name}_p99_s": cuts[98],
+    }
+
+
+def run_workload(args: argparse.Namespace, workload: str, intercom_url: str):
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    server = context.Process(
+        target=serve,
+        args=(args, workload_config(workload, intercom_url), ready),
+        daemon=True,
+    )
+    server.start()
+    try:
+        if not ready.wait(120):
+            raise RuntimeError("The app didn't start")
+        url = f"http://127.0.0.1:{args.port}/chat"
+        requests = make_requests(workload, args.requests)
+
+        # Warm up imports, pools and caches in the server before measuring
+        warmup = requests[: args.concurrency]
+        asyncio.run(run_load(url, warmup, args.concurrency, None, args.timeout))
+        before = read_process_stats(server.pid)
+        results = asyncio.run(
+            run_load(url, requests, args.concurrency, args.qps, args.timeout)
+        )
+        after = read_process_stats(server.pid)
+    finally:
+        server.terminate()
+        server.join()
+
+    cpu_seconds = after["cpu_s"] - before["cpu_s"]
+    results["cpu_percent"] = 100 * cpu_seconds / results["wall_s"]
+    results["rss_mib"] = after["rss_mib"]
+    results["rss_peak_mib"] = after["rss_peak_mib"]
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    threshold: float,
+) -> List[str]:
+    """The metrics that are more than `threshold` worse than the baseline"""
+    regressions = []
+    for workload, metrics in results.items():
+        if metrics["errors"]:
+            regressions.append(f"{workload}: {metrics['errors']} requests failed")
+        for name, higher_is_better in BASELINE_METRICS.items():
+            expected = baseline.get(workload, {}).get(name)
+            if not expected:
+                continue
+            change = (metrics[name] - expected) / expected
+            if higher_is_better:
+                change = -change
+            if change > threshold:
+                regressions.append(
+                    f"{workload}: {name} {metrics[name]:.3f} vs {expected:.3f} "
+                    f"({change:+.0%} worse)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workload", nargs="+", default=["questions", "intercom"], choices=["questions", "intercom"])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20, help="clients, or the connection limit with --qps")
+    parser.add_argument("--qps", type=float, default=None, help="send at this rate instead of back to back")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds per request")
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--ttft", type=float, default=0.2, help="stub LLM seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="stub LLM token rate")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="stub embedding seconds per call")
+    parser.add_argument("--vs-latency", type=float, default=0.02, help="stub vector store seconds per query")
+    parser.add_argument("--intercom-latency", type=float, default=0.02, help="stub Intercom API seconds per call")
+    parser.add_argument("--port", type=int, default=5597)
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed regression, 0.25 is 25%%")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results to --baseline")
+    args = parser.parse_args()
+
+    intercom = uvicorn.Server(
+        uvicorn.Config(
+            make_stub_intercom(args.intercom_latency),
+            port=args.port + 1,
+            log_level="warning",
+        )
+    )
+    threading.Thread(target=intercom.run, daemon=True).start()
+    while not intercom.started:
+        time.sleep(0.05)
+    intercom_url = f"http://127.0.0.1:{args.port + 1}"
+
+    results = {}
+    for workload in args.workload:
+        results[workload] = run_workload(args, workload, intercom_url)
+        print(
+            f"{workload:<10} "
+            + " ".join(f"{k}={v:.3f}" for k, v in results[workload].items())
+        )
+
+    if args.baseline is None:
+        return
+    if args.update_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+            file.write("\n")
+        return
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
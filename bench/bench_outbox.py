@@ -0,0 +1,67 @@
+"""
+Measures Outbox append throughput and latency with per-entry commits against group
+commits, with `--concurrency` requests appending at once. Every commit is fsynced,
+so run it on the disk the outbox will live on.
+
+Usage:
+    PYTHONPATH=. python bench/bench_outbox.py --concurrency 1 16 64 --appends 2000
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+
+from pipeline.outbox import Outbox, OutboxEntry
+
+TEXT = "Storage-Attached Indexing lets you query any column of a table. " * 20
+
+
+async def run(sync_mode: str, concurrency: int, appends: int, parent: str) -> None:
+    with tempfile.TemporaryDirectory(dir=parent) as directory:
+        outbox = Outbox(directory, sync_mode=sync_mode)
+        latencies = []
+
+        async def client(client_id: int) -> None:
+            for i in range(appends // concurrency):
+                entry = OutboxEntry(
+                    f"{client_id}:{i}",
+                    "IntercomResponseActor",
+                    {"conversation_id": str(client_id)},
+                    TEXT,
+                    TEXT,
+                    TEXT,
+                    time.time(),
+                )
+                start = time.perf_counter()
+                await outbox.append([entry])
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client(i) for i in range(concurrency)])
+        elapsed = time.perf_counter() - start
+        outbox.close()
+
+    latencies.sort()
+    print(
+        f"sync_mode={sync_mode:<5} concurrency={concurrency:>3} "
+        f"appends/s={len(latencies) / elapsed:8.0f} "
+        f"p50={statistics.median(latencies) * 1000:7.2f}ms "
+        f"p99={latencies[int(len(latencies) * 0.99)] * 1000:7.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--appends", type=int, default=2000)
+    parser.add_argument("--directory", default=".", help="Where to put the outbox")
+    args = parser.parse_args()
+
+    for concurrency in args.concurrency:
+        for sync_mode in ["entry", "group"]:
+            asyncio.run(run(sync_mode, concurrency, args.appends, args.directory))
+
+
+if __name__ == "__main__":
+    main()
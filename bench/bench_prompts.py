@@ -0,0 +1,61 @@
+"""
+Compares the per-call cost of building the LLM prompt: loading and formatting the
+persona's YAML file on every call, as get_template used to, against the compiled
+prompts of the PromptRegistry.
+
+Usage:
+    PYTHONPATH=. python bench/bench_prompts.py --calls 2000
+"""
+import argparse
+import time
+
+from langchain.prompts import load_prompt
+
+from chatbot_api.prompt_util import get_persona_path, get_template
+
+ARGS = dict(
+    persona="default",
+    vector_search_results="- Storage-Attached Indexing lets you query any column.\n" * 4,
+    user_question="How do I create an SAI index?",
+    user_context="The user is on the free tier.",
+    company="DataStax",
+    custom_rules=["- Only answer questions about DataStax.", "- Never share secrets."],
+)
+
+
+def load_and_format(
+    persona, vector_search_results, user_question, user_context, company, custom_rules
+) -> str:
+    """The previous implementation, kept here only as the benchmark baseline"""
+    prompt = load_prompt(get_persona_path(persona))
+    return prompt.format(
+        vector_search_results=vector_search_results,
+        user_question=user_question,
+        user_context=user_context,
+        company=company,
+        custom_rules="\n".join(custom_rules),
+    )
+
+
+def run(name: str, fn, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn(**ARGS)
+    per_call = (time.perf_counter() - start) / calls
+    print(f"{name:<16} {per_call * 1e6:10.1f}us/call")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+
+    assert load_and_format(**ARGS) == get_template(**ARGS)
+    before = run("load_prompt", load_and_format, args.calls)
+    after = run("PromptRegistry", get_template, args.calls)
+    print(f"speedup          {before / after:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
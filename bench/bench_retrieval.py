@@ -0,0 +1,75 @@
+"""
+Compares the per-request cost of the retrieval step in Assistant.find_relevant_docs:
+the previous streaming query engine path, which sets up a response synthesis call to
+the LLM, against the retriever-only path.
+
+Usage:
+    PYTHONPATH=. python bench/bench_retrieval.py --requests 50 --ttft 0.5
+"""
+import argparse
+import statistics
+import time
+
+from bench.stubs import (
+    StubAssistant,
+    StubEmbeddings,
+    StubLLM,
+    StubVectorStore,
+    make_corpus,
+    stub_config,
+)
+
+
+def query_engine_docs(assistant: StubAssistant, query: str) -> str:
+    """The previous implementation, kept here only as the benchmark baseline"""
+    query_engine = assistant.index.as_query_engine(
+        similarity_top_k=assistant.retriever._similarity_top_k, streaming=True
+    )
+    results = query_engine.query(query).source_nodes
+    return "- " + "\n\n- ".join(doc.get_content() for doc in results)
+
+
+def run(name: str, fn, assistant: StubAssistant, llm: StubLLM, requests: int) -> None:
+    llm.calls, llm.prompt_tokens = 0, 0
+    timings = []
+    for i in range(requests):
+        start = time.perf_counter()
+        fn(f"How do I create an SAI index? ({i})")
+        timings.append(time.perf_counter() - start)
+
+    print(
+        f"{name:<14} "
+        f"p50={statistics.median(timings) * 1000:8.2f}ms "
+        f"mean={statistics.mean(timings) * 1000:8.2f}ms "
+        f"llm_calls/req={llm.calls / requests:.2f} "
+        f"llm_prompt_tokens/req={llm.prompt_tokens / requests:.0f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--ttft", type=float, default=0.5, help="stub LLM seconds to first token")
+    parser.add_argument("--vs-latency", type=float, default=0.02, help="stub vector store seconds per query")
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="stub embedding seconds per call")
+    args = parser.parse_args()
+
+    embeddings = StubEmbeddings()
+    vectorstore = StubVectorStore()
+    vectorstore.add(make_corpus(embeddings, args.docs))
+    vectorstore.latency = args.vs_latency
+    embeddings.delay = args.embed_latency
+
+    # Lazy providers (e.g. OpenAI) only open the request once the stream is read,
+    # eager providers (e.g. LangChain wrapped Vertex AI) pay for it immediately
+    for eager in (False, True):
+        llm = StubLLM(ttft=args.ttft, eager=eager)
+        assistant = StubAssistant(stub_config(), llm, embeddings, vectorstore)
+        print(f"# {'eager' if eager else 'lazy'} LLM stream, ttft={args.ttft}s")
+        run("query_engine", lambda q: query_engine_docs(assistant, q), assistant, llm, args.requests)
+        run("retriever", assistant.find_relevant_docs, assistant, llm, args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Measures SemanticCache lookup latency and memory footprint as the number of cached
+entries grows.
+
+Usage:
+    PYTHONPATH=. python bench/bench_semantic_cache.py --sizes 10000 100000 1000000
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from chatbot_api.cache import CachedResponse, ResponseCache, SemanticCache
+from integrations.openai import OPENAI_EMB_DIM
+
+
+def fill(cache: SemanticCache, size: int, partition: str, rng: np.random.Generator):
+    """Bulk loads random entries, add() one at a time would dominate the run time"""
+    entry = CachedResponse(["cached"], "", "", 1.0, time.time())
+    for start in range(0, size, cache.block_size):
+        end = min(start + cache.block_size, size)
+        block = rng.standard_normal((end - start, cache.dimension), dtype=np.float32)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        cache._matrix[start:end] = block
+    cache._partitions[:size] = cache._partition_id(partition)
+    cache._entries = [entry] * size
+    cache._size = size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--dim", type=int, default=OPENAI_EMB_DIM)
+    parser.add_argument("--lookups", type=int, default=20)
+    parser.add_argument("--dtypes", nargs="+", default=["float16", "float32"])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    partition = ResponseCache.make_partition_key("default", "", "v1", "gpt-4")
+
+    for size in args.sizes:
+        for dtype in args.dtypes:
+            cache = SemanticCache(args.dim, size, threshold=0.95, dtype=dtype)
+            fill(cache, size, partition, rng)
+
+            queries = rng.standard_normal((args.lookups, args.dim), dtype=np.float32)
+            timings = []
+            for query in queries:
+                start = time.perf_counter()
+                cache.search(query.tolist(), partition)
+                timings.append(time.perf_counter() - start)
+
+            print(
+                f"entries={size:>8} dim={args.dim} dtype={dtype} "
+                f"matrix={cache._matrix.nbytes / 2**20:8.1f}MiB "
+                f"p50={statistics.median(timings) * 1000:8.2f}ms "
+                f"max={max(timings) * 1000:8.2f}ms"
+            )
+            del cache
+
+
+if __name__ == "__main__":
+    main()
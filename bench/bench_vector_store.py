@@ -0,0 +1,160 @@
+"""
+Measures LocalVectorStore query latency as the corpus grows, with the time to build
+it through add() and its size on disk. Each size is built in a fresh directory,
+under --dir if given or else a temporary one.
+
+With --index ivf, each --nprobe is measured too, with its recall@k: the fraction of
+the exact top k that it finds. Embeddings are drawn around --clusters topics, as
+real ones are, since uniformly random vectors have no clusters for IVF to exploit.
+
+Usage:
+    PYTHONPATH=. python bench/bench_vector_store.py --sizes 10000 100000 1000000
+    PYTHONPATH=. python bench/bench_vector_store.py --sizes 1000000 --index ivf \\
+        --nprobe 8 32 128
+"""
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from typing import List, Tuple
+
+import numpy as np
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from chatbot_api.vector_store import LocalVectorStore
+
+
+def make_vectors(
+    count: int, centers: np.ndarray, rng: np.random.Generator
+) -> np.ndarray:
+    """Points around random topics, about as close to them as to each other"""
+    noise = rng.standard_normal((count, centers.shape[1]), dtype=np.float32)
+    noise /= np.sqrt(centers.shape[1])
+    return centers[rng.integers(len(centers), size=count)] + noise
+
+
+def build(
+    store: LocalVectorStore,
+    size: int,
+    batch_size: int,
+    centers: np.ndarray,
+    rng: np.random.Generator,
+):
+    """Adds `size` random chunks of about a paragraph each, `batch_size` at a time"""
+    text = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 16
+    for start in range(0, size, batch_size):
+        end = min(start + batch_size, size)
+        vectors = make_vectors(end - start, centers, rng)
+        nodes = [
+            TextNode(
+                id_=str(i),
+                text=text,
+                relationships={
+                    NodeRelationship.SOURCE: RelatedNodeInfo(node_id=str(i // 10))
+                },
+            )
+            for i in range(start, end)
+        ]
+        # Bypasses pydantic, whose validation of every float is slower than the store
+        for node, vector in zip(nodes, vectors):
+            object.__setattr__(node, "embedding", vector.tolist())
+        store.add(nodes)
+
+
+def disk_usage(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def index_bytes(store: LocalVectorStore) -> int:
+    """The IVF index on disk, its lists and centroids, and its rows grouped by list"""
+    return sum(
+        os.path.getsize(os.path.join(store.path, name))
+        for name in ("lists.npy", "centroids.npy", "list_rows.npy", "list_offsets.npy")
+        if os.path.exists(os.path.join(store.path, name))
+    )
+
+
+def run_queries(
+    store: LocalVectorStore, queries: np.ndarray, k: int
+) -> Tuple[List[List[str]], List[float]]:
+    results, timings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        result = store.query(
+            VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=k)
+        )
+        timings.append(time.perf_counter() - start)
+        results.append(result.ids)
+    return results, timings
+
+
+def report(label: str, timings: List[float]) -> str:
+    cuts = statistics.quantiles(timings, n=100)
+    return (
+        f"{label} p50={cuts[49] * 1000:8.2f}ms p95={cuts[94] * 1000:8.2f}ms "
+        f"qps={len(timings) / sum(timings):8.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--dir", help="where to build the stores, default /tmp")
+    parser.add_argument("--clusters", type=int, default=1000, help="embedding topics")
+    parser.add_argument("--index", choices=["flat", "ivf"], default="flat")
+    parser.add_argument("--n-lists", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[8, 32, 128])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((args.clusters, args.dim), dtype=np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    for size in args.sizes:
+        path = tempfile.mkdtemp(dir=args.dir)
+        try:
+            store = LocalVectorStore(
+                path, args.dim, dtype=args.dtype, index=args.index, n_lists=args.n_lists
+            )
+            start = time.perf_counter()
+            build(store, size, args.batch_size, centers, rng)
+            build_seconds = time.perf_counter() - start
+            print(
+                f"chunks={size:>8} dim={args.dim} dtype={args.dtype} "
+                f"disk={disk_usage(path) / 2**20:8.1f}MiB "
+                f"build={build_seconds:7.1f}s ({size / build_seconds:6.0f}/s)"
+            )
+
+            queries = make_vectors(args.queries, centers, rng)
+            exact = LocalVectorStore(path, args.dim, dtype=args.dtype)
+            expected, timings = run_queries(exact, queries, args.k)
+            print(report("  exact         ", timings))
+            if store._centroids is None:
+                continue
+
+            for nprobe in args.nprobe:
+                store.nprobe = nprobe
+                results, timings = run_queries(store, queries, args.k)
+                found = sum(
+                    len(set(ids) & set(exact_ids))
+                    for ids, exact_ids in zip(results, expected)
+                )
+                print(
+                    report(f"  ivf nprobe={nprobe:<4}", timings)
+                    + f" recall@{args.k}={found / (args.k * len(queries)):.3f} "
+                    f"index={index_bytes(store) / 2**20:.1f}MiB"
+                )
+            del store, exact
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main()
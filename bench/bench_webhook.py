@@ -0,0 +1,143 @@
+"""
+Compares the cost of verifying and deciding on an Intercom webhook: parsing the body
+with json and re-encoding it to check the signature, as validate_signature used to,
+against checking the signature on the raw bytes of a RequestBody and parsing it with
+orjson only once the decider reads it. Payloads carry long conversation_parts lists.
+
+Usage:
+    PYTHONPATH=. python bench/bench_webhook.py --parts 10 100 1000 --calls 200
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import time
+from unittest.mock import patch
+
+from bench.stubs import stub_config
+from integrations.intercom import IntercomResponseDecider, validate_signature
+from pipeline import RequestBody
+
+SECRET = "bench-secret"
+
+
+def make_payload(num_parts: int) -> bytes:
+    author = {"email": "fake.user@example.com", "id": "80be2e9f4de6", "type": "user"}
+    question = "How do I create an SAI index? " * 10
+    parts = [
+        {
+            "type": "conversation_part",
+            "id": str(1000 + i),
+            "part_type": "comment",
+            "body": f"<p>Message {i}: {question}</p>",
+            "created_at": 1700000000 + i,
+            "author": author,
+            "attachments": [],
+        }
+        for i in range(num_parts)
+    ]
+    payload = {
+        "type": "notification_event",
+        "topic": "conversation.user.replied",
+        "delivery_attempts": 1,
+        "data": {
+            "item": {
+                "type": "conversation",
+                "id": "181643600711471",
+                "source": {
+                    "author": author,
+                    "body": "This is a test question",
+                    "delivered_as": "customer_initiated",
+                    "url": "https://example.com",
+                },
+                "conversation_parts": {
+                    "type": "conversation_part.list",
+                    "conversation_parts": parts[::-1],
+                    "total_count": num_parts,
+                },
+            }
+        },
+    }
+    # Intercom's own encoding, which json.dumps doesn't reproduce byte for byte
+    return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+
+def sign(raw: bytes) -> dict:
+    digest = hmac.new(SECRET.encode("utf-8"), raw, hashlib.sha1).hexdigest()
+    return {"X-Hub-Signature": f"sha1={digest}"}
+
+
+def reencode_and_verify(raw: bytes, headers: dict) -> dict:
+    """The previous implementation, kept here only as the benchmark baseline"""
+    body = json.loads(raw.decode("utf-8"))
+    signature = headers["X-Hub-Signature"].split("=")[1]
+    local = hmac.new(SECRET.encode("utf-8"), json.dumps(body).encode("utf-8"), "sha1")
+    # Fails whenever the sender's encoding differs from json.dumps, as Intercom's does
+    hmac.compare_digest(local.hexdigest(), signature)
+    return body
+
+
+def verify_and_parse(raw: bytes, headers: dict) -> dict:
+    body = RequestBody(raw)
+    validate_signature(headers, body.raw, SECRET)
+    return body.data
+
+
+def run(name: str, fn, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    per_call = (time.perf_counter() - start) / calls
+    print(f"  {name:<28} {per_call * 1e6:10.1f}us/call")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--parts", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    config = stub_config(
+        response_decider_cls=["IntercomResponseDecider"],
+        bot_intercom_id="bot",
+        intercom_token="token",
+        intercom_client_secret=SECRET,
+    )
+    decider = IntercomResponseDecider(config)
+    bad_headers = {"X-Hub-Signature": "sha1=" + "0" * 40}
+
+    with patch.object(decider, "get_intercom_contact_by_id", return_value={}), patch(
+        "integrations.intercom.bugsnag.before_notify"
+    ):
+        for num_parts in args.parts:
+            raw = make_payload(num_parts)
+            headers = sign(raw)
+            print(f"{num_parts} parts, {len(raw) / 1024:.0f}KiB")
+
+            decision = decider.make_response_decision(RequestBody(raw), headers)
+            assert not decision.should_return_early, decision.response_dict
+
+            before = run(
+                "json + re-encode",
+                lambda: reencode_and_verify(raw, headers),
+                args.calls,
+            )
+            after = run(
+                "raw bytes + orjson", lambda: verify_and_parse(raw, headers), args.calls
+            )
+            run(
+                "raw bytes, full decision",
+                lambda: decider.make_response_decision(RequestBody(raw), headers),
+                args.calls,
+            )
+            run(
+                "raw bytes, bad signature",
+                lambda: decider.make_response_decision(RequestBody(raw), bad_headers),
+                args.calls,
+            )
+            print(f"  {'speedup':<28} {before / after:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
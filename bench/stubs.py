@@ -0,0 +1,140 @@
+"""
+Stub backends for running the assistant offline in benchmarks. Nothing here talks to
+the network: the embeddings and LLM are those of the fake llm_provider, hash-seeded
+vectors and canned tokens with configurable delays, and the vector store is an
+in-memory llama-index store with a simulated round trip.
+"""
+import time
+from types import ModuleType
+from typing import Any, List, Optional
+from unittest.mock import patch
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode, TextNode
+from llama_index.core.utils import get_tokenizer
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+from chatbot_api.assistant import Assistant, AssistantBison
+from integrations.fake import FakeEmbeddings, FakeLLM
+from integrations.openai import OPENAI_EMB_DIM
+from pipeline.config import Config
+from tests.helpers import make_config
+
+
+def count_tokens(text: str) -> int:
+    # llama-index ships the tiktoken vocabulary, so this works without network access
+    return len(get_tokenizer()(text))
+
+
+def stub_config(**overrides: Any) -> Config:
+    """The tests' Config, with the fake llm_provider and the example integrations"""
+    fields = {
+        "company": "DataStax and Cassandra",
+        "response_decider_cls": ["ExampleResponseDecider"],
+        "user_context_creator_cls": ["ExampleUserContextCreator"],
+        "response_actor_cls": ["ExampleResponseActor"],
+        "llm_provider": "fake",
+    }
+    fields.update(overrides)
+    return make_config(**fields)
+
+
+class StubEmbeddings(FakeEmbeddings):
+    """The fake provider's embeddings, at the OpenAI dimension by default"""
+
+    def __init__(self, dimension: int = OPENAI_EMB_DIM, delay: float = 0.0):
+        super().__init__(dimension, delay)
+
+
+class StubLLM(FakeLLM):
+    """The fake provider's LLM, also counting the prompt tokens it was sent"""
+
+    prompt_tokens: int = 0
+
+    def _record(self, prompt: str) -> None:
+        super()._record(prompt)
+        self.prompt_tokens += count_tokens(prompt)
+
+
+class StubVectorStore(BasePydanticVectorStore):
+    """A brute-force in-memory vector store that sleeps `latency` seconds per query"""
+
+    stores_text: bool = True
+    latency: float = 0.0
+
+    _nodes: List[BaseNode] = PrivateAttr(default_factory=list)
+    _matrix: Optional[np.ndarray] = PrivateAttr(default=None)
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    def add(self, nodes: List[BaseNode], **kwargs: Any) -> List[str]:
+        self._nodes.extend(nodes)
+        self._matrix = np.array([node.get_embedding() for node in self._nodes])
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        self._nodes = [node for node in self._nodes if node.ref_doc_id != ref_doc_id]
+        self._matrix = np.array([node.get_embedding() for node in self._nodes])
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        time.sleep(self.latency)
+        scores = self._matrix @ np.array(query.query_embedding)
+        top = np.argsort(-scores)[: query.similarity_top_k]
+        return VectorStoreQueryResult(
+            nodes=[self._nodes[i] for i in top],
+            similarities=[float(scores[i]) for i in top],
+            ids=[self._nodes[i].node_id for i in top],
+        )
+
+
+def make_corpus(embeddings: Embeddings, num_docs: int = 200) -> List[TextNode]:
+    """Builds embedded nodes that look roughly like the scraped documentation chunks"""
+    nodes = []
+    for i in range(num_docs):
+        text = (
+            f"Document {i}. Storage-Attached Indexing (SAI) section {i % 17}. "
+            + "Cassandra tables are partitioned by their primary key. " * 20
+        )
+        nodes.append(
+            TextNode(
+                text=text,
+                metadata={"source": f"https://docs.example.com/page-{i % 40}.html"},
+                embedding=embeddings.embed_query(text),
+            )
+        )
+    return nodes
+
+
+class StubAssistant(AssistantBison):
+    """AssistantBison wired to whatever stub backends are passed in"""
+
+    def __init__(
+        self,
+        config: Config,
+        llm: StubLLM,
+        embeddings: Embeddings,
+        vectorstore: Optional[StubVectorStore] = None,
+        k: int = 4,
+    ):
+        Assistant.__init__(self, config, embeddings, k, llm, vectorstore=vectorstore)
+
+        self.company = config.company
+        self.custom_rules = config.custom_rules or []
+
+
+def load_stub_app(config: Config, assistant: Assistant) -> ModuleType:
+    """Imports app.py with the given config and assistant in place of the real ones"""
+    with patch("pipeline.config.load_config", return_value=config), patch(
+        "chatbot_api.assistant.AssistantBison", return_value=assistant
+    ):
+        import app
+
+    return app
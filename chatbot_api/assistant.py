@@ -1,5 +1,9 @@
+import asyncio
+import contextvars
+import time
 from abc import ABC, abstractmethod
-from typing import List, Optional, Tuple
+from dataclasses import dataclass
+from typing import Awaitable, List, Optional, Tuple
 from langchain_community.embeddings import OpenAIEmbeddings, VertexAIEmbeddings
 from langchain.embeddings.base import Embeddings
 #from langchain.embeddings import OpenAIEmbeddings, VertexAIEmbeddings
@@ -10,13 +14,57 @@ from llama_index.core import ServiceContext
 from llama_index.vector_stores.astra_db import AstraDBVectorStore
 from llama_index.embeddings.langchain import LangchainEmbedding
 from llama_index.llms.openai import OpenAI
-from llama_index.core.base.response.schema import StreamingResponse
+from llama_index.core.llms import ChatMessage
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.types import BasePydanticVectorStore
 
-from chatbot_api.prompt_util import get_template
+from chatbot_api.cache import (
+    CachedResponse,
+    CacheLookup,
+    ResponseCache,
+    create_response_cache,
+    create_semantic_cache,
+)
+from chatbot_api.context_packer import ContextPacker
+from chatbot_api.embedding_cache import create_cached_embeddings
+from chatbot_api.lexical_index import (
+    create_lexical_index,
+    lexical_executor,
+    reciprocal_rank_fusion,
+)
+from chatbot_api.prompt_util import (
+    get_prompt_registry,
+    get_template,
+    get_template_version,
+)
+from chatbot_api.sessions import create_session_store
+from chatbot_api.streaming import (
+    ChatResponse,
+    RecordingChatResponse,
+    ReplayedChatResponse,
+    TimedChatResponse,
+)
+from chatbot_api.vector_store import (
+    CollectionVersions,
+    LocalVectorStore,
+    create_vector_store,
+)
+from integrations.fake import FakeEmbeddings, FakeLLM
 from integrations.google import GECKO_EMB_DIM, init_gcp
 from integrations.openai import OPENAI_EMB_DIM
 from pipeline.config import Config, LLMProvider
+from pipeline.metrics import time_stage
+from pipeline.tracing import span
 from llama_index.core.chat_engine import SimpleChatEngine
+from llama_index.core.chat_engine.types import StreamingAgentChatResponse
+
+
+@dataclass
+class Retrieval:
+    """A question's embedding and the nodes the vector search found with it"""
+
+    embedding: List[float]
+    results: List[NodeWithScore]
 
 
 class Assistant(ABC):
@@ -26,23 +74,19 @@ class Assistant(ABC):
         embeddings: Embeddings,
         k: int = 4,
         llm=None,
+        vectorstore: Optional[BasePydanticVectorStore] = None,
     ):
         self.config = config
-        self.embedding_model = LangchainEmbedding(embeddings)
+        self.embedding_model = LangchainEmbedding(
+            create_cached_embeddings(config, embeddings, self.embeddings_model_name)
+        )
         self.llm = llm
 
-        embedding_dimension = (
-            OPENAI_EMB_DIM
-            if self.config.llm_provider == LLMProvider.OpenAI
-            else GECKO_EMB_DIM
-        )
+        embedding_dimension = self.embedding_dimension
 
         # Initialize the vector store, which contains the vector embeddings of the data
-        self.vectorstore = AstraDBVectorStore(
-            token=self.config.astra_db_application_token,
-            api_endpoint=self.config.astra_db_api_endpoint,
-            collection_name=self.config.astra_db_table_name,
-            embedding_dimension=embedding_dimension,
+        self.vectorstore = vectorstore or create_vector_store(
+            config, embedding_dimension
         )
 
         self.service_context = ServiceContext.from_defaults(
@@ -59,34 +103,291 @@ class Assistant(ABC):
 
         )
 
-        self.query_engine = self.index.as_query_engine(
-            similarity_top_k=k, streaming=True
+        # Retrieval only, the answer itself is generated by the chat engine below. For
+        # hybrid search, both searches return more candidates, fused down to k
+        self.k = k
+        self.lexical_index = create_lexical_index(config)
+        if self.lexical_index is not None:
+            k = max(k, config.hybrid_candidates)
+        self.retriever = self.index.as_retriever(similarity_top_k=k)
+        self.context_packer = ContextPacker(
+            config.context_token_budget, config.context_dedupe_threshold
+        )
+
+        # Chat history is kept per conversation, a chat engine is created per request
+        self.session_store = create_session_store(config)
+
+        # Parse the persona prompts now rather than on the first request
+        get_prompt_registry()
+
+        # Caches of complete answers, each None if disabled in config
+        self.collection_versions = None
+        if config.semantic_cache_enabled and isinstance(
+            self.vectorstore, AstraDBVectorStore
+        ):
+            self.collection_versions = CollectionVersions(config)
+        self.response_cache = create_response_cache(config)
+        self.semantic_cache = create_semantic_cache(
+            config, embedding_dimension, self.get_collection_version
         )
 
-        self.chat_engine = SimpleChatEngine.from_defaults(service_context=self.service_context)
-        #self.chat_engine = SimpleChatEngine.from_defaults(settings=self.settings)
+    @property
+    def model_name(self) -> str:
+        if self.config.llm_provider == LLMProvider.Google:
+            return self.config.google_textgen_model
+        if self.config.llm_provider == LLMProvider.Fake:
+            return "fake"
+        return self.config.openai_textgen_model
+
+    @property
+    def embeddings_model_name(self) -> str:
+        if self.config.llm_provider == LLMProvider.Google:
+            return self.config.google_embeddings_model
+        if self.config.llm_provider == LLMProvider.Fake:
+            return f"fake-{self.config.fake_embeddings_dimension}"
+        return self.config.openai_embeddings_model
+
+    @property
+    def embedding_dimension(self) -> int:
+        if self.config.llm_provider == LLMProvider.Google:
+            return GECKO_EMB_DIM
+        if self.config.llm_provider == LLMProvider.Fake:
+            return self.config.fake_embeddings_dimension
+        return OPENAI_EMB_DIM
+
+    @property
+    def llm_provider(self) -> str:
+        return self.config.llm_provider.value
+
+    def embed_query(self, query: str) -> List[float]:
+        with time_stage("embedding", self.llm_provider), span("assistant.embedding"):
+            return self.embedding_model.get_query_embedding(query)
+
+    async def aembed_query(self, query: str) -> List[float]:
+        with time_stage("embedding", self.llm_provider), span("assistant.embedding"):
+            return await self.embedding_model.aget_query_embedding(query)
+
+    # Changes whenever documents are ingested into or removed from the collection
+    def get_collection_version(self) -> str:
+        collection_name = self.config.astra_db_table_name
+        if self.collection_versions is not None:
+            return f"{collection_name}:{self.collection_versions.get(collection_name)}"
+        if isinstance(self.vectorstore, LocalVectorStore):
+            return f"{collection_name}:{self.vectorstore.version}"
+        return collection_name
+
+    def vector_search(
+        self, query: str, embedding: Optional[List[float]] = None
+    ) -> List[NodeWithScore]:
+        with time_stage("vector_search", self.llm_provider), span(
+            "assistant.vector_search"
+        ):
+            return self.retriever.retrieve(QueryBundle(query, embedding=embedding))
+
+    def lexical_search(self, query: str) -> List[NodeWithScore]:
+        with time_stage("lexical_search", self.llm_provider), span(
+            "assistant.lexical_search"
+        ):
+            return self.lexical_index.search(query, self.config.hybrid_candidates)
+
+    def start_lexical_search(
+        self, query: str
+    ) -> Optional["asyncio.Future[List[NodeWithScore]]"]:
+        """Starts the lexical search, which doesn't need the embedding, if enabled"""
+        if self.lexical_index is None:
+            return None
+        return asyncio.get_running_loop().run_in_executor(
+            lexical_executor, contextvars.copy_context().run, self.lexical_search, query
+        )
+
+    def fuse(
+        self, vector_results: List[NodeWithScore], lexical_results: List[NodeWithScore]
+    ) -> List[NodeWithScore]:
+        return reciprocal_rank_fusion(
+            [vector_results, lexical_results], self.k, self.config.hybrid_rrf_k
+        )
+
+    # Get the top k scored nodes from the vector store, and the lexical index for
+    # hybrid search, without involving the LLM
+    def retrieve(
+        self, query: str, embedding: Optional[List[float]] = None
+    ) -> List[NodeWithScore]:
+        if self.lexical_index is None:
+            return self.vector_search(query, embedding)
+        lexical_results = lexical_executor.submit(
+            contextvars.copy_context().run, self.lexical_search, query
+        )
+        return self.fuse(self.vector_search(query, embedding), lexical_results.result())
+
+    async def aretrieve(
+        self,
+        query: str,
+        embedding: Optional[List[float]] = None,
+        lexical_results: Optional[Awaitable[List[NodeWithScore]]] = None,
+    ) -> List[NodeWithScore]:
+        """`lexical_results` is the result of start_lexical_search(query), if started"""
+        async def vector_search() -> List[NodeWithScore]:
+            nonlocal embedding
+            if embedding is None:
+                embedding = await self.aembed_query(query)
+            # The vector store query has no native async version, keep it off the
+            # event loop
+            return await asyncio.to_thread(self.vector_search, query, embedding)
+
+        if lexical_results is None:
+            lexical_results = self.start_lexical_search(query)
+        if lexical_results is None:
+            return await vector_search()
+        vector_results = await vector_search()
+        return self.fuse(vector_results, await lexical_results)
+
+    # Embed the question and search the vector store, which doesn't need the prompt
+    async def aprefetch(self, query: str) -> Retrieval:
+        with span("assistant.retrieval"):
+            # The lexical search doesn't wait for the embedding
+            lexical_results = self.start_lexical_search(query)
+            embedding = await self.aembed_query(query)
+            return Retrieval(
+                embedding, await self.aretrieve(query, embedding, lexical_results)
+            )
 
     # Get a response from the vector search, aka the relevant data
-    def find_relevant_docs(self, query: str) -> str:
-        response = self.query_engine.query(
-            query
-        )  # TODO: Retriever (index.as_retriever (returns list of source nodes instead of response object))
-        results = response.source_nodes
-
-        raw_text = []
-        for doc in results:
-            try:
-                raw_text.append(
-                    doc.get_content()
-                    + f"\nPrevious document was from URL link: {doc.metadata['source']}"
-                )
-            except KeyError:
-                raw_text.append(doc.get_content())
-        vector_search_results = "- " + "\n\n- ".join(
-            raw_text
-        )  # Prevent any one document from being too long
+    def find_relevant_docs(
+        self, query: str, embedding: Optional[List[float]] = None
+    ) -> str:
+        return self.format_docs(self.retrieve(query, embedding))
+
+    async def afind_relevant_docs(
+        self,
+        query: str,
+        embedding: Optional[List[float]] = None,
+        lexical_results: Optional[Awaitable[List[NodeWithScore]]] = None,
+    ) -> str:
+        return self.format_docs(
+            await self.aretrieve(query, embedding, lexical_results)
+        )
+
+    # Pack the retrieved nodes into the context section of the prompt
+    def format_docs(self, results: List[NodeWithScore]) -> str:
+        return self.context_packer.pack(results).text
+
+    # Get a chat engine primed with the history of a conversation
+    def get_chat_engine(
+        self, chat_history: Optional[List[ChatMessage]] = None
+    ) -> SimpleChatEngine:
+        return SimpleChatEngine.from_defaults(
+            service_context=self.service_context, chat_history=chat_history
+        )
+
+    def get_cache_lookup(
+        self,
+        user_input: str,
+        persona: str,
+        user_context: str,
+        include_context: bool,
+        chat_history: List[ChatMessage],
+    ) -> Optional[CacheLookup]:
+        # Follow up questions depend on the conversation so far, don't cache those
+        if chat_history or (self.response_cache is None and self.semantic_cache is None):
+            return None
+
+        template_version = get_template_version(persona) if include_context else ""
+        return CacheLookup(
+            key=ResponseCache.make_key(
+                user_input, persona, user_context, template_version, self.model_name
+            ),
+            partition=ResponseCache.make_partition_key(
+                persona, user_context, template_version, self.model_name
+            ),
+        )
+
+    # Replay a previous answer to the same question, if there is one
+    def get_cached_response(
+        self, lookup: Optional[CacheLookup]
+    ) -> Optional[Tuple[ReplayedChatResponse, str, str]]:
+        if lookup is None or self.response_cache is None:
+            return None
+
+        return self._replay(self.response_cache.get(lookup.key))
+
+    async def aget_cached_response(
+        self, lookup: Optional[CacheLookup]
+    ) -> Optional[Tuple[ReplayedChatResponse, str, str]]:
+        # A persisted cache reads, and deletes expired entries, in SQLite
+        return await asyncio.to_thread(self.get_cached_response, lookup)
+
+    # Replay a previous answer to a similar question, needs lookup.embedding set
+    def get_semantic_cached_response(
+        self, lookup: Optional[CacheLookup]
+    ) -> Optional[Tuple[ReplayedChatResponse, str, str]]:
+        if lookup is None or self.semantic_cache is None:
+            return None
+
+        return self._replay(
+            self.semantic_cache.search(lookup.embedding, lookup.partition)
+        )
+
+    async def aget_semantic_cached_response(
+        self, lookup: Optional[CacheLookup]
+    ) -> Optional[Tuple[ReplayedChatResponse, str, str]]:
+        # The search is a matmul over every entry, and may check the collection
+        # version with a database call, keep both off the event loop
+        return await asyncio.to_thread(self.get_semantic_cached_response, lookup)
+
+    @staticmethod
+    def _replay(
+        cached: Optional[CachedResponse],
+    ) -> Optional[Tuple[ReplayedChatResponse, str, str]]:
+        if cached is None:
+            return None
+
+        return (
+            ReplayedChatResponse(cached.tokens),
+            cached.responses_from_vs,
+            cached.context,
+        )
+
+    # Store the answer in the response caches once it has been fully streamed
+    def record_response(
+        self,
+        bot_response: StreamingAgentChatResponse,
+        lookup: Optional[CacheLookup],
+        responses_from_vs: str,
+        context: str,
+        start_time: float,
+    ) -> ChatResponse:
+        if lookup is None:
+            return bot_response
+
+        def on_complete(tokens: List[str]) -> None:
+            if not tokens:
+                return
 
-        return vector_search_results
+            entry = CachedResponse(
+                tokens=tokens,
+                responses_from_vs=responses_from_vs,
+                context=context,
+                generation_seconds=time.perf_counter() - start_time,
+                created_at=time.time(),
+            )
+            if self.response_cache is not None:
+                self.response_cache.put(lookup.key, entry)
+            if self.semantic_cache is not None and lookup.embedding is not None:
+                self.semantic_cache.add(lookup.embedding, lookup.partition, entry)
+
+        return RecordingChatResponse(bot_response, on_complete)
+
+    # Record a completed question/answer pair in the conversation history
+    def save_turn(
+        self, session_id: Optional[str], user_input: str, text_response: str
+    ) -> None:
+        self.session_store.append_turn(session_id, user_input, text_response)
+
+    async def asave_turn(
+        self, session_id: Optional[str], user_input: str, text_response: str
+    ) -> None:
+        # Session backends may do blocking I/O (SQLite, Astra)
+        await asyncio.to_thread(self.save_turn, session_id, user_input, text_response)
 
     # Get a response from the chatbot, excluding the responses from the vector search
     @abstractmethod
@@ -96,12 +397,28 @@ class Assistant(ABC):
         persona: str,
         user_context: str = "",
         include_context: bool = True,
+        session_id: Optional[str] = None,
     ) -> Tuple[str, str, str]:
         """
         :returns: Should return a tuple of
                   (bot response, vector store responses string, user context)
         """
 
+    @abstractmethod
+    async def aget_response(
+        self,
+        user_input: str,
+        persona: str,
+        user_context: str = "",
+        include_context: bool = True,
+        session_id: Optional[str] = None,
+        retrieval: Optional[Awaitable[Retrieval]] = None,
+    ) -> Tuple[ChatResponse, str, str]:
+        """
+        The async version of get_response, streaming with astream_chat. `retrieval`
+        is the result of aprefetch(user_input), if the caller already started it.
+        """
+
 
 class AssistantBison(Assistant):
     # Instantiate the class using the default bison model
@@ -124,8 +441,17 @@ class AssistantBison(Assistant):
             embeddings = VertexAIEmbeddings(model_name=config.google_embeddings_model)
             llm = VertexAI(model_name=config.google_textgen_model)
 
+        elif config.llm_provider == LLMProvider.Fake:
+            embeddings = FakeEmbeddings(
+                config.fake_embeddings_dimension, config.fake_embeddings_delay_seconds
+            )
+            llm = FakeLLM(
+                ttft=config.fake_ttft_seconds,
+                tokens_per_second=config.fake_tokens_per_second,
+            )
+
         else:
-            raise AssertionError("LLM Provider must be one of openai or google")
+            raise AssertionError("LLM Provider must be one of openai, google or fake")
 
         super().__init__(config, embeddings, k, llm)
 
@@ -143,8 +469,109 @@ class AssistantBison(Assistant):
         persona: str,
         user_context: str = "",
         include_context: bool = True,
-    ) -> Tuple[StreamingResponse, str, str]:
-        responses_from_vs = self.find_relevant_docs(query=user_input)
+        session_id: Optional[str] = None,
+    ) -> Tuple[ChatResponse, str, str]:
+        chat_history = self.session_store.get_history(session_id)
+        lookup = self.get_cache_lookup(
+            user_input, persona, user_context, include_context, chat_history
+        )
+        cached_response = self.get_cached_response(lookup)
+        if cached_response is not None:
+            return cached_response
+
+        # Embed once, for both the semantic cache and the vector search
+        start_time = time.perf_counter()
+        embedding = self.embed_query(user_input)
+        if lookup is not None:
+            lookup.embedding = embedding
+        cached_response = self.get_semantic_cached_response(lookup)
+        if cached_response is not None:
+            return cached_response
+
+        responses_from_vs = self.find_relevant_docs(user_input, embedding)
+        responses_from_vs, context = self.build_prompt(
+            user_input, persona, user_context, include_context, responses_from_vs
+        )
+
+        llm_start_time = time.perf_counter()
+        bot_response = self.get_chat_engine(chat_history).stream_chat(context)
+        bot_response = TimedChatResponse(
+            bot_response, llm_start_time, self.llm_provider
+        )
+        bot_response = self.record_response(
+            bot_response, lookup, responses_from_vs, context, start_time
+        )
+
+        return bot_response, responses_from_vs, context
+
+    async def aget_response(
+        self,
+        user_input: str,
+        persona: str,
+        user_context: str = "",
+        include_context: bool = True,
+        session_id: Optional[str] = None,
+        retrieval: Optional[Awaitable[Retrieval]] = None,
+    ) -> Tuple[ChatResponse, str, str]:
+        # Session backends may do blocking I/O (SQLite, Astra)
+        chat_history = await asyncio.to_thread(
+            self.session_store.get_history, session_id
+        )
+        lookup = self.get_cache_lookup(
+            user_input, persona, user_context, include_context, chat_history
+        )
+        cached_response = await self.aget_cached_response(lookup)
+        if cached_response is not None:
+            return cached_response
+
+        # Embed once, for both the semantic cache and the vector search
+        start_time = time.perf_counter()
+        prefetched = await retrieval if retrieval is not None else None
+        lexical_results = None
+        if prefetched is not None:
+            embedding = prefetched.embedding
+        else:
+            # The lexical search doesn't wait for the embedding
+            lexical_results = self.start_lexical_search(user_input)
+            embedding = await self.aembed_query(user_input)
+        if lookup is not None:
+            lookup.embedding = embedding
+        cached_response = await self.aget_semantic_cached_response(lookup)
+        if cached_response is not None:
+            return cached_response
+
+        if prefetched is not None:
+            responses_from_vs = self.format_docs(prefetched.results)
+        else:
+            responses_from_vs = await self.afind_relevant_docs(
+                user_input, embedding, lexical_results
+            )
+        responses_from_vs, context = self.build_prompt(
+            user_input, persona, user_context, include_context, responses_from_vs
+        )
+
+        llm_start_time = time.perf_counter()
+        bot_response = await self.get_chat_engine(chat_history).astream_chat(context)
+        bot_response = TimedChatResponse(
+            bot_response, llm_start_time, self.llm_provider
+        )
+        bot_response = self.record_response(
+            bot_response, lookup, responses_from_vs, context, start_time
+        )
+
+        return bot_response, responses_from_vs, context
+
+    def build_prompt(
+        self,
+        user_input: str,
+        persona: str,
+        user_context: str,
+        include_context: bool,
+        responses_from_vs: str,
+    ) -> Tuple[str, str]:
+        """
+        :returns: A tuple of (vector store responses string, prompt for the LLM)
+        """
         # Ensure that we include the prompt context assuming the parameter is provided
         context = user_input
         if include_context:
@@ -152,15 +579,14 @@ class AssistantBison(Assistant):
             if "[NO CONTEXT]" in user_input:
                 responses_from_vs = ""
 
-            context = get_template(
-                persona,
-                responses_from_vs,
-                user_input,
-                user_context,
-                self.company,
-                self.custom_rules,
-            )
-
-        bot_response = self.chat_engine.stream_chat(context)
+            with time_stage("prompt", self.llm_provider), span("assistant.prompt"):
+                context = get_template(
+                    persona,
+                    responses_from_vs,
+                    user_input,
+                    user_context,
+                    self.company,
+                    self.custom_rules,
+                )
 
-        return bot_response, responses_from_vs, context
+        return responses_from_vs, context
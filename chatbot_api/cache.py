@@ -0,0 +1,326 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from pipeline.config import Config
+from pipeline.metrics import Counter, Gauge, Histogram
+
+RESPONSE_CACHE_REQUESTS = Counter(
+    "chatbot_response_cache_requests_total",
+    "Lookups in the exact-match response cache",
+    ["result"],
+)
+RESPONSE_CACHE_SAVED_SECONDS = Counter(
+    "chatbot_response_cache_saved_seconds_total",
+    "Generation time of the original responses that were served from the cache",
+)
+RESPONSE_CACHE_ENTRIES = Gauge(
+    "chatbot_response_cache_entries", "Entries held in the response cache"
+)
+RESPONSE_CACHE_HIT_RATIO = Gauge(
+    "chatbot_response_cache_hit_ratio", "Hits over lookups in the response cache"
+)
+
+SEMANTIC_CACHE_REQUESTS = Counter(
+    "chatbot_semantic_cache_requests_total",
+    "Lookups in the semantic response cache",
+    ["result"],
+)
+SEMANTIC_CACHE_LOOKUP_SECONDS = Histogram(
+    "chatbot_semantic_cache_lookup_seconds",
+    "Time to search the semantic cache for a similar question",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+SEMANTIC_CACHE_ENTRIES = Gauge(
+    "chatbot_semantic_cache_entries", "Entries held in the semantic cache"
+)
+
+
+def normalize_question(question: str) -> str:
+    """Case, whitespace and trailing punctuation don't change the answer"""
+    return re.sub(r"\s+", " ", question).strip().lower().rstrip("?!. ")
+
+
+@dataclass
+class CachedResponse:
+    tokens: List[str]
+    responses_from_vs: str
+    context: str
+    generation_seconds: float
+    created_at: float
+
+
+@dataclass
+class CacheLookup:
+    """Where a request's answer lives in the response caches"""
+
+    key: str  # Exact-match key, see ResponseCache.make_key
+    partition: str  # See ResponseCache.make_partition_key
+    embedding: Optional[List[float]] = None  # Question embedding, for SemanticCache
+
+
+class ResponseCache:
+    """
+    An exact-match cache of complete bot responses with LRU and TTL eviction. If a
+    path is given, entries are also written to a SQLite file and reloaded on startup.
+    """
+
+    def __init__(
+        self, max_entries: int, ttl_seconds: float, path: Optional[str] = None
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._conn = None
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache "
+                "(key TEXT PRIMARY KEY, entry TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._load()
+
+        RESPONSE_CACHE_ENTRIES.set_function(lambda: len(self._entries))
+        RESPONSE_CACHE_HIT_RATIO.set_function(self.hit_ratio)
+
+    @staticmethod
+    def make_partition_key(
+        persona: str, user_context: str, template_version: str, model: str
+    ) -> str:
+        """Everything but the question that determines the answer"""
+        user_context_hash = hashlib.sha256(user_context.encode("utf-8")).hexdigest()
+        key_parts = [persona, user_context_hash, template_version, model]
+        return hashlib.sha256(json.dumps(key_parts).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def make_key(
+        question: str,
+        persona: str,
+        user_context: str,
+        template_version: str,
+        model: str,
+    ) -> str:
+        key_parts = [
+            normalize_question(question),
+            ResponseCache.make_partition_key(
+                persona, user_context, template_version, model
+            ),
+        ]
+        return hashlib.sha256(json.dumps(key_parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry.created_at > self.ttl_seconds:
+                self._delete(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                RESPONSE_CACHE_REQUESTS.inc(result="miss")
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        RESPONSE_CACHE_REQUESTS.inc(result="hit")
+        RESPONSE_CACHE_SAVED_SECONDS.inc(entry.generation_seconds)
+        return entry
+
+    def put(self, key: str, entry: CachedResponse) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?)",
+                        (key, json.dumps(asdict(entry)), entry.created_at),
+                    )
+
+            while len(self._entries) > self.max_entries:
+                self._delete(next(iter(self._entries)))
+
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def _delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+        if self._conn is not None:
+            with self._conn:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+
+    def _load(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM response_cache WHERE created_at < ? OR key NOT IN "
+                "(SELECT key FROM response_cache ORDER BY created_at DESC LIMIT ?)",
+                (cutoff, self.max_entries),
+            )
+        rows = self._conn.execute(
+            "SELECT key, entry FROM response_cache ORDER BY created_at"
+        ).fetchall()
+        for key, entry in rows:
+            self._entries[key] = CachedResponse(**json.loads(entry))
+
+
+class SemanticCache:
+    """
+    Serves the answer to a previous question whose embedding is within `threshold`
+    cosine similarity of the new one. Embeddings are kept normalized in one matrix,
+    float16 by default to halve the footprint, searched with one matmul per block of
+    rows, and evicted least recently used first. Only entries from the same partition
+    (see ResponseCache.make_partition_key) can match. The cache is cleared whenever
+    `version_fn` reports a new version of the underlying document collection, which
+    is checked at most every `version_check_seconds`.
+    """
+
+    block_size = 16384
+
+    def __init__(
+        self,
+        dimension: int,
+        max_entries: int,
+        threshold: float,
+        version_fn: Optional[Callable[[], str]] = None,
+        version_check_seconds: float = 60.0,
+        dtype: str = "float16",
+    ):
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.version_fn = version_fn
+        self.version_check_seconds = version_check_seconds
+
+        self._matrix = np.zeros((max_entries, dimension), dtype=dtype)
+        # float16 has no BLAS matmul, blocks are converted into this buffer first
+        self._buffer = np.zeros((self.block_size, dimension), dtype=np.float32)
+        self._partitions = np.zeros(max_entries, dtype=np.int64)
+        self._last_used = np.zeros(max_entries, dtype=np.int64)
+        self._entries: List[Optional[CachedResponse]] = [None] * max_entries
+        self._size = 0
+        self._clock = 0
+        self._version: Optional[str] = None
+        self._version_checked_at = 0.0
+        self._lock = threading.Lock()
+
+        SEMANTIC_CACHE_ENTRIES.set_function(lambda: self._size)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def _partition_id(partition: str) -> int:
+        return int(partition[:15], 16)
+
+    def _normalize(self, embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _check_version(self) -> None:
+        now = time.time()
+        if self.version_fn is None:
+            return
+        if now - self._version_checked_at < self.version_check_seconds:
+            return
+
+        self._version_checked_at = now
+        version = self.version_fn()
+        if version != self._version:
+            self._version = version
+            self.clear()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = [None] * self.max_entries
+            self._last_used[:] = 0
+            self._size = 0
+
+    def search(self, embedding: List[float], partition: str) -> Optional[CachedResponse]:
+        """Returns the most similar entry above the threshold, if any"""
+        start_time = time.perf_counter()
+        self._check_version()
+        query = self._normalize(embedding)
+        partition_id = self._partition_id(partition)
+
+        with self._lock:
+            best_slot, best_score = -1, -np.inf
+            for start in range(0, self._size, self.block_size):
+                end = min(start + self.block_size, self._size)
+                block = self._matrix[start:end]
+                if block.dtype != np.float32:
+                    np.copyto(self._buffer[: end - start], block)
+                    block = self._buffer[: end - start]
+                scores = block @ query
+                scores[self._partitions[start:end] != partition_id] = -np.inf
+                slot = int(np.argmax(scores))
+                if scores[slot] > best_score:
+                    best_slot, best_score = start + slot, scores[slot]
+
+            entry = None
+            if best_score >= self.threshold:
+                self._clock += 1
+                self._last_used[best_slot] = self._clock
+                entry = self._entries[best_slot]
+
+        SEMANTIC_CACHE_LOOKUP_SECONDS.observe(time.perf_counter() - start_time)
+        SEMANTIC_CACHE_REQUESTS.inc(result="hit" if entry is not None else "miss")
+        return entry
+
+    def add(self, embedding: List[float], partition: str, entry: CachedResponse) -> None:
+        self._check_version()
+        with self._lock:
+            if self._size < self.max_entries:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+
+            self._clock += 1
+            self._matrix[slot] = self._normalize(embedding)
+            self._partitions[slot] = self._partition_id(partition)
+            self._last_used[slot] = self._clock
+            self._entries[slot] = entry
+
+
+def create_response_cache(config: Config) -> Optional[ResponseCache]:
+    """Build the ResponseCache configured for the app, or None if it's disabled"""
+    if not config.response_cache_enabled:
+        return None
+
+    return ResponseCache(
+        max_entries=config.response_cache_max_entries,
+        ttl_seconds=config.response_cache_ttl_seconds,
+        path=config.response_cache_path,
+    )
+
+
+def create_semantic_cache(
+    config: Config, dimension: int, version_fn: Optional[Callable[[], str]] = None
+) -> Optional[SemanticCache]:
+    """Build the SemanticCache configured for the app, or None if it's disabled"""
+    if not config.semantic_cache_enabled:
+        return None
+
+    return SemanticCache(
+        dimension=dimension,
+        max_entries=config.semantic_cache_max_entries,
+        threshold=config.semantic_cache_threshold,
+        version_fn=version_fn,
+        version_check_seconds=config.semantic_cache_version_check_seconds,
+        dtype=config.semantic_cache_dtype,
+    )
@@ -0,0 +1,159 @@
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, List, Optional
+
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.utils import get_tokenizer
+
+from pipeline.metrics import Histogram
+from pipeline.tokens import truncate_tokens
+
+CONTEXT_TOKENS = Histogram(
+    "chatbot_context_tokens",
+    "Tokens of retrieved documents per request, as retrieved and after packing",
+    ["stage"],
+    buckets=(100, 250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 16000),
+)
+
+SOURCE_TEMPLATE = "\nPrevious document was from URL link: {source}"
+
+
+@dataclass
+class PackedContext:
+    text: str
+    tokens_before: int  # Tokens of every retrieved node joined as is
+    tokens_after: int
+    nodes_before: int
+    nodes_after: int  # Nodes that made it into text, in full or truncated
+
+
+@dataclass
+class _Chunk:
+    text: str
+    source: Optional[str]
+    start: Optional[int]
+    end: Optional[int]
+
+
+def _shingles(text: str, size: int = 3) -> FrozenSet[str]:
+    words = re.findall(r"\w+", text.lower())
+    return frozenset(
+        " ".join(words[i : i + size]) for i in range(max(len(words) - size + 1, 1))
+    )
+
+
+def _similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class ContextPacker:
+    """
+    Fits the retrieved nodes into at most `token_budget` tokens of prompt, keeping the
+    best scored first. Nodes whose word shingles overlap a better scored node's by
+    `dedupe_threshold` or more are dropped, and nodes from the same source are merged
+    into one entry in document order, without the overlap between adjacent chunks.
+    """
+
+    def __init__(
+        self,
+        token_budget: Optional[int],
+        dedupe_threshold: float = 0.9,
+        tokenizer: Optional[Callable[[str], List[Any]]] = None,
+    ):
+        self.token_budget = token_budget
+        self.dedupe_threshold = dedupe_threshold
+        self.tokenizer = tokenizer or get_tokenizer()
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer(text))
+
+    @staticmethod
+    def join(entries: List[str]) -> str:
+        return "- " + "\n\n- ".join(entries)
+
+    @staticmethod
+    def format_node(doc: NodeWithScore) -> str:
+        source = doc.metadata.get("source")
+        if source is None:
+            return doc.get_content()
+        return doc.get_content() + SOURCE_TEMPLATE.format(source=source)
+
+    def _dedupe(self, results: List[NodeWithScore]) -> List[NodeWithScore]:
+        kept, kept_shingles = [], []
+        for doc in results:
+            shingles = _shingles(doc.get_content())
+            if any(
+                _similarity(shingles, other) >= self.dedupe_threshold
+                for other in kept_shingles
+            ):
+                continue
+            kept.append(doc)
+            kept_shingles.append(shingles)
+        return kept
+
+    @staticmethod
+    def _merge(chunks: List[_Chunk]) -> str:
+        """Joins chunks of one source, in document order when their offsets are known"""
+        if all(chunk.start is not None for chunk in chunks):
+            chunks = sorted(chunks, key=lambda chunk: chunk.start)
+
+        text, end = chunks[0].text, chunks[0].end
+        for chunk in chunks[1:]:
+            if end is not None and chunk.start is not None and chunk.start <= end:
+                # Adjacent chunks share the node parser's chunk_overlap, keep it once
+                text += chunk.text[end - chunk.start :]
+            else:
+                text += "\n...\n" + chunk.text
+            if chunk.end is not None:
+                end = max(end or 0, chunk.end)
+        return text
+
+    def pack(self, results: List[NodeWithScore]) -> PackedContext:
+        results = sorted(results, key=lambda doc: doc.score or 0.0, reverse=True)
+        tokens_before = self.count_tokens(
+            self.join([self.format_node(doc) for doc in results])
+        )
+
+        # Group by source, the best scored node of each group sets its position
+        groups: Dict[Any, List[_Chunk]] = OrderedDict()
+        for i, doc in enumerate(self._dedupe(results)):
+            source = doc.metadata.get("source")
+            node = doc.node
+            chunk = _Chunk(
+                node.get_content(), source, node.start_char_idx, node.end_char_idx
+            )
+            groups.setdefault(source if source is not None else i, []).append(chunk)
+
+        entries, used, nodes_after = [], 0, 0
+        for chunks in groups.values():
+            text = self._merge(chunks)
+            source = chunks[0].source
+            suffix = SOURCE_TEMPLATE.format(source=source) if source is not None else ""
+            # Count the list marker and separator too, they cost a couple of tokens
+            tokens = self.count_tokens("- " + text + suffix + "\n\n")
+
+            if self.token_budget is not None and used + tokens > self.token_budget:
+                overhead = self.count_tokens("- \n\n" + suffix)
+                remaining = self.token_budget - used - overhead
+                text = (
+                    truncate_tokens(text, remaining, self.count_tokens)
+                    if remaining > 0
+                    else ""
+                )
+                if text:
+                    entries.append(text + suffix)
+                    nodes_after += len(chunks)
+                break
+
+            entries.append(text + suffix)
+            used += tokens
+            nodes_after += len(chunks)
+
+        packed = self.join(entries)
+        tokens_after = self.count_tokens(packed)
+        CONTEXT_TOKENS.observe(tokens_before, stage="retrieved")
+        CONTEXT_TOKENS.observe(tokens_after, stage="packed")
+        return PackedContext(
+            packed, tokens_before, tokens_after, len(results), nodes_after
+        )
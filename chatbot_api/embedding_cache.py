@@ -0,0 +1,246 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from pipeline.config import Config
+from pipeline.metrics import Counter, Gauge
+
+EMBEDDING_CACHE_REQUESTS = Counter(
+    "chatbot_embedding_cache_requests_total",
+    "Texts looked up in the embedding cache, by where the embedding came from",
+    ["result"],
+)
+EMBEDDING_CACHE_BYTES = Gauge(
+    "chatbot_embedding_cache_bytes",
+    "Bytes used by the embedding cache",
+    ["tier"],
+)
+
+
+class EmbeddingStore:
+    """
+    Embeddings persisted on disk, so they survive restarts and are shared between
+    the app and data/compile_documents.py. Vectors are appended as float32 to
+    `<model>.f32` and read back through a memory map, a SQLite index next to it maps
+    each key to its offset. Appends take a file lock, so several processes can write.
+    """
+
+    def __init__(self, directory: str, model: str):
+        os.makedirs(directory, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+        self.vectors_path = os.path.join(directory, f"{name}.f32")
+        self.index_path = os.path.join(directory, f"{name}.db")
+        open(self.vectors_path, "ab").close()
+
+        self._conn = sqlite3.connect(
+            self.index_path, check_same_thread=False, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, "
+                "offset INTEGER NOT NULL, dimension INTEGER NOT NULL)"
+            )
+        self._mmap: Optional[np.memmap] = None
+        self._lock = threading.Lock()
+
+    def _vectors(self, end: int) -> np.memmap:
+        """The memory map of the vectors file, remapped if it has grown past `end`"""
+        if self._mmap is None or len(self._mmap) < end:
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r")
+        return self._mmap
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT offset, dimension FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            start = row[0] // 4
+            end = start + row[1]
+            return np.array(self._vectors(end)[start:end])
+
+    def put_many(self, vectors: Dict[str, np.ndarray]) -> None:
+        if not vectors:
+            return
+
+        data = b"".join(
+            vector.astype(np.float32).tobytes() for vector in vectors.values()
+        )
+        with self._lock:
+            with open(self.vectors_path, "ab") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    offset = f.seek(0, os.SEEK_END)
+                    f.write(data)
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+            rows = []
+            for key, vector in vectors.items():
+                rows.append((key, offset, len(vector)))
+                offset += len(vector) * 4
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)", rows
+                )
+
+    @property
+    def nbytes(self) -> int:
+        return os.path.getsize(self.vectors_path) + os.path.getsize(self.index_path)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model with an in-process LRU of up to `max_entries` vectors,
+    backed by an optional EmbeddingStore. Keys cover the model and whether the text
+    was embedded as a query or a document, as some providers embed them differently.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model: str,
+        max_entries: int,
+        store: Optional[EmbeddingStore] = None,
+    ):
+        self.embeddings = embeddings
+        self.model = model
+        self.max_entries = max_entries
+        self.store = store
+        self.memory_bytes = 0
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        EMBEDDING_CACHE_BYTES.set_function(lambda: self.memory_bytes, tier="memory")
+        if store is not None:
+            EMBEDDING_CACHE_BYTES.set_function(lambda: store.nbytes, tier="disk")
+
+    def _key(self, kind: str, text: str) -> str:
+        key_parts = [self.model, kind, text]
+        return hashlib.sha256(json.dumps(key_parts).encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        with self._lock:
+            if key not in self._entries:
+                self.memory_bytes += vector.nbytes
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.memory_bytes -= evicted.nbytes
+
+    def _lookup(self, key: str) -> Optional[np.ndarray]:
+        vector = self._recall(key)
+        if vector is None:
+            vector = self._load(key)
+        return vector
+
+    def _recall(self, key: str) -> Optional[np.ndarray]:
+        """The vector from the memory tier"""
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                EMBEDDING_CACHE_REQUESTS.inc(result="hit")
+            return vector
+
+    def _load(self, key: str) -> Optional[np.ndarray]:
+        """The vector from the disk tier, after a miss in memory"""
+        if self.store is not None:
+            vector = self.store.get(key)
+            if vector is not None:
+                self._remember(key, vector)
+                EMBEDDING_CACHE_REQUESTS.inc(result="disk_hit")
+                return vector
+
+        EMBEDDING_CACHE_REQUESTS.inc(result="miss")
+        return None
+
+    def _save(self, vectors: Dict[str, np.ndarray]) -> None:
+        for key, vector in vectors.items():
+            self._remember(key, vector)
+        if self.store is not None:
+            self.store.put_many(vectors)
+
+    def _embed(
+        self,
+        kind: str,
+        texts: List[str],
+        embed_missing: Callable[[List[str]], List[List[float]]],
+    ) -> List[List[float]]:
+        keys = [self._key(kind, text) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            vector = self._lookup(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                found[key] = vector
+
+        if missing:
+            embedded = embed_missing(list(missing.values()))
+            new = {
+                key: np.asarray(vector, dtype=np.float32)
+                for key, vector in zip(missing, embedded)
+            }
+            self._save(new)
+            found.update(new)
+
+        return [found[key].tolist() for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("document", texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(
+            "query", [text], lambda texts: [self.embeddings.embed_query(texts[0])]
+        )[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key("query", text)
+        vector = self._recall(key)
+        if vector is not None:
+            return vector.tolist()
+
+        # The disk tier reads and writes SQLite and the vectors file, keep it off
+        # the event loop
+        vector = await asyncio.to_thread(self._load, key)
+        if vector is None:
+            vector = np.asarray(
+                await self.embeddings.aembed_query(text), dtype=np.float32
+            )
+            await asyncio.to_thread(self._save, {key: vector})
+        return vector.tolist()
+
+
+def create_cached_embeddings(
+    config: Config, embeddings: Embeddings, model: str
+) -> Embeddings:
+    """Wrap embeddings in the cache configured for the app, unchanged if disabled"""
+    if not config.embedding_cache_enabled:
+        return embeddings
+
+    store = None
+    if config.embedding_cache_path is not None:
+        store = EmbeddingStore(config.embedding_cache_path, model)
+
+    return CachedEmbeddings(
+        embeddings, model, config.embedding_cache_max_entries, store=store
+    )
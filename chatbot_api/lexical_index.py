@@ -0,0 +1,381 @@
+import fcntl
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from llama_index.core.schema import BaseNode, MetadataMode, NodeWithScore
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+from pipeline.config import Config
+
+# Words, with the dots, dashes and underscores inside product names, SKUs, versions
+# and error codes, e.g. "text-embedding-ada-002", which also match their parts
+_TOKEN = re.compile(r"[a-z0-9]+(?:[._-][a-z0-9]+)*")
+_SEPARATOR = re.compile(r"[._-]")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from has have how i if in into is "
+    "it its my not of on or so that the their then there these this to was we what "
+    "when where which who why will with you your".split()
+)
+
+# Runs the lexical half of a hybrid search, beside the vector search in the caller
+lexical_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="lexical")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if token not in _STOPWORDS:
+            tokens.append(token)
+        if _SEPARATOR.search(token):
+            tokens.extend(
+                part
+                for part in _SEPARATOR.split(token)
+                if part and part not in _STOPWORDS
+            )
+    return tokens
+
+
+class BM25Index:
+    """
+    A BM25 inverted index of the same chunks as the vector store, for the exact terms
+    that embeddings retrieve poorly: product names, SKUs, CQL keywords, error codes.
+
+    Postings are kept in NumPy arrays read through memory maps: for each term, the
+    rows of the chunks it's in, as int32, and their term frequencies and BM25 term
+    weights, the part of a row's score that doesn't depend on the query, as float16.
+    The postings of a term are sorted by weight, so a query only reads the best
+    `max_postings` of each term, which bounds its latency for terms that are in most
+    chunks. The terms, their ids and the chunks themselves are in `index.db`.
+
+    add() buffers chunks in memory and save() writes a new generation of the arrays,
+    merged with the last one, so build the index in large batches, as
+    data/compile_documents.py does. One process builds it at a time, any number can
+    query it, picking up the new generation on their next query.
+
+    Like the vector store, adding a chunk replaces the one with its node id, and
+    delete() removes a document's chunks, by marking their rows deleted in place:
+    they're left out of results but still count in the term statistics.
+    """
+
+    _ARRAYS = ("postings", "frequencies", "weights", "offsets", "lengths")
+
+    def __init__(
+        self, path: str, k1: float = 1.2, b: float = 0.75, max_postings: int = 10000
+    ):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_postings = max_postings
+        os.makedirs(path, exist_ok=True)
+
+        self._conn = sqlite3.connect(
+            os.path.join(path, "index.db"), check_same_thread=False, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS terms "
+                "(term TEXT PRIMARY KEY, id INTEGER NOT NULL) WITHOUT ROWID"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS nodes (row INTEGER PRIMARY KEY, "
+                "node_id TEXT NOT NULL, ref_doc_id TEXT, node_type TEXT NOT NULL, "
+                "node TEXT NOT NULL, deleted INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS nodes_node_id ON nodes (node_id)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS nodes_ref_doc_id ON nodes (ref_doc_id)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)"
+            )
+        self._lock = threading.Lock()
+        self._data_version: Optional[int] = None
+        self._generation = 0
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._deleted = np.zeros(0, dtype=bool)
+
+        # Chunks added since the last save, with the terms they introduced
+        self._vocabulary: Optional[Dict[str, int]] = None
+        self._vocabulary_generation = 0
+        self._pending_terms: List[np.ndarray] = []
+        self._pending_rows: List[np.ndarray] = []
+        self._pending_frequencies: List[np.ndarray] = []
+        self._pending_lengths: List[int] = []
+        self._pending_nodes: List[list] = []
+        # The position in _pending_nodes of each node id
+        self._pending_ids: Dict[str, int] = {}
+
+        with self._lock:
+            self._refresh()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self._size - int(self._deleted.sum())
+
+    @property
+    def _size(self) -> int:
+        return len(self._arrays["lengths"]) if self._arrays else 0
+
+    def _file(self, name: str, generation: int) -> str:
+        return os.path.join(self.path, f"{name}-{generation}.npy")
+
+    def _refresh(self) -> None:
+        """Maps the latest generation of the arrays and its deletions, holding _lock"""
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+
+        self._data_version = data_version
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'generation'"
+        ).fetchone()
+        generation = row[0] if row is not None else 0
+        if generation != self._generation:
+            self._arrays = {
+                name: np.load(self._file(name, generation), mmap_mode="r")
+                for name in self._ARRAYS
+            }
+            self._generation = generation
+        self._deleted = np.zeros(self._size, dtype=bool)
+        rows = self._conn.execute("SELECT row FROM nodes WHERE deleted = 1")
+        self._deleted[[row for row, in rows]] = True
+
+    def add(self, nodes: Sequence[BaseNode]) -> None:
+        """Buffers the chunks for the next save()"""
+        with self._lock:
+            if self._vocabulary is None:
+                self._refresh()
+                terms = self._conn.execute("SELECT term, id FROM terms")
+                self._vocabulary = dict(terms)
+                self._vocabulary_generation = self._generation
+            vocabulary = self._vocabulary
+
+            row = self._size + len(self._pending_lengths)
+            terms, rows, frequencies = [], [], []
+            for node in nodes:
+                tokens = tokenize(node.get_content(metadata_mode=MetadataMode.NONE))
+                for term, frequency in Counter(tokens).items():
+                    terms.append(vocabulary.setdefault(term, len(vocabulary)))
+                    frequencies.append(frequency)
+                rows.extend([row] * (len(terms) - len(rows)))
+                self._pending_lengths.append(len(tokens))
+                # Replaces the chunk with the same id added since the last save
+                replaced = self._pending_ids.get(node.node_id)
+                if replaced is not None:
+                    self._pending_nodes[replaced][-1] = 1
+                self._pending_ids[node.node_id] = len(self._pending_nodes)
+                self._pending_nodes.append(
+                    [
+                        row,
+                        node.node_id,
+                        node.ref_doc_id,
+                        node.class_name(),
+                        node.json(exclude={"embedding"}),
+                        0,
+                    ]
+                )
+                row += 1
+            self._pending_terms.append(np.array(terms, dtype=np.int32))
+            self._pending_rows.append(np.array(rows, dtype=np.int32))
+            self._pending_frequencies.append(np.array(frequencies, dtype=np.int32))
+
+    def save(self) -> None:
+        """Writes the chunks added since the last save as a new generation"""
+        with open(os.path.join(self.path, "lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with self._lock:
+                if not self._pending_nodes:
+                    return
+                self._refresh()
+                if self._generation != self._vocabulary_generation:
+                    raise RuntimeError(
+                        f"{self.path} was saved by another process since add()"
+                    )
+                self._write(self._generation + 1)
+                self._vocabulary = None
+                self._pending_terms, self._pending_rows = [], []
+                self._pending_frequencies, self._pending_lengths = [], []
+                self._pending_nodes, self._pending_ids = [], {}
+                # data_version only counts other connections' commits
+                self._data_version = None
+                self._refresh()
+
+    def _write(self, generation: int) -> None:
+        terms = np.concatenate(self._pending_terms)
+        rows = np.concatenate(self._pending_rows)
+        frequencies = np.concatenate(self._pending_frequencies)
+        lengths = np.array(self._pending_lengths, dtype=np.int32)
+        old_terms = 0
+        if self._arrays:
+            old = self._arrays
+            old_terms = len(old["offsets"]) - 1
+            terms = np.concatenate(
+                [
+                    np.repeat(
+                        np.arange(old_terms, dtype=np.int32), np.diff(old["offsets"])
+                    ),
+                    terms,
+                ]
+            )
+            rows = np.concatenate([old["postings"], rows])
+            frequencies = np.concatenate([old["frequencies"], frequencies])
+            lengths = np.concatenate([old["lengths"], lengths])
+
+        # The BM25 score of a row for a term is idf(term) * weight
+        frequencies = np.minimum(frequencies, np.iinfo(np.uint16).max)
+        # In float32, the arrays of a million chunks take gigabytes in float64
+        norms = lengths[rows].astype(np.float32)
+        norms *= self.k1 * self.b / max(lengths.mean(), 1)
+        norms += self.k1 * (1 - self.b)
+        weights = frequencies.astype(np.float32)
+        weights = weights * (self.k1 + 1) / (weights + norms)
+        order = np.lexsort((-weights, terms))
+        offsets = np.zeros(len(self._vocabulary) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(terms, minlength=len(self._vocabulary)))
+        arrays = {
+            "postings": rows[order],
+            "frequencies": frequencies[order].astype(np.uint16),
+            "weights": weights[order].astype(np.float16),
+            "offsets": offsets,
+            "lengths": lengths,
+        }
+        for name, array in arrays.items():
+            np.save(self._file(name, generation), array)
+
+        new_terms = [
+            (term, id) for term, id in self._vocabulary.items() if id >= old_terms
+        ]
+        with self._conn:
+            self._conn.executemany("INSERT INTO terms VALUES (?, ?)", new_terms)
+            # The chunks these replace, saved in earlier generations
+            self._conn.executemany(
+                "UPDATE nodes SET deleted = 1 WHERE node_id = ?",
+                [(node_id,) for node_id in self._pending_ids],
+            )
+            self._conn.executemany(
+                "INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?)", self._pending_nodes
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('generation', ?)", (generation,)
+            )
+        # Readers that still map the old generation keep it until they move on
+        for name in self._ARRAYS:
+            if os.path.exists(self._file(name, self._generation)):
+                os.remove(self._file(name, self._generation))
+
+    def delete(self, ref_doc_id: str) -> None:
+        """Marks the document's chunks deleted, including any not saved yet"""
+        with self._lock:
+            for pending in self._pending_nodes:
+                if pending[2] == ref_doc_id:
+                    pending[-1] = 1
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE nodes SET deleted = 1 WHERE ref_doc_id = ?", (ref_doc_id,)
+                )
+            # data_version only counts other connections' commits
+            self._data_version = None
+
+    def search(self, query: str, k: int) -> List[NodeWithScore]:
+        """The k chunks with the best BM25 score for the query, best first"""
+        terms = sorted(set(tokenize(query)))
+        with self._lock:
+            self._refresh()
+            if not terms or not self._arrays:
+                return []
+            arrays, deleted = self._arrays, self._deleted
+            placeholders = ",".join("?" * len(terms))
+            ids = [
+                id
+                for id, in self._conn.execute(
+                    f"SELECT id FROM terms WHERE term IN ({placeholders})", terms
+                )
+            ]
+
+        offsets, postings, weights = (
+            arrays["offsets"],
+            arrays["postings"],
+            arrays["weights"],
+        )
+        size = len(arrays["lengths"])
+        scores = np.zeros(size, dtype=np.float32)
+        matched = []
+        for id in ids:
+            start, end = int(offsets[id]), int(offsets[id + 1])
+            idf = math.log(1 + (size - (end - start) + 0.5) / (end - start + 0.5))
+            end = min(end, start + self.max_postings)
+            rows = postings[start:end]
+            scores[rows] += idf * weights[start:end].astype(np.float32)
+            matched.append(rows)
+        if not matched:
+            return []
+
+        # A row is in at most one list per term, so the best k * terms postings hold
+        # the best k distinct rows
+        candidates = np.concatenate(matched)
+        candidates = candidates[~deleted[candidates]]
+        count = min(len(candidates), k * len(matched))
+        if not count:
+            return []
+        best = np.argpartition(-scores[candidates], count - 1)[:count]
+        rows = np.unique(candidates[best])
+        rows = rows[np.argsort(-scores[rows], kind="stable")][:k].tolist()
+
+        with self._lock:
+            nodes = {
+                row: metadata_dict_to_node(
+                    {"_node_type": node_type, "_node_content": node}
+                )
+                for row, node_type, node in self._conn.execute(
+                    "SELECT row, node_type, node FROM nodes WHERE row IN "
+                    f"({','.join('?' * len(rows))})",
+                    rows,
+                )
+            }
+        return [
+            NodeWithScore(node=nodes[row], score=float(scores[row])) for row in rows
+        ]
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[List[NodeWithScore]], top_k: int, k: int = 60
+) -> List[NodeWithScore]:
+    """
+    Merges ranked lists of nodes into the top_k with the best sum of 1 / (k + rank)
+    over the lists, which needs no calibration between their scores
+    """
+    scores: Dict[str, float] = {}
+    nodes: Dict[str, BaseNode] = {}
+    for ranking in rankings:
+        for rank, result in enumerate(ranking, 1):
+            node_id = result.node.node_id
+            scores[node_id] = scores.get(node_id, 0.0) + 1 / (k + rank)
+            nodes.setdefault(node_id, result.node)
+    best = sorted(scores, key=scores.__getitem__, reverse=True)[:top_k]
+    return [
+        NodeWithScore(node=nodes[node_id], score=scores[node_id]) for node_id in best
+    ]
+
+
+def create_lexical_index(
+    config: Config, collection_name: Optional[str] = None
+) -> Optional[BM25Index]:
+    """The BM25 index of the collection for hybrid search, or None if it's disabled"""
+    if not config.hybrid_search_enabled:
+        return None
+    return BM25Index(
+        os.path.join(
+            config.lexical_index_path, collection_name or config.astra_db_table_name
+        )
+    )
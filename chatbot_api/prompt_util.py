@@ -1,7 +1,135 @@
+import glob
+import hashlib
 import os
-from typing import List
+import threading
+from dataclasses import dataclass, field
+from string import Formatter
+from typing import Dict, List, Optional, Tuple, Union
 
 from langchain.prompts import load_prompt
+from langchain_core.prompts import BasePromptTemplate
+
+
+def get_persona_path(persona: str) -> str:
+    persona_path = f"prompts/{persona}.yaml"
+    if not os.path.exists(persona_path):
+        persona_path = f"../prompts/{persona}.yaml"
+
+    return persona_path
+
+
+class CompiledPrompt:
+    """
+    A prompt template with its static fields already filled in, split into literal
+    text and the names of the fields that are still left to fill per request.
+    """
+
+    def __init__(self, template: str, static_fields: Dict[str, str]):
+        self.parts: List[Tuple[bool, str]] = []  # (is_field, literal text or name)
+        literal = ""
+        for text, name, format_spec, conversion in Formatter().parse(template):
+            literal += text
+            if name is None:
+                continue
+
+            if format_spec or conversion:
+                raise ValueError(f"Unsupported field {{{name}}} in prompt template")
+            if name in static_fields:
+                literal += static_fields[name]
+            else:
+                self.parts.append((False, literal))
+                self.parts.append((True, name))
+                literal = ""
+        self.parts.append((False, literal))
+
+    def format(self, **fields: str) -> str:
+        return "".join(
+            fields[value] if is_field else value for is_field, value in self.parts
+        )
+
+
+@dataclass
+class PersonaPrompt:
+    prompt: BasePromptTemplate
+    mtime: float
+    version: str  # Hash of the prompt file, see PromptRegistry.get_version
+    compiled: Dict[Tuple[str, Tuple[str, ...]], CompiledPrompt] = field(
+        default_factory=dict
+    )
+
+
+class PromptRegistry:
+    """
+    Loads every persona prompt in `directory` once, and again only when its file's
+    mtime changes. Each persona is compiled once per company and set of custom rules,
+    so a request only fills in the question, context and search results.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        if directory is None:
+            directory = os.path.dirname(get_persona_path("default"))
+        self.directory = directory
+        self._personas: Dict[str, PersonaPrompt] = {}
+        self._lock = threading.Lock()
+
+        for path in glob.glob(os.path.join(directory, "*.yaml")):
+            self._load(os.path.splitext(os.path.basename(path))[0])
+
+    def _path(self, persona: str) -> str:
+        return os.path.join(self.directory, f"{persona}.yaml")
+
+    def _load(self, persona: str) -> PersonaPrompt:
+        path = self._path(persona)
+        mtime = os.stat(path).st_mtime
+        with open(path, "rb") as prompt_file:
+            version = hashlib.sha1(prompt_file.read()).hexdigest()[:12]
+
+        entry = PersonaPrompt(load_prompt(path), mtime, version)
+        with self._lock:
+            self._personas[persona] = entry
+        return entry
+
+    def get(self, persona: str) -> PersonaPrompt:
+        entry = self._personas.get(persona)
+        if entry is None or os.stat(self._path(persona)).st_mtime != entry.mtime:
+            entry = self._load(persona)
+        return entry
+
+    def get_version(self, persona: str) -> str:
+        """A hash of the persona's prompt file, changes whenever the prompt is edited"""
+        return self.get(persona).version
+
+    def get_compiled(
+        self, persona: str, company: str, custom_rules: List[str]
+    ) -> Union[CompiledPrompt, BasePromptTemplate]:
+        entry = self.get(persona)
+        key = (company, tuple(custom_rules))
+        compiled = entry.compiled.get(key)
+        if compiled is None:
+            # Only f-string templates can be compiled, anything else is formatted as is
+            if getattr(entry.prompt, "template_format", None) != "f-string":
+                return entry.prompt
+
+            static_fields = dict(entry.prompt.partial_variables)
+            static_fields.update(company=company, custom_rules="\n".join(custom_rules))
+            compiled = CompiledPrompt(entry.prompt.template, static_fields)
+            entry.compiled[key] = compiled
+        return compiled
+
+
+_registry: Optional[PromptRegistry] = None
+
+
+def get_prompt_registry() -> PromptRegistry:
+    """The registry of the prompts/ folder, loaded on first use"""
+    global _registry
+    if _registry is None:
+        _registry = PromptRegistry()
+    return _registry
+
+
+def get_template_version(persona: str) -> str:
+    return get_prompt_registry().get_version(persona)
 
 
 def get_template(
@@ -12,18 +140,21 @@ def get_template(
     company: str,
     custom_rules: List[str],
 ) -> str:
-    persona_path = f"prompts/{persona}.yaml"
-    if not os.path.exists(persona_path):
-        persona_path = f"../prompts/{persona}.yaml"
+    prompt = get_prompt_registry().get_compiled(persona, company, custom_rules)
+    if not isinstance(prompt, CompiledPrompt):
+        return prompt.format(
+            vector_search_results=vector_search_results,
+            user_question=user_question,
+            user_context=user_context,
+            company=company,
+            custom_rules="\n".join(custom_rules),
+        )
 
-    prompt = load_prompt(persona_path)
     input_txt = prompt.format(
         **{
             "vector_search_results": vector_search_results,
             "user_question": user_question,
             "user_context": user_context,
-            "company": company,
-            "custom_rules": "\n".join(custom_rules),
         }
     )
 
@@ -0,0 +1,312 @@
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.utils import get_tokenizer
+
+from pipeline.config import Config, SessionBackendType
+
+
+class SessionBackend(ABC):
+    """Storage for the serialized chat history of each conversation"""
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        """Return the stored messages, or None if missing or expired"""
+
+    @abstractmethod
+    def save(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        pass
+
+    @abstractmethod
+    def append(
+        self,
+        session_id: str,
+        messages: List[Dict[str, str]],
+        truncate: Callable[[List[Dict[str, str]]], List[Dict[str, str]]],
+    ) -> None:
+        """
+        Add the messages to the stored ones, or to none if missing or expired, and
+        store what truncate() keeps of them, without losing concurrent appends
+        """
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        pass
+
+
+class InMemorySessionBackend(SessionBackend):
+    """A process local LRU of sessions, for single node deployments"""
+
+    def __init__(self, max_sessions: int, ttl_seconds: float):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, Tuple[float, List[Dict[str, str]]]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.RLock()
+
+    def load(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+
+            updated_at, messages = entry
+            if time.time() - updated_at > self.ttl_seconds:
+                del self._sessions[session_id]
+                return None
+
+            self._sessions.move_to_end(session_id)
+            return messages
+
+    def save(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        with self._lock:
+            self._sessions[session_id] = (time.time(), messages)
+            self._sessions.move_to_end(session_id)
+
+            # Evict idle sessions first, then the least recently used ones
+            cutoff = time.time() - self.ttl_seconds
+            while self._sessions:
+                oldest_id, (updated_at, _) = next(iter(self._sessions.items()))
+                if updated_at >= cutoff and len(self._sessions) <= self.max_sessions:
+                    break
+                del self._sessions[oldest_id]
+
+    def append(
+        self,
+        session_id: str,
+        messages: List[Dict[str, str]],
+        truncate: Callable[[List[Dict[str, str]]], List[Dict[str, str]]],
+    ) -> None:
+        with self._lock:
+            history = self.load(session_id) or []
+            self.save(session_id, truncate(history + messages))
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Sessions stored in a SQLite file, shared by every worker on the same host"""
+
+    def __init__(self, path: str, max_sessions: int, ttl_seconds: float):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(id TEXT PRIMARY KEY, messages TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        return self._load(self._connect(), session_id)
+
+    def save(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        with self._connect() as conn:
+            self._save(conn, session_id, messages)
+
+    def append(
+        self,
+        session_id: str,
+        messages: List[Dict[str, str]],
+        truncate: Callable[[List[Dict[str, str]]], List[Dict[str, str]]],
+    ) -> None:
+        with self._connect() as conn:
+            # Takes the write lock before reading, so concurrent appends wait for
+            # each other instead of overwriting each other's turn
+            conn.execute("BEGIN IMMEDIATE")
+            history = self._load(conn, session_id) or []
+            self._save(conn, session_id, truncate(history + messages))
+
+    def _load(
+        self, conn: sqlite3.Connection, session_id: str
+    ) -> Optional[List[Dict[str, str]]]:
+        row = conn.execute(
+            "SELECT messages FROM sessions WHERE id = ? AND updated_at >= ?",
+            (session_id, time.time() - self.ttl_seconds),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save(
+        self, conn: sqlite3.Connection, session_id: str, messages: List[Dict[str, str]]
+    ) -> None:
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (id, messages, updated_at) VALUES (?, ?, ?)",
+            (session_id, json.dumps(messages), now),
+        )
+        conn.execute(
+            "DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl_seconds,)
+        )
+        conn.execute(
+            "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions "
+            "ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,),
+        )
+
+    def delete(self, session_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+
+class AstraSessionBackend(SessionBackend):
+    """Sessions stored in an Astra DB collection, shared by every node"""
+
+    def __init__(self, config: Config, ttl_seconds: float):
+        from astrapy import DataAPIClient
+
+        self.ttl_seconds = ttl_seconds
+        database = DataAPIClient(config.astra_db_application_token).get_database(
+            config.astra_db_api_endpoint
+        )
+        self.collection = database.create_collection(
+            config.session_astra_collection, check_exists=False
+        )
+
+    def load(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        document = self.collection.find_one({"_id": session_id})
+        if document is None:
+            return None
+        if time.time() - document["updated_at"] > self.ttl_seconds:
+            self.collection.delete_one({"_id": session_id})
+            return None
+        return document["messages"]
+
+    def save(self, session_id: str, messages: List[Dict[str, str]]) -> None:
+        now = time.time()
+        self.collection.find_one_and_replace(
+            {"_id": session_id},
+            {"_id": session_id, "messages": messages, "updated_at": now},
+            upsert=True,
+        )
+
+    def append(
+        self,
+        session_id: str,
+        messages: List[Dict[str, str]],
+        truncate: Callable[[List[Dict[str, str]]], List[Dict[str, str]]],
+    ) -> None:
+        now = time.time()
+        self.collection.delete_one(
+            {"_id": session_id, "updated_at": {"$lt": now - self.ttl_seconds}}
+        )
+        # $push is atomic, so concurrent appends all land
+        before = self.collection.find_one_and_update(
+            {"_id": session_id},
+            {"$push": {"messages": {"$each": messages}}, "$set": {"updated_at": now}},
+            upsert=True,
+            return_document="before",
+        )
+        history = before["messages"] if before is not None else []
+        kept = truncate(history + messages)
+        if len(kept) < len(history) + len(messages):
+            # Unless another turn was pushed since, which truncates in its turn
+            self.collection.update_one(
+                {"_id": session_id, "updated_at": now}, {"$set": {"messages": kept}}
+            )
+
+    def delete(self, session_id: str) -> None:
+        self.collection.delete_one({"_id": session_id})
+
+
+class SessionStore:
+    """
+    Keeps a bounded chat history per conversation id. Only the user questions and the
+    bot answers are stored, never the full prompt with the retrieved documents, and
+    the oldest messages are dropped once the history exceeds max_messages or
+    token_limit.
+    """
+
+    def __init__(
+        self,
+        backend: SessionBackend,
+        max_messages: int = 20,
+        token_limit: int = 2000,
+        tokenizer: Optional[Callable[[str], List[Any]]] = None,
+    ):
+        self.backend = backend
+        self.max_messages = max_messages
+        self.token_limit = token_limit
+        self.tokenizer = tokenizer or get_tokenizer()
+
+    def get_history(self, session_id: Optional[str]) -> List[ChatMessage]:
+        if session_id is None:
+            return []
+
+        messages = self.backend.load(session_id) or []
+        return [
+            ChatMessage(role=MessageRole(message["role"]), content=message["content"])
+            for message in messages
+        ]
+
+    def append_turn(
+        self, session_id: Optional[str], user_message: str, bot_message: str
+    ) -> None:
+        if session_id is None:
+            return
+
+        turn = [
+            {"role": MessageRole.USER.value, "content": user_message},
+            {"role": MessageRole.ASSISTANT.value, "content": bot_message},
+        ]
+        self.backend.append(session_id, turn, self._truncate)
+
+    def clear(self, session_id: str) -> None:
+        self.backend.delete(session_id)
+
+    def _truncate(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        # Messages are always stored in user/assistant pairs
+        messages = messages[max(0, len(messages) - self.max_messages // 2 * 2) :]
+        token_counts = [len(self.tokenizer(m["content"])) for m in messages]
+
+        # Drop whole user/assistant turns from the front until we fit the budget
+        while messages and sum(token_counts) > self.token_limit:
+            messages, token_counts = messages[2:], token_counts[2:]
+
+        return messages
+
+
+def create_session_store(config: Config) -> SessionStore:
+    """Build the SessionStore for the backend chosen in config"""
+    if config.session_backend == SessionBackendType.Memory:
+        backend = InMemorySessionBackend(
+            config.session_max_sessions, config.session_ttl_seconds
+        )
+    elif config.session_backend == SessionBackendType.SQLite:
+        backend = SQLiteSessionBackend(
+            config.session_sqlite_path,
+            config.session_max_sessions,
+            config.session_ttl_seconds,
+        )
+    elif config.session_backend == SessionBackendType.Astra:
+        backend = AstraSessionBackend(config, config.session_ttl_seconds)
+    else:
+        raise ValueError(f"Unrecognized session_backend {config.session_backend}")
+
+    return SessionStore(
+        backend,
+        max_messages=config.session_max_messages,
+        token_limit=config.session_token_limit,
+    )
@@ -0,0 +1,172 @@
+import asyncio
+import time
+from typing import AsyncGenerator, Callable, Generator, List, Optional, Union
+
+from llama_index.core.chat_engine.types import StreamingAgentChatResponse
+
+from pipeline.metrics import STAGE_SECONDS, Histogram
+from pipeline.tracing import start_span
+
+LLM_TOKENS_PER_SECOND = Histogram(
+    "chatbot_llm_tokens_per_second",
+    "Streamed chunks per second after the first, roughly tokens per second",
+    ["llm_provider"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+
+
+class ReplayedChatResponse:
+    """
+    Replays previously generated tokens through the same interface as the
+    StreamingAgentChatResponse returned by stream_chat/astream_chat.
+    """
+
+    aqueue = None
+
+    def __init__(self, tokens: List[str]):
+        self.tokens = tokens
+        self.response = "".join(tokens).strip()
+
+    @property
+    def response_gen(self) -> Generator[str, None, None]:
+        yield from self.tokens
+
+    async def async_response_gen(self) -> AsyncGenerator[str, None]:
+        for token in self.tokens:
+            yield token
+            # Let other requests run between tokens, like a live stream would
+            await asyncio.sleep(0)
+
+
+class RecordingChatResponse:
+    """Passes a live stream through, then hands the full list of tokens to on_complete"""
+
+    aqueue = None
+
+    def __init__(
+        self,
+        bot_response: StreamingAgentChatResponse,
+        on_complete: Callable[[List[str]], None],
+    ):
+        self.bot_response = bot_response
+        self.on_complete = on_complete
+
+    @property
+    def response_gen(self) -> Generator[str, None, None]:
+        tokens = []
+        for token in self.bot_response.response_gen:
+            tokens.append(token)
+            yield token
+        self.on_complete(tokens)
+
+    async def async_response_gen(self) -> AsyncGenerator[str, None]:
+        tokens = []
+        async for token in stream_tokens(self.bot_response):
+            tokens.append(token)
+            yield token
+        # Storing the answer writes to the caches, keep it off the event loop
+        await asyncio.to_thread(self.on_complete, tokens)
+
+
+class TimedChatResponse:
+    """
+    Passes a live LLM stream through, observing the time to its first token and to
+    its end as the llm_first_token and llm_stream stages, counted from `start_time`,
+    the perf_counter() before the LLM was called. Traced requests get a span for it.
+    """
+
+    aqueue = None
+
+    def __init__(
+        self,
+        bot_response: StreamingAgentChatResponse,
+        start_time: float,
+        llm_provider: str,
+    ):
+        self.bot_response = bot_response
+        self.start_time = start_time
+        self.llm_provider = llm_provider
+        self._first_token_time: Optional[float] = None
+        self._tokens = 0
+        self.span = start_span("assistant.llm_stream", llm_provider=llm_provider)
+        if self.span is not None:
+            self.span.start_ns -= int((time.perf_counter() - start_time) * 1e9)
+
+    def _on_token(self) -> None:
+        self._tokens += 1
+        if self._first_token_time is None:
+            self._first_token_time = time.perf_counter()
+            STAGE_SECONDS.observe(
+                self._first_token_time - self.start_time,
+                stage="llm_first_token",
+                integration="",
+                llm_provider=self.llm_provider,
+            )
+
+    def _on_error(self, error: BaseException) -> None:
+        if self.span is not None:
+            self.span.end(error)
+
+    def _on_complete(self) -> None:
+        end_time = time.perf_counter()
+        STAGE_SECONDS.observe(
+            end_time - self.start_time,
+            stage="llm_stream",
+            integration="",
+            llm_provider=self.llm_provider,
+        )
+        if self._first_token_time is not None and end_time > self._first_token_time:
+            LLM_TOKENS_PER_SECOND.observe(
+                (self._tokens - 1) / (end_time - self._first_token_time),
+                llm_provider=self.llm_provider,
+            )
+        if self.span is not None:
+            self.span.set_attribute("chunks", self._tokens)
+            if self._first_token_time is not None:
+                first_token_ms = (self._first_token_time - self.start_time) * 1e3
+                self.span.set_attribute("first_token_ms", first_token_ms)
+            self.span.end()
+
+    @property
+    def response_gen(self) -> Generator[str, None, None]:
+        try:
+            for token in self.bot_response.response_gen:
+                self._on_token()
+                yield token
+        except BaseException as e:
+            self._on_error(e)
+            raise
+        self._on_complete()
+
+    async def async_response_gen(self) -> AsyncGenerator[str, None]:
+        try:
+            async for token in stream_tokens(self.bot_response):
+                self._on_token()
+                yield token
+        except BaseException as e:
+            self._on_error(e)
+            raise
+        self._on_complete()
+
+
+ChatResponse = Union[
+    StreamingAgentChatResponse,
+    ReplayedChatResponse,
+    RecordingChatResponse,
+    TimedChatResponse,
+]
+
+
+async def stream_tokens(bot_response: ChatResponse) -> AsyncGenerator[str, None]:
+    """
+    Yields the tokens of an astream_chat response. async_response_gen polls its queue
+    with a timeout and stops if the stream finished meanwhile, which can leave the last
+    tokens in the queue, so drain whatever is left afterwards.
+    """
+    async for text in bot_response.async_response_gen():
+        yield text
+
+    while bot_response.aqueue is not None and not bot_response.aqueue.empty():
+        text = bot_response.aqueue.get_nowait()
+        if text:
+            yield text
@@ -0,0 +1,494 @@
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+from llama_index.vector_stores.astra_db import AstraDBVectorStore
+
+from pipeline.config import Config, VectorStoreType
+
+
+class LocalVectorStore(BasePydanticVectorStore):
+    """
+    A vector store in a local directory, for offline development and to save the
+    network round trip of a hosted one. Normalized embeddings are rows of one float32,
+    or float16, matrix in `embeddings.npy`, read through a memory map, and a query is
+    an exact cosine top-k: one matmul over the matrix and an argpartition. Node text
+    and metadata are kept in `nodes.db`, a SQLite table keyed by row.
+
+    The matrix is allocated ahead, doubling when it fills up, so adding nodes is
+    amortized O(1). Writes take a file lock, and other processes pick them up on
+    their next query, e.g. the app after data/compile_documents.py has run. Adding a
+    node replaces the one with its node id, whose row is marked deleted, as delete()
+    does with the rows of a document.
+
+    With index="ivf", once the store holds `train_size` nodes it clusters them into
+    `n_lists` inverted lists with k-means, and from then on a query only scores the
+    rows of the `nprobe` lists whose centroids are nearest to it. More probes trade
+    latency for recall, and probing every list is exact. The centroids are saved to
+    `centroids.npy` and the list of each row to `lists.npy`, which is kept up to
+    date as nodes are added, whichever index the store is opened with. Each add()
+    also merges its rows into `list_rows.npy`, the rows grouped by list, so queries
+    read the lists as they are.
+    """
+
+    stores_text: bool = True
+    path: str
+    dimension: int
+    dtype: str = "float32"
+    index: str = "flat"
+    n_lists: int = 1024
+    nprobe: int = 32
+
+    # float16 has no BLAS matmul, it's converted to float32 this many rows at a time
+    block_size: int = 65536
+    kmeans_iterations: int = 10
+
+    _conn: sqlite3.Connection = PrivateAttr()
+    _matrix: Optional[np.ndarray] = PrivateAttr(default=None)
+    _deleted: np.ndarray = PrivateAttr()
+    _count: int = PrivateAttr(default=0)
+    _data_version: Optional[int] = PrivateAttr(default=None)
+    _version: str = PrivateAttr(default="")
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    # The IVF index: centroids, the list of each row, and its rows grouped by list
+    # with the first row of list i at _list_rows[_list_offsets[i]]
+    _centroids: Optional[np.ndarray] = PrivateAttr(default=None)
+    _lists: Optional[np.ndarray] = PrivateAttr(default=None)
+    _list_rows: Optional[np.ndarray] = PrivateAttr(default=None)
+    _list_offsets: Optional[np.ndarray] = PrivateAttr(default=None)
+
+    def __init__(
+        self,
+        path: str,
+        dimension: int,
+        dtype: str = "float32",
+        index: str = "flat",
+        n_lists: int = 1024,
+        nprobe: int = 32,
+    ):
+        if index not in ("flat", "ivf"):
+            raise ValueError(f"Unknown index {index}, expected flat or ivf")
+        super().__init__(
+            path=path,
+            dimension=dimension,
+            dtype=dtype,
+            index=index,
+            n_lists=n_lists,
+            nprobe=nprobe,
+        )
+        os.makedirs(path, exist_ok=True)
+        self._conn = sqlite3.connect(
+            os.path.join(path, "nodes.db"), check_same_thread=False, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS nodes (row INTEGER PRIMARY KEY, "
+                "node_id TEXT NOT NULL, ref_doc_id TEXT, node_type TEXT, "
+                "node TEXT NOT NULL, deleted INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS nodes_ref_doc_id ON nodes (ref_doc_id)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS nodes_node_id ON nodes (node_id)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+        self._deleted = np.zeros(0, dtype=bool)
+        with self._lock:
+            self._refresh()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    @property
+    def embeddings_path(self) -> str:
+        return os.path.join(self.path, "embeddings.npy")
+
+    @property
+    def train_size(self) -> int:
+        """Nodes needed to train the IVF index, k-means wants a few dozen per list"""
+        return 32 * self.n_lists
+
+    @property
+    def version(self) -> str:
+        """A stamp renewed by every write, even one that leaves as many nodes"""
+        with self._lock:
+            self._refresh()
+            return self._version
+
+    def __bool__(self) -> bool:
+        # Empty, but still a store: llama-index defaults `vector_store or ...`
+        return True
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self._count - int(self._deleted[: self._count].sum())
+
+    def _refresh(self) -> None:
+        """Picks up what other processes wrote since the last call, holding _lock"""
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+
+        self._data_version = data_version
+        count, deleted = self._conn.execute(
+            "SELECT COALESCE(MAX(row) + 1, 0), COALESCE(SUM(deleted), 0) FROM nodes"
+        ).fetchone()
+        version = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()
+        self._version = version[0] if version is not None else ""
+        if count > (len(self._matrix) if self._matrix is not None else 0):
+            self._matrix = np.load(self.embeddings_path, mmap_mode="r")
+        if self._centroids is None or count > len(self._lists):
+            self._load_index()
+        self._count = count
+        if self._centroids is not None:
+            self._load_groups()
+        self._deleted = np.zeros(len(self._matrix) if count else 0, dtype=bool)
+        if deleted:
+            rows = self._conn.execute("SELECT row FROM nodes WHERE deleted = 1")
+            self._deleted[[row for row, in rows]] = True
+
+    def _load_index(self) -> None:
+        centroids_path = os.path.join(self.path, "centroids.npy")
+        if os.path.exists(centroids_path):
+            self._centroids = np.load(centroids_path)
+            self._lists = np.load(os.path.join(self.path, "lists.npy"), mmap_mode="r")
+
+    def _load_groups(self) -> None:
+        """Maps the rows grouped by list, as of the last add()"""
+        rows_path = os.path.join(self.path, "list_rows.npy")
+        if not os.path.exists(rows_path):
+            # add() saves them before the centroids, which make the index exist
+            raise RuntimeError(
+                f"{self.path} has an IVF index but no list_rows.npy, rebuild it"
+            )
+        self._list_rows = np.load(rows_path, mmap_mode="r")
+        self._list_offsets = np.load(os.path.join(self.path, "list_offsets.npy"))
+
+    def _resize(self, name: str, old: Optional[np.ndarray], shape: Tuple) -> None:
+        """Replaces the file with a larger one, holding the first _count rows of old"""
+        path = os.path.join(self.path, name)
+        dtype = old.dtype if old is not None else self.dtype
+        grown = np.lib.format.open_memmap(path + ".tmp", "w+", dtype, shape)
+        if self._count:
+            grown[: self._count] = old[: self._count]
+        grown.flush()
+        del grown
+        os.replace(path + ".tmp", path)
+
+    def _reserve(self, rows: int) -> None:
+        """Grows the matrix, and the lists of the index, to fit `rows` more"""
+        capacity = len(self._matrix) if self._matrix is not None else 0
+        if self._count + rows <= capacity:
+            return
+        capacity = max(2 * capacity, self._count + rows, 1024)
+        self._resize("embeddings.npy", self._matrix, (capacity, self.dimension))
+        if self._centroids is not None:
+            self._resize("lists.npy", self._lists, (capacity,))
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+
+        vectors = np.array([node.get_embedding() for node in nodes], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        with open(os.path.join(self.path, "lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with self._lock:
+                self._refresh()
+                start, end = self._count, self._count + len(nodes)
+                self._reserve(len(nodes))
+                matrix = np.load(self.embeddings_path, mmap_mode="r+")
+                matrix[start:end] = vectors
+                matrix.flush()
+                lists_path = os.path.join(self.path, "lists.npy")
+                if self._centroids is not None:
+                    lists = np.load(lists_path, mmap_mode="r+")
+                    lists[start:end] = self._nearest(vectors, self._centroids)
+                    lists.flush()
+                    self._save_groups(lists, start, end, len(self._centroids))
+                    del lists
+                elif self.index == "ivf" and end >= self.train_size:
+                    centroids = self._train(matrix, end)
+                    lists = np.load(lists_path, mmap_mode="r")
+                    self._save_groups(lists, 0, end, len(centroids))
+                    del lists
+                    # Written last, the index exists for readers once its centroids do
+                    centroids_path = os.path.join(self.path, "centroids.npy")
+                    np.save(centroids_path + ".tmp.npy", centroids)
+                    os.replace(centroids_path + ".tmp.npy", centroids_path)
+                del matrix
+
+                # What node_to_metadata_dict stores, without walking the embedding,
+                # with only the last of the nodes that share an id kept
+                last = {node.node_id: row for row, node in enumerate(nodes, start)}
+                rows = [
+                    (
+                        row,
+                        node.node_id,
+                        node.ref_doc_id,
+                        node.class_name(),
+                        node.json(exclude={"embedding"}),
+                        int(last[node.node_id] != row),
+                    )
+                    for row, node in enumerate(nodes, start)
+                ]
+                with self._conn:
+                    self._conn.executemany(
+                        "UPDATE nodes SET deleted = 1 WHERE node_id = ?",
+                        [(node_id,) for node_id in last],
+                    )
+                    self._conn.executemany(
+                        "INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?)", rows
+                    )
+                    self._stamp()
+                self._data_version = None
+                self._refresh()
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """Marks the document's nodes deleted, their rows are left in place"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE nodes SET deleted = 1 WHERE ref_doc_id = ?", (ref_doc_id,)
+            )
+            self._stamp()
+            self._data_version = None
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM nodes")
+            self._stamp()
+            self._data_version = None
+
+    def _stamp(self) -> None:
+        """Renews the version, in the transaction of a write"""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('version', ?)", (uuid.uuid4().hex,)
+        )
+
+    def _nearest(self, vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """The index of the centroid nearest to each vector"""
+        nearest = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), 8192):
+            block = np.asarray(vectors[start : start + 8192], dtype=np.float32)
+            nearest[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return nearest
+
+    def _train(self, matrix: np.ndarray, count: int) -> np.ndarray:
+        """
+        Clusters a sample of the first `count` rows, assigns every row a list and
+        returns the centroids of the lists
+        """
+        rng = np.random.default_rng(0)
+        sample = matrix[
+            np.sort(rng.choice(count, min(count, 64 * self.n_lists), replace=False))
+        ].astype(np.float32)
+        centroids = sample[rng.choice(len(sample), self.n_lists, replace=False)]
+        for _ in range(self.kmeans_iterations):
+            nearest = self._nearest(sample, centroids)
+            sizes = np.bincount(nearest, minlength=self.n_lists)
+            # Sum the members of each list, lists left empty keep their centroid
+            filled = sizes > 0
+            offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+            sums = np.add.reduceat(
+                sample[np.argsort(nearest, kind="stable")], offsets[filled]
+            )
+            centroids[filled] = sums / np.linalg.norm(sums, axis=1, keepdims=True)
+
+        lists = np.lib.format.open_memmap(
+            os.path.join(self.path, "lists.npy"), "w+", np.int32, (len(matrix),)
+        )
+        lists[:count] = self._nearest(matrix[:count], centroids)
+        lists.flush()
+        del lists
+        return centroids
+
+    def _group(self, lists: np.ndarray, start: int, end: int, n_lists: int) -> None:
+        """
+        Groups the first `end` rows by list, merging rows start:end into the groups
+        of the rows before them if those are the ones held, else sorting them all
+        """
+        if not start or self._list_rows is None or len(self._list_rows) != start:
+            start, self._list_rows = 0, np.zeros(0, dtype=np.int32)
+            self._list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        new = lists[start:end]
+        order = np.argsort(new, kind="stable")
+        # Each new row goes at the end of its list, after the rows already in it
+        self._list_rows = np.insert(
+            self._list_rows,
+            self._list_offsets[new[order] + 1],
+            (order + start).astype(np.int32),
+        )
+        self._list_offsets = self._list_offsets + np.concatenate(
+            ([0], np.cumsum(np.bincount(new, minlength=n_lists)))
+        )
+
+    def _save_groups(
+        self, lists: np.ndarray, start: int, end: int, n_lists: int
+    ) -> None:
+        """Groups the rows by list and saves them, in add() before its commit"""
+        self._group(lists, start, end, n_lists)
+        for name, array in (
+            ("list_rows.npy", self._list_rows),
+            ("list_offsets.npy", self._list_offsets),
+        ):
+            path = os.path.join(self.path, name)
+            np.save(path + ".tmp.npy", array)
+            os.replace(path + ".tmp.npy", path)
+
+    def _probe(self, query: np.ndarray) -> np.ndarray:
+        """The rows of the `nprobe` lists nearest to the query, holding _lock"""
+        nprobe = min(self.nprobe, len(self._centroids))
+        probed = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+        rows = [
+            self._list_rows[self._list_offsets[i] : self._list_offsets[i + 1]]
+            for i in probed
+        ]
+        # Sorted, so the rows are read from the map in order, and without any that
+        # a write in progress grouped before committing them
+        rows = np.sort(np.concatenate(rows))
+        return rows[: np.searchsorted(rows, self._count)]
+
+    def _scores(
+        self, matrix: np.ndarray, deleted: np.ndarray, query: np.ndarray
+    ) -> np.ndarray:
+        if matrix.dtype == np.float32:
+            scores = matrix @ query
+        else:
+            scores = np.empty(len(matrix), dtype=np.float32)
+            for start in range(0, len(matrix), self.block_size):
+                block = matrix[start : start + self.block_size].astype(np.float32)
+                scores[start : start + len(block)] = block @ query
+        scores[deleted] = -np.inf
+        return scores
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None or query.doc_ids or query.node_ids:
+            raise NotImplementedError("LocalVectorStore doesn't support filters")
+
+        vector = np.asarray(query.query_embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        with self._lock:
+            self._refresh()
+            candidates = None
+            if self.index == "ivf" and self._centroids is not None:
+                candidates = self._probe(vector)
+            matrix = self._matrix[: self._count] if self._count else None
+            deleted = self._deleted[: self._count]
+
+        # Concurrent queries share the map, only the metadata reads take the lock
+        if matrix is None:
+            scores = np.zeros(0, dtype=np.float32)
+        elif candidates is None:
+            scores = self._scores(matrix, deleted, vector)
+        else:
+            scores = self._scores(matrix[candidates], deleted[candidates], vector)
+        k = min(query.similarity_top_k, len(scores))
+        if not k:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        top = top[np.isfinite(scores[top])]
+        similarities = scores[top].tolist()
+        if candidates is not None:
+            top = candidates[top]
+        top = top.tolist()
+
+        with self._lock:
+            rows = {
+                row: (node_type, node)
+                for row, node_type, node in self._conn.execute(
+                    "SELECT row, node_type, node FROM nodes WHERE row IN "
+                    f"({','.join('?' * len(top))})",
+                    top,
+                )
+            }
+        nodes = [
+            metadata_dict_to_node({"_node_type": node_type, "_node_content": node})
+            for node_type, node in (rows[row] for row in top)
+        ]
+        return VectorStoreQueryResult(
+            nodes=nodes,
+            similarities=similarities,
+            ids=[node.node_id for node in nodes],
+        )
+
+
+class CollectionVersions:
+    """
+    A version stamp per Astra DB collection, renewed by data/compile_documents.py
+    after each ingestion. Unlike a document count, it changes when a re-ingestion
+    replaces documents one for one. A LocalVectorStore stamps its own writes.
+    """
+
+    def __init__(self, config: Config):
+        from astrapy import DataAPIClient
+
+        database = DataAPIClient(config.astra_db_application_token).get_database(
+            config.astra_db_api_endpoint
+        )
+        self.collection = database.create_collection(
+            config.collection_versions_astra_collection, check_exists=False
+        )
+
+    def get(self, collection_name: str) -> str:
+        """The collection's stamp, empty until its first ingestion"""
+        document = self.collection.find_one({"_id": collection_name})
+        return document["version"] if document is not None else ""
+
+    def stamp(self, collection_name: str) -> str:
+        version = uuid.uuid4().hex
+        self.collection.find_one_and_replace(
+            {"_id": collection_name},
+            {"_id": collection_name, "version": version, "stamped_at": time.time()},
+            upsert=True,
+        )
+        return version
+
+
+def create_vector_store(
+    config: Config, dimension: int, collection_name: Optional[str] = None
+) -> BasePydanticVectorStore:
+    """The vector store configured for the app, holding the given collection"""
+    collection_name = collection_name or config.astra_db_table_name
+    if config.vector_store_backend == VectorStoreType.Local:
+        return LocalVectorStore(
+            os.path.join(config.local_vector_store_path, collection_name),
+            dimension,
+            dtype=config.local_vector_store_dtype,
+            index=config.local_vector_store_index,
+            n_lists=config.local_vector_store_ivf_lists,
+            nprobe=config.local_vector_store_ivf_nprobe,
+        )
+
+    return AstraDBVectorStore(
+        token=config.astra_db_application_token,
+        api_endpoint=config.astra_db_api_endpoint,
+        collection_name=collection_name,
+        embedding_dimension=dimension,
+    )
@@ -8,32 +8,40 @@ from llama_index.embeddings.langchain import LangchainEmbedding
 from llama_index.core.node_parser import SimpleNodeParser
 from llama_index.vector_stores.astra_db import AstraDBVectorStore
 
+from chatbot_api.embedding_cache import create_cached_embeddings
+from chatbot_api.lexical_index import create_lexical_index
+from chatbot_api.vector_store import CollectionVersions, create_vector_store
+from integrations.fake import FakeEmbeddings
 from integrations.google import init_gcp, GECKO_EMB_DIM
 from integrations.openai import OPENAI_EMB_DIM
 from pipeline.config import LLMProvider, load_config
 
 dotenv_path = ".env"
 load_dotenv(dotenv_path)
-astra_db_application_token = os.getenv("ASTRA_DB_APPLICATION_TOKEN")
-astra_db_api_endpoint = os.getenv("ASTRA_DB_API_ENDPOINT")
 
 
 config = load_config("config.yml")
 
 # Provider for LLM
 if config.llm_provider == LLMProvider.OpenAI:
-    embedding_model = LangchainEmbedding(
-        OpenAIEmbeddings(model=config.openai_embeddings_model)
-    )
+    embeddings_model_name = config.openai_embeddings_model
+    embeddings = OpenAIEmbeddings(model=embeddings_model_name)
+    embedding_dimension = OPENAI_EMB_DIM
+elif config.llm_provider == LLMProvider.Fake:
+    embeddings_model_name = f"fake-{config.fake_embeddings_dimension}"
+    embeddings = FakeEmbeddings(config.fake_embeddings_dimension)
+    embedding_dimension = config.fake_embeddings_dimension
 else:
     init_gcp(config)
-    embedding_model = LangchainEmbedding(
-        VertexAIEmbeddings(model_name=config.google_embeddings_model)
-    )
+    embeddings_model_name = config.google_embeddings_model
+    embeddings = VertexAIEmbeddings(model_name=embeddings_model_name)
+    embedding_dimension = GECKO_EMB_DIM
 
-embedding_dimension = (
-    OPENAI_EMB_DIM if config.llm_provider == LLMProvider.OpenAI else GECKO_EMB_DIM
+# Reuses chunk embeddings from previous runs when embedding_cache_path is set
+embedding_model = LangchainEmbedding(
+    create_cached_embeddings(config, embeddings, embeddings_model_name)
 )
+
 table_name = ""
 if len(sys.argv) < 2 or sys.argv[1] == "output":
     table_name = os.getenv("ASTRA_DB_TABLE_NAME")
@@ -44,35 +52,52 @@ elif sys.argv[1] == "recipe_sites":
 elif sys.argv[1] == "video_output":
     table_name = os.getenv("ASTRA_DB_TABLE_NAME_VIDEO")
 
-vectorstore = AstraDBVectorStore(
-    token= astra_db_application_token,
-    api_endpoint=astra_db_api_endpoint,
-    collection_name=table_name,
-    embedding_dimension=embedding_dimension,
-)
+# Astra DB, or with vector_store_backend: local a directory the app reads from
+vectorstore = create_vector_store(config, embedding_dimension, table_name)
+# The same chunks in a BM25 index, for hybrid search, None if it's disabled
+lexical_index = create_lexical_index(config, table_name)
+
+
+# The same on every run, so re-running replaces a document's chunks in the vector
+# store and lexical index instead of adding copies of them
+def chunk_id(i, document):
+    return f"{document.doc_id}_chunk_{i}"
+
 
 storage_context = StorageContext.from_defaults(vector_store=vectorstore)
 service_context = ServiceContext.from_defaults(
     llm=None,
     embed_model=embedding_model,
-    node_parser=SimpleNodeParser.from_defaults(
+    node_parser=SimpleNodeParser(
         # According to https://genai.stackexchange.com/questions/317/does-the-length-of-a-token-give-llms-a-preference-for-words-of-certain-lengths
         # tokens are ~4 chars on average, so estimating 1,000 char chunk_size & 500 char overlap as previously used
         chunk_size=1500,
         chunk_overlap=125,
+        id_func=chunk_id,
     ),
 )
 
 
 # Perform embedding and add to vectorstore
 def add_documents(folder_path):
-    documents = SimpleDirectoryReader(folder_path).load_data()
-    VectorStoreIndex.from_documents(
-        documents=documents,
+    # Documents are identified by their file path
+    documents = SimpleDirectoryReader(folder_path, filename_as_id=True).load_data()
+    nodes = service_context.node_parser.get_nodes_from_documents(
+        documents, show_progress=True
+    )
+    VectorStoreIndex(
+        nodes,
         storage_context=storage_context,
         service_context=service_context,
         show_progress=True,
     )
+    if lexical_index is not None:
+        lexical_index.add(nodes)
+        lexical_index.save()
+    # Clears the app's semantic cache of answers from the previous documents, a
+    # LocalVectorStore stamps its own writes
+    if isinstance(vectorstore, AstraDBVectorStore):
+        CollectionVersions(config).stamp(table_name)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 from .astra import *
 from .example import *
+from .fake import *
 from .google import *
 from .intercom import *
 from .openai import *
@@ -5,7 +5,7 @@ the prompt to the LLM, then prints the resulting question/answer pair upon reque
 
 NOTE: You must add this import to `integrations/__init__.py` in order for it to get added to the registry.
 """
-from typing import Any, Mapping
+from typing import Any, Mapping, Optional
 
 from pipeline import (
     BaseIntegration,
@@ -35,7 +35,12 @@ class ExampleResponseDecider(ExampleMixin, ResponseDecider):
         ), "Include 'question' field in the POST request"
         return ResponseDecision(
             should_return_early=False,
-            conversation_info={"question": request_body["question"]},
+            user_question=request_body["question"],
+            conversation_info={
+                "question": request_body["question"],
+                # Optional, lets the client continue a previous conversation
+                "conversation_id": request_body.get("conversation_id"),
+            },
         )
 
 
@@ -47,6 +52,7 @@ class ExampleUserContextCreator(ExampleMixin, UserContextCreator):
             user_question=conv_info["question"],
             persona="default",
             context_str="",
+            session_id=conv_info.get("conversation_id"),
         )
 
 
@@ -54,7 +60,12 @@ class ExampleResponseActor(ExampleMixin, ResponseActor):
     """An example of a response actor that takes action based on the chatbot response"""
 
     def take_action(
-        self, conv_info: Any, text_response: str, responses_from_vs: str, context: str
+        self,
+        conv_info: Any,
+        text_response: str,
+        responses_from_vs: str,
+        context: str,
+        idempotency_key: Optional[str] = None,
     ) -> None:
         print("Bot Response:")
         print(f"    Question: {conv_info['question']}")
@@ -0,0 +1,136 @@
+"""
+The "fake" llm_provider: deterministic embeddings and a canned, streamed answer, for
+running the assistant without network access or credentials, e.g. in tests and
+benchmarks. Delays mimic a real provider's latency and can be set in config.
+"""
+import asyncio
+import hashlib
+import time
+from typing import Any, Iterator, List, Sequence
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from llama_index.core.llms import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    CompletionResponse,
+    CompletionResponseGen,
+    CustomLLM,
+    LLMMetadata,
+    MessageRole,
+)
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+
+FAKE_RESPONSE = (
+    "Storage-Attached Indexing lets you query non-primary key columns in Cassandra. "
+    "Create the index with CREATE CUSTOM INDEX and query the column with a WHERE "
+    "clause."
+)
+
+
+class FakeEmbeddings(Embeddings):
+    """Unit vectors seeded from a hash of the text, sleeping `delay` seconds per call"""
+
+    def __init__(self, dimension: int, delay: float = 0.0):
+        self.dimension = dimension
+        self.delay = delay
+        self.calls = 0
+
+    def _embed(self, text: str) -> List[float]:
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        seed = int.from_bytes(digest[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.delay)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        time.sleep(self.delay)
+        return self._embed(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self._embed(text)
+
+
+class FakeLLM(CustomLLM):
+    """
+    Streams `response` word by word, after `ttft` seconds and then at
+    `tokens_per_second`, 0 for no delay. `eager` pays the time to first token when
+    the stream is requested, like providers that open the request up front, rather
+    than when the first token is read.
+    """
+
+    response: str = FAKE_RESPONSE
+    ttft: float = 0.0
+    tokens_per_second: float = 0.0
+    eager: bool = False
+    calls: int = 0
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="fake")
+
+    def _record(self, prompt: str) -> None:
+        self.calls += 1
+
+    def _deltas(self) -> Iterator[str]:
+        for i, word in enumerate(self.response.split(" ")):
+            yield word if i == 0 else " " + word
+
+    @llm_completion_callback()
+    def complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        self._record(prompt)
+        time.sleep(self.ttft)
+        return CompletionResponse(text=self.response)
+
+    @llm_completion_callback()
+    def stream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseGen:
+        self._record(prompt)
+        if self.eager:
+            time.sleep(self.ttft)
+
+        def gen() -> CompletionResponseGen:
+            if not self.eager:
+                time.sleep(self.ttft)
+            text = ""
+            for delta in self._deltas():
+                if self.tokens_per_second:
+                    time.sleep(1 / self.tokens_per_second)
+                text += delta
+                yield CompletionResponse(text=text, delta=delta)
+
+        return gen()
+
+    @llm_chat_callback()
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> ChatResponseAsyncGen:
+        self._record(self.messages_to_prompt(messages))
+        if self.eager:
+            await asyncio.sleep(self.ttft)
+
+        async def gen() -> ChatResponseAsyncGen:
+            if not self.eager:
+                await asyncio.sleep(self.ttft)
+            text = ""
+            for delta in self._deltas():
+                if self.tokens_per_second:
+                    await asyncio.sleep(1 / self.tokens_per_second)
+                text += delta
+                yield ChatResponse(
+                    message=ChatMessage(role=MessageRole.ASSISTANT, content=text),
+                    delta=delta,
+                )
+
+        return gen()
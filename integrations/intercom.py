@@ -1,21 +1,72 @@
+import asyncio
 import hashlib
 import hmac
+import random
 import re
 import json
+import logging
+import threading
+import time
 import bugsnag
-import requests
+import httpx
 
+from collections import OrderedDict
 from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
 from integrations.astra import get_persona
 from pipeline import (
     BaseIntegration,
     ResponseActor,
     ResponseDecider,
     ResponseDecision,
+    RequestBody,
     UserContext,
     UserContextCreator,
 )
-from typing import Any, Dict, List, Optional, Mapping, Union
+from pipeline.base_integration import integration_executor
+from pipeline.config import Config
+from pipeline.metrics import Counter, Gauge
+from pipeline.tracing import Span, span
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Mapping,
+    Set,
+    Tuple,
+    Union,
+)
+
+logger = logging.getLogger(__name__)
+
+INTERCOM_REQUESTS = Counter(
+    "chatbot_intercom_requests_total",
+    "Intercom API requests by response status, including retried ones",
+    ["method", "status"],
+)
+INTERCOM_RETRIES = Counter(
+    "chatbot_intercom_retries_total", "Intercom API requests retried", ["method"]
+)
+CONTACT_CACHE_REQUESTS = Counter(
+    "chatbot_intercom_contact_cache_requests_total",
+    "Lookups in the Intercom contact cache: fresh hits, stale hits served while "
+    "refreshing, and misses",
+    ["result"],
+)
+CONTACT_CACHE_HIT_RATIO = Gauge(
+    "chatbot_intercom_contact_cache_hit_ratio",
+    "Fresh and stale hits over lookups in the Intercom contact cache",
+)
+CONTACT_CACHE_ENTRIES = Gauge(
+    "chatbot_intercom_contact_cache_entries", "Contacts held in the contact cache"
+)
+CONTACT_CACHE_INVALIDATIONS = Counter(
+    "chatbot_intercom_contact_cache_invalidations_total",
+    "Contacts dropped from the cache because an Intercom contact webhook arrived",
+)
 
 # Pulled from https://developers.intercom.com/docs/references/rest-api/api.intercom.io/Conversations/conversation/
 DEFAULT_ALLOWED_DELIVERED_AS = [
@@ -28,71 +79,491 @@ DEFAULT_ALLOWED_DELIVERED_AS = [
 
 
 # Validate the webhook actually comes from Intercom servers
-def validate_signature(
-    header: Mapping[str, str], body: Mapping[str, Any], secret: str
-) -> bool:
+def validate_signature(header: Mapping[str, str], body: bytes, secret: str) -> bool:
     # Get the signature from the payload
     signature_header = header["X-Hub-Signature"]
     sha_name, signature = signature_header.split("=")
     if sha_name != "sha1":
         print("ERROR: X-Hub-Signature in payload headers was not sha1=****")
         return False
-    # Convert the dictionary to a JSON string
-    data_str = json.dumps(body)
-    data_bytes = data_str.encode("utf-8")
-
-    local_signature = hmac.new(
-        secret.encode("utf-8"), msg=data_bytes, digestmod=hashlib.sha1
-    )
+    # Sign the body exactly as it was sent, re-encoding it could change the bytes
+    local_signature = hmac.new(secret.encode("utf-8"), msg=body, digestmod=hashlib.sha1)
 
     # See if they match
     return hmac.compare_digest(local_signature.hexdigest(), signature)
 
 
+# Worth retrying, the request either wasn't processed or failed on Intercom's side
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Safe to send again even if Intercom may have processed the first one, e.g. after a
+# read timeout or a 5xx. Other methods, like POSTing a reply, would post it again, so
+# they are only retried if the request was never sent, or was throttled
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def _retry_delay(
+    response: Optional[httpx.Response],
+    attempt: int,
+    backoff_seconds: float,
+    max_delay_seconds: float,
+) -> float:
+    """Waits as long as Retry-After asks, if given, else backs off exponentially"""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after is not None:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0.0), max_delay_seconds)
+    delay = backoff_seconds * 2**attempt * random.uniform(0.5, 1.0)
+    return min(delay, max_delay_seconds)
+
+
+def _final_response(
+    trace: Optional[Span], response: httpx.Response, attempt: int
+) -> httpx.Response:
+    if trace is not None:
+        trace.set_attribute("status_code", response.status_code)
+        trace.set_attribute("attempts", attempt + 1)
+    # Retries didn't help, or weren't safe
+    if response.status_code in RETRY_STATUSES:
+        response.raise_for_status()
+    return response
+
+
+class IntercomClient:
+    """
+    Keep-alive, HTTP/2 connection pools to the Intercom API, one for sync callers and
+    one for async callers. Requests that fail to connect or get a 429 response are
+    retried up to `intercom_max_retries` times, and so are idempotent requests that
+    fail in any other way or get a 5xx. A 429 or 5xx that isn't retried, or is the
+    last attempt's, raises httpx.HTTPStatusError.
+    """
+
+    def __init__(self, config: Config):
+        self.max_retries = config.intercom_max_retries
+        self.backoff_seconds = config.intercom_retry_backoff_seconds
+        self.max_retry_delay_seconds = config.intercom_max_retry_delay_seconds
+        self._client_kwargs = dict(
+            base_url=config.intercom_api_url,
+            headers={
+                "Authorization": f"Bearer {config.intercom_token}",
+                "Accept": "application/json",
+            },
+            timeout=httpx.Timeout(
+                config.intercom_timeout_seconds,
+                connect=config.intercom_connect_timeout_seconds,
+            ),
+            limits=httpx.Limits(max_connections=config.intercom_max_connections),
+            http2=True,
+        )
+        self._lock = threading.Lock()
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing: Set[asyncio.Task] = set()
+
+    def _get_client(self) -> httpx.Client:
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(**self._client_kwargs)
+            return self._client
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        # Async connections belong to the event loop that opened them
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._loop is not loop:
+                old_loop, old_client = self._loop, self._async_client
+                self._loop = loop
+                self._async_client = httpx.AsyncClient(**self._client_kwargs)
+                if old_client is not None:
+                    self._close_replaced(old_loop, old_client)
+            return self._async_client
+
+    def _close_replaced(
+        self, loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient
+    ) -> None:
+        """Closes the pool of a previous event loop, on that loop if it still runs"""
+        if not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(_aclose_quietly(client), loop)
+            return
+        # Its connections can't be awaited anymore, only their sockets closed
+        task = asyncio.get_running_loop().create_task(_aclose_quietly(client))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def _should_retry(
+        self,
+        method: str,
+        response: Optional[httpx.Response],
+        error: Optional[httpx.TransportError],
+        attempt: int,
+    ) -> bool:
+        status = "error" if response is None else str(response.status_code)
+        INTERCOM_REQUESTS.inc(method=method, status=status)
+        if attempt == self.max_retries:
+            return False
+        if method.upper() in IDEMPOTENT_METHODS:
+            retry = response is None or response.status_code in RETRY_STATUSES
+        else:
+            retry = isinstance(error, UNSENT_ERRORS) or (
+                response is not None and response.status_code == 429
+            )
+        if retry:
+            INTERCOM_RETRIES.inc(method=method)
+        return retry
+
+    def request(self, method: str, path: str, **kwargs: Any) -> httpx.Response:
+        with span("intercom.request", method=method, path=path) as trace:
+            return self._request(trace, method, path, **kwargs)
+
+    async def arequest(self, method: str, path: str, **kwargs: Any) -> httpx.Response:
+        with span("intercom.request", method=method, path=path) as trace:
+            return await self._arequest(trace, method, path, **kwargs)
+
+    def _request(
+        self, trace: Optional[Span], method: str, path: str, **kwargs: Any
+    ) -> httpx.Response:
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = self._get_client().request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                if not self._should_retry(method, None, e, attempt):
+                    raise
+            else:
+                if not self._should_retry(method, response, None, attempt):
+                    return _final_response(trace, response, attempt)
+            time.sleep(
+                _retry_delay(
+                    response,
+                    attempt,
+                    self.backoff_seconds,
+                    self.max_retry_delay_seconds,
+                )
+            )
+
+    async def _arequest(
+        self, trace: Optional[Span], method: str, path: str, **kwargs: Any
+    ) -> httpx.Response:
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = await self._get_async_client().request(
+                    method, path, **kwargs
+                )
+            except httpx.TransportError as e:
+                if not self._should_retry(method, None, e, attempt):
+                    raise
+            else:
+                if not self._should_retry(method, response, None, attempt):
+                    return _final_response(trace, response, attempt)
+            await asyncio.sleep(
+                _retry_delay(
+                    response,
+                    attempt,
+                    self.backoff_seconds,
+                    self.max_retry_delay_seconds,
+                )
+            )
+
+    async def aclose(self) -> None:
+        with self._lock:
+            client, self._client = self._client, None
+            async_client, self._async_client = self._async_client, None
+            loop, self._loop = self._loop, None
+        if client is not None:
+            await asyncio.to_thread(client.close)
+        if async_client is not None:
+            if loop is asyncio.get_running_loop():
+                await async_client.aclose()
+            else:
+                self._close_replaced(loop, async_client)
+
+
+async def _aclose_quietly(client: httpx.AsyncClient) -> None:
+    try:
+        await client.aclose()
+    except Exception:
+        logger.debug("Error closing a replaced Intercom client", exc_info=True)
+
+
+Contact = Dict[str, Any]
+
+
+class ContactCache:
+    """
+    An LRU cache of Intercom contacts by id, fresh for `ttl_seconds`. Entries up to
+    `stale_seconds` past that are still served, and refreshed in the background so
+    the request doesn't wait on Intercom. Error responses are never cached.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, stale_seconds: float = 0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Contact]]" = OrderedDict()
+        # When each recently invalidated contact was, so that fetches started before
+        # an invalidation don't put the outdated contact back
+        self._invalidated: "OrderedDict[str, float]" = OrderedDict()
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+
+        CONTACT_CACHE_ENTRIES.set_function(lambda: len(self._entries))
+        CONTACT_CACHE_HIT_RATIO.set_function(self.hit_ratio)
+
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def _lookup(self, contact_id: str) -> Tuple[Optional[Contact], bool]:
+        """Returns the cached contact if it can be served, and whether to refresh it"""
+        with self._lock:
+            entry = self._entries.get(contact_id)
+            age = time.time() - entry[0] if entry is not None else None
+            if age is None or age > self.ttl_seconds + self.stale_seconds:
+                self.misses += 1
+                CONTACT_CACHE_REQUESTS.inc(result="miss")
+                return None, False
+
+            self._entries.move_to_end(contact_id)
+            self.hits += 1
+            if age <= self.ttl_seconds:
+                CONTACT_CACHE_REQUESTS.inc(result="hit")
+                return entry[1], False
+
+            CONTACT_CACHE_REQUESTS.inc(result="stale")
+            refresh = contact_id not in self._refreshing
+            self._refreshing.add(contact_id)
+            return entry[1], refresh
+
+    def put(self, contact_id: str, contact: Contact, fetched_at: float) -> None:
+        """Caches a contact fetched from Intercom at `fetched_at`"""
+        if contact.get("type") != "contact":
+            return
+        with self._lock:
+            if self._invalidated.get(contact_id, 0.0) >= fetched_at:
+                return
+            self._entries[contact_id] = (time.time(), contact)
+            self._entries.move_to_end(contact_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, contact_id: str) -> None:
+        with self._lock:
+            self._entries.pop(contact_id, None)
+            self._invalidated[contact_id] = time.time()
+            self._invalidated.move_to_end(contact_id)
+            while len(self._invalidated) > self.max_entries:
+                self._invalidated.popitem(last=False)
+        CONTACT_CACHE_INVALIDATIONS.inc()
+
+    def _refresh(self, contact_id: str, fetch: Callable[[str], Contact]) -> None:
+        fetched_at = time.time()
+        try:
+            self.put(contact_id, fetch(contact_id), fetched_at)
+        except Exception:
+            logger.warning("Failed to refresh Intercom contact", exc_info=True)
+        finally:
+            with self._lock:
+                self._refreshing.discard(contact_id)
+
+    async def _arefresh(
+        self, contact_id: str, fetch: Callable[[str], Awaitable[Contact]]
+    ) -> None:
+        fetched_at = time.time()
+        try:
+            self.put(contact_id, await fetch(contact_id), fetched_at)
+        except Exception:
+            logger.warning("Failed to refresh Intercom contact", exc_info=True)
+        finally:
+            with self._lock:
+                self._refreshing.discard(contact_id)
+
+    def get(self, contact_id: str, fetch: Callable[[str], Contact]) -> Contact:
+        """The cached contact, fetching it with `fetch` when missing or expired"""
+        contact, refresh = self._lookup(contact_id)
+        if refresh:
+            integration_executor.submit(self._refresh, contact_id, fetch)
+        if contact is not None:
+            return contact
+
+        fetched_at = time.time()
+        contact = fetch(contact_id)
+        self.put(contact_id, contact, fetched_at)
+        return contact
+
+    async def aget(
+        self, contact_id: str, fetch: Callable[[str], Awaitable[Contact]]
+    ) -> Contact:
+        """The async version of get"""
+        contact, refresh = self._lookup(contact_id)
+        if refresh:
+            # Hold a reference, the event loop only keeps a weak one
+            task = asyncio.create_task(self._arefresh(contact_id, fetch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if contact is not None:
+            return contact
+
+        fetched_at = time.time()
+        contact = await fetch(contact_id)
+        self.put(contact_id, contact, fetched_at)
+        return contact
+
+
+# One IntercomClient and ContactCache per API url and token, shared by the Intercom
+# integrations
+_intercom_clients: Dict[Tuple[str, Optional[str]], IntercomClient] = {}
+_contact_caches: Dict[Tuple[str, Optional[str]], ContactCache] = {}
+_intercom_clients_lock = threading.Lock()
+
+
 class IntercomIntegrationMixin(BaseIntegration):
     required_fields = ["bot_intercom_id", "intercom_token", "intercom_client_secret"]
 
+    @property
+    def intercom(self) -> IntercomClient:
+        key = (self.config.intercom_api_url, self.config.intercom_token)
+        with _intercom_clients_lock:
+            if key not in _intercom_clients:
+                _intercom_clients[key] = IntercomClient(self.config)
+            return _intercom_clients[key]
+
+    @property
+    def contact_cache(self) -> Optional[ContactCache]:
+        if not self.config.intercom_contact_cache_enabled:
+            return None
+        key = (self.config.intercom_api_url, self.config.intercom_token)
+        with _intercom_clients_lock:
+            if key not in _contact_caches:
+                _contact_caches[key] = ContactCache(
+                    self.config.intercom_contact_cache_max_entries,
+                    self.config.intercom_contact_cache_ttl_seconds,
+                    self.config.intercom_contact_cache_stale_seconds,
+                )
+            return _contact_caches[key]
+
+    # Get a contact through the contact cache, if enabled
+    def get_contact(self, contact_id: str) -> Dict[str, Any]:
+        contact_cache = self.contact_cache
+        if contact_cache is None:
+            return self.get_intercom_contact_by_id(contact_id)
+        return contact_cache.get(contact_id, self.get_intercom_contact_by_id)
+
+    async def aget_contact(self, contact_id: str) -> Dict[str, Any]:
+        contact_cache = self.contact_cache
+        if contact_cache is None:
+            return await self.aget_intercom_contact_by_id(contact_id)
+        return await contact_cache.aget(contact_id, self.aget_intercom_contact_by_id)
+
+    async def shutdown(self) -> None:
+        key = (self.config.intercom_api_url, self.config.intercom_token)
+        with _intercom_clients_lock:
+            client = _intercom_clients.pop(key, None)
+        if client is not None:
+            await client.aclose()
+
+    def _reply_payload(self, message: str, message_type: str) -> Dict[str, Any]:
+        return {
+            "type": "admin",
+            "admin_id": self.config.bot_intercom_id,
+            "message_type": message_type,
+            "body": message,
+        }
+
     # Get an Intercom contact/lead using the Intercom UUID
     def get_intercom_contact_by_id(self, _id: Union[int, str]) -> Dict[str, Any]:
-        headers = {"Authorization": f"Bearer {self.config.intercom_token}"}
-        res = requests.get(f"https://api.intercom.io/contacts/{_id}", headers=headers)
-        return res.json()
+        return self.intercom.request("GET", f"/contacts/{_id}").json()
+
+    async def aget_intercom_contact_by_id(
+        self, _id: Union[int, str]
+    ) -> Dict[str, Any]:
+        return (await self.intercom.arequest("GET", f"/contacts/{_id}")).json()
 
     def add_comment_to_intercom_conversation(
         self,
         conversation_id: str,
         message: str,
     ) -> Dict[str, Any]:
-        headers = {"Authorization": f"Bearer {self.config.intercom_token}"}
-        res = requests.post(
-            f"https://api.intercom.io/conversations/{conversation_id}/reply",
-            headers=headers,
-            json={
-                "message_type": "note",
-                "type": "admin",
-                "admin_id": self.config.bot_intercom_id,
-                "body": message,
-            },
+        return self.intercom.request(
+            "POST",
+            f"/conversations/{conversation_id}/reply",
+            json=self._reply_payload(message, "note"),
+        ).json()
+
+    async def aadd_comment_to_intercom_conversation(
+        self,
+        conversation_id: str,
+        message: str,
+    ) -> Dict[str, Any]:
+        response = await self.intercom.arequest(
+            "POST",
+            f"/conversations/{conversation_id}/reply",
+            json=self._reply_payload(message, "note"),
         )
-        return res.json()
+        return response.json()
 
     # Reply to an existing Intercom conversation
     def send_intercom_message(
         self, conversation_id: str, message: str
     ) -> Dict[str, Any]:
-        headers = {"Authorization": f"Bearer {self.config.intercom_token}"}
-        payload = {
-            "type": "admin",
-            "admin_id": self.config.bot_intercom_id,
-            "message_type": "comment",
-            "body": message,
-        }
-        res = requests.post(
-            f"https://api.intercom.io/conversations/{conversation_id}/reply",
-            json=payload,
-            headers=headers,
+        return self.intercom.request(
+            "POST",
+            f"/conversations/{conversation_id}/reply",
+            json=self._reply_payload(message, "comment"),
+        ).json()
+
+    async def asend_intercom_message(
+        self, conversation_id: str, message: str
+    ) -> Dict[str, Any]:
+        response = await self.intercom.arequest(
+            "POST",
+            f"/conversations/{conversation_id}/reply",
+            json=self._reply_payload(message, "comment"),
+        )
+        return response.json()
+
+    # Whether the bot already posted the message to the conversation
+    def has_intercom_reply(
+        self, conversation_id: str, message: str, message_type: str
+    ) -> bool:
+        response = self.intercom.request(
+            "GET",
+            f"/conversations/{conversation_id}",
+            params={"display_as": "plaintext"},
+        )
+        return self._has_reply(response.json(), message, message_type)
+
+    async def ahas_intercom_reply(
+        self, conversation_id: str, message: str, message_type: str
+    ) -> bool:
+        response = await self.intercom.arequest(
+            "GET",
+            f"/conversations/{conversation_id}",
+            params={"display_as": "plaintext"},
+        )
+        return self._has_reply(response.json(), message, message_type)
+
+    def _has_reply(
+        self, conversation: Dict[str, Any], message: str, message_type: str
+    ) -> bool:
+        parts = conversation.get("conversation_parts", {}).get("conversation_parts", [])
+        return any(
+            part.get("part_type") == message_type
+            and str(part.get("author", {}).get("id")) == self.config.bot_intercom_id
+            and " ".join((part.get("body") or "").split()) == " ".join(message.split())
+            for part in parts
         )
-        return res.json()
 
 
 @dataclass
@@ -100,11 +571,12 @@ class IntercomConversationInfo:
     """A class representing all the required attributes from the chatbot to give a response"""
 
     conversation_id: str
-    contact: Dict[str, Any]
+    contact: Optional[Dict[str, Any]]
     user_question: str
     is_user: bool
     debug_mode: bool
     source_url: str
+    contact_id: Optional[str] = None
 
 
 class IntercomResponseDecider(IntercomIntegrationMixin, ResponseDecider):
@@ -114,7 +586,7 @@ class IntercomResponseDecider(IntercomIntegrationMixin, ResponseDecider):
 
     def make_response_decision(
         self,
-        request_body: Mapping[str, Any],
+        request_body: RequestBody,
         request_headers: Mapping[str, str],
         allowed_delivered_as: Optional[List[str]] = None,
     ) -> ResponseDecision:
@@ -124,13 +596,22 @@ class IntercomResponseDecider(IntercomIntegrationMixin, ResponseDecider):
 
         # Don't allow invalid signatures
         if not validate_signature(
-            request_headers, request_body, self.config.intercom_client_secret
+            request_headers, request_body.raw, self.config.intercom_client_secret
         ):
             return ResponseDecision(
                 should_return_early=True,
                 response_dict={"ok": False, "message": "Invalid signature."},
                 response_code=401,
             )
+        # Contact webhooks, e.g. contact.user.updated, mean the cached copy is stale
+        if (request_body.get("topic") or "").startswith("contact."):
+            if self.contact_cache is not None:
+                self.contact_cache.invalidate(request_body["data"]["item"]["id"])
+            return ResponseDecision(
+                should_return_early=True,
+                response_dict={"ok": True, "message": "Contact updated."},
+                response_code=200,
+            )
         # Ignore repeat deliveries
         if request_body["delivery_attempts"] > 1:
             return ResponseDecision(
@@ -158,19 +639,17 @@ class IntercomResponseDecider(IntercomIntegrationMixin, ResponseDecider):
 
         # Find relevant part of intercom conversation for most recent message
         conversation_parts = data["item"]["conversation_parts"]["conversation_parts"]
-        filtered_conversation_parts = [
-            part
-            for part in conversation_parts
-            if part.get("part_type") != "default_assignment"
-            and part.get("body")  # Filter for nulls and empty strings
-        ]
-
         # Use conversation parts if available (means user responded in the convo),
         # otherwise use the source (means user initiated a convo)
-        if len(filtered_conversation_parts) > 0:
-            conv_item = filtered_conversation_parts[0]
-        else:
-            conv_item = data["item"]["source"]
+        conv_item = next(
+            (
+                part
+                for part in conversation_parts
+                if part.get("part_type") != "default_assignment"
+                and part.get("body")  # Filter for nulls and empty strings
+            ),
+            data["item"]["source"],
+        )
 
         conversation_text = conv_item["body"]
         author = conv_item["author"]
@@ -205,23 +684,58 @@ class IntercomResponseDecider(IntercomIntegrationMixin, ResponseDecider):
                 response_code=400,
             )
 
+        # Intercom can deliver the same conversation part more than once
+        idempotency_key = hashlib.sha256(
+            json.dumps(
+                [data["item"]["id"], conv_item.get("id"), conversation_text]
+            ).encode("utf-8")
+        ).hexdigest()
+
         # If we passed every check above, should proceed with querying the LLM
         return ResponseDecision(
             should_return_early=False,
+            idempotency_key=idempotency_key,
+            user_question=user_question,
             conversation_info=IntercomConversationInfo(
                 conversation_id=data["item"]["id"],
-                contact=self.get_intercom_contact_by_id(author["id"]),
+                contact=None,  # Looked up by IntercomUserContextCreator
                 user_question=user_question,
                 is_user=f"@{self.config.company_url}" in author["email"]
                 and self.config.company_url != "",
                 debug_mode="[DEBUG]" in user_question,
                 source_url=data["item"]["source"]["url"],
+                contact_id=author["id"],
             ),
         )
 
 
 class IntercomUserContextCreator(IntercomIntegrationMixin, UserContextCreator):
     def create_user_context(self, conv_info: IntercomConversationInfo) -> UserContext:
+        if conv_info.contact is None and conv_info.contact_id is not None:
+            conv_info.contact = self.get_contact(conv_info.contact_id)
+        user_context = self._build_user_context(conv_info)
+
+        # Send an intercom debug message if debug mode is on
+        if conv_info.debug_mode:
+            self.send_intercom_message(
+                conv_info.conversation_id, self._debug_message(user_context)
+            )
+        return user_context
+
+    async def acreate_user_context(
+        self, conv_info: IntercomConversationInfo
+    ) -> UserContext:
+        if conv_info.contact is None and conv_info.contact_id is not None:
+            conv_info.contact = await self.aget_contact(conv_info.contact_id)
+        user_context = self._build_user_context(conv_info)
+        if conv_info.debug_mode:
+            await self.asend_intercom_message(
+                conv_info.conversation_id, self._debug_message(user_context)
+            )
+        return user_context
+
+    @staticmethod
+    def _build_user_context(conv_info: IntercomConversationInfo) -> UserContext:
         # Grab needed parameters
         conversation_id = conv_info.conversation_id  # Astra User Id
 
@@ -238,30 +752,52 @@ class IntercomUserContextCreator(IntercomIntegrationMixin, UserContextCreator):
                 f"- User Email: {conv_info.contact['email']}\n"
             )
 
-        # Send an intercom debug message if debug mode is on
-        if conv_info.debug_mode:
-            self.send_intercom_message(
-                conversation_id,
-                f"Generating response: "
-                f"\nContext: {context_str}\n"
-                f"\nQuestion: {conv_info.user_question}\n",
-            )
-
         return UserContext(
             user_question=conv_info.user_question,
             persona=get_persona(conv_info.contact),
             context_str=context_str,
+            session_id=conversation_id,
+        )
+
+    @staticmethod
+    def _debug_message(user_context: UserContext) -> str:
+        return (
+            f"Generating response: "
+            f"\nContext: {user_context.context_str}\n"
+            f"\nQuestion: {user_context.user_question}\n"
         )
 
 
 class IntercomResponseActor(IntercomIntegrationMixin, ResponseActor):
+    """
+    Posts the response to the conversation. Intercom replies take no idempotency
+    key, so given one, as by the ActorEngine, which may replay a job whose worker
+    crashed after posting, the actor first looks for the reply in the conversation
+    and skips posting it again.
+    """
+
+    @staticmethod
+    def _reply(conv_info: IntercomConversationInfo, text_response: str):
+        """The reply and its type, a message to users or else a note for the team"""
+        if conv_info.is_user:
+            return text_response, "comment"
+        return f"Assistant Suggested Response: {text_response}", "note"
+
     def take_action(
         self,
         conv_info: IntercomConversationInfo,
         text_response: str,
         responses_from_vs: str,
         context: str,
+        idempotency_key: Optional[str] = None,
     ) -> None:
+        message, message_type = self._reply(conv_info, text_response)
+        if idempotency_key is not None and self.has_intercom_reply(
+            conv_info.conversation_id, message, message_type
+        ):
+            logger.info("Already replied for %s, skipping", idempotency_key)
+            return
+
         # One more debugging message
         if conv_info.debug_mode:
             self.send_intercom_message(
@@ -270,11 +806,10 @@ class IntercomResponseActor(IntercomIntegrationMixin, ResponseActor):
 
         # Either comment or message based on whether its a current user
         if conv_info.is_user:
-            self.send_intercom_message(conv_info.conversation_id, text_response)
+            self.send_intercom_message(conv_info.conversation_id, message)
         else:
             self.add_comment_to_intercom_conversation(
-                conv_info.conversation_id,
-                f"Assistant Suggested Response: {text_response}",
+                conv_info.conversation_id, message
             )
 
         # Return the result with the full response if desired
@@ -283,3 +818,30 @@ class IntercomResponseActor(IntercomIntegrationMixin, ResponseActor):
             result["response"] = text_response
         if self.config.intercom_include_context:
             result["context"] = context
+
+    async def atake_action(
+        self,
+        conv_info: IntercomConversationInfo,
+        text_response: str,
+        responses_from_vs: str,
+        context: str,
+        idempotency_key: Optional[str] = None,
+    ) -> None:
+        message, message_type = self._reply(conv_info, text_response)
+        if idempotency_key is not None and await self.ahas_intercom_reply(
+            conv_info.conversation_id, message, message_type
+        ):
+            logger.info("Already replied for %s, skipping", idempotency_key)
+            return
+
+        if conv_info.debug_mode:
+            await self.asend_intercom_message(
+                conv_info.conversation_id, "\nDocuments retrieved: " + responses_from_vs
+            )
+
+        if conv_info.is_user:
+            await self.asend_intercom_message(conv_info.conversation_id, message)
+        else:
+            await self.aadd_comment_to_intercom_conversation(
+                conv_info.conversation_id, message
+            )
@@ -1,21 +1,30 @@
-from typing import Any
+from typing import Any, Optional
 
 import requests
 
 from pipeline import ResponseActor
+from pipeline.tracing import span
 
 
 class SlackResponseActor(ResponseActor):
     required_fields = ["slack_webhook_url"]
 
     def send_slack_message(self, message: str) -> None:
-        requests.post(
-            self.config.slack_webhook_url,
-            json={"text": message, "username": "AI Bot", "icon_emoji": ":ghost:"},
-        )
+        with span("slack.request", method="POST") as trace:
+            response = requests.post(
+                self.config.slack_webhook_url,
+                json={"text": message, "username": "AI Bot", "icon_emoji": ":ghost:"},
+            )
+            if trace is not None:
+                trace.set_attribute("status_code", response.status_code)
 
     def take_action(
-        self, conv_info: Any, text_response: str, responses_from_vs: str, context: str
+        self,
+        conv_info: Any,
+        text_response: str,
+        responses_from_vs: str,
+        context: str,
+        idempotency_key: Optional[str] = None,
     ) -> None:
         self.send_slack_message("*PROMPT*")
         self.send_slack_message(context)
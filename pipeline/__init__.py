@@ -1,8 +1,17 @@
-from .base_integration import BaseIntegration
-from .response_action import ResponseActor, take_all_actions
+from .actor_engine import ActorEngine
+from .base_integration import BaseIntegration, IntegrationSet
+from .job_queue import JobQueue
+from .request_body import RequestBody
+from .response_action import ResponseActor, atake_all_actions, take_all_actions
 from .response_decision import (
     ResponseDecider,
     ResponseDecision,
+    amake_all_response_decisions,
     make_all_response_decisions,
 )
-from .user_context import UserContext, UserContextCreator, create_all_user_context
+from .user_context import (
+    UserContext,
+    UserContextCreator,
+    acreate_all_user_context,
+    create_all_user_context,
+)
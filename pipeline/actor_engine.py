@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, List, Optional, Set
+
+from .base_integration import IntegrationSet, get_integration
+from .config import Config
+from .metrics import Counter, Gauge, Histogram, time_stage
+from .outbox import Outbox, OutboxEntry, response_key
+from .response_action import ResponseActor
+from .tracing import Span, current_span, span, use_span
+
+logger = logging.getLogger(__name__)
+
+ACTOR_JOBS = Counter(
+    "chatbot_actor_jobs_total",
+    "ResponseActor jobs by outcome: succeeded, failed after retries, or shed",
+    ["actor", "result"],
+)
+ACTOR_RETRIES = Counter(
+    "chatbot_actor_retries_total", "ResponseActor attempts that were retried", ["actor"]
+)
+ACTOR_TIMEOUTS = Counter(
+    "chatbot_actor_timeouts_total",
+    "ResponseActor attempts still running after the timeout",
+    ["actor"],
+)
+ACTOR_SECONDS = Histogram(
+    "chatbot_actor_seconds",
+    "Time from queueing a ResponseActor job to its last attempt finishing",
+    ["actor"],
+)
+ACTOR_QUEUE_DEPTH = Gauge(
+    "chatbot_actor_queue_depth", "ResponseActor jobs waiting for a worker"
+)
+ACTOR_REPLAYED = Counter(
+    "chatbot_actor_replayed_total",
+    "Pending ResponseActor jobs replayed from the outbox after their worker stopped",
+    ["actor"],
+)
+
+
+@dataclass
+class ActorJob:
+    actor: ResponseActor
+    conv_info: Any
+    text_response: str
+    responses_from_vs: str
+    context: str
+    queued_at: float
+    key: str  # Idempotency key, also that of the job's OutboxEntry
+    trace: Optional[Span] = None  # The span of the request, if it is traced
+
+
+class ActorEngine:
+    """
+    Runs the configured ResponseActors in the background, so a response can finish
+    streaming without waiting on them. Each actor of a response is a separate job
+    on a bounded queue served by `num_workers` tasks, jobs that don't fit are shed.
+    A job is attempted up to `max_retries` more times, with exponential backoff, if
+    it raises. An attempt still running after `timeout_seconds` frees its worker,
+    and is cancelled and retried only if the actor is idempotent. Otherwise it may
+    still deliver, a thread can't be cancelled anyway, so it runs on in the
+    background and the job's outcome is that of the attempt once it ends.
+
+    Each job has an idempotency key, the same for every delivery of the request, or
+    else of the response, and passed to the actor. If config.outbox_path is set, jobs
+    are journaled to an Outbox before they are queued, unless their key already is,
+    and marked once they succeed or give up. Jobs still pending when their worker
+    stops, including shed ones, are replayed by the next engine to start on the
+    outbox, or by another worker sharing it. A worker that crashed stops renewing
+    its lease on its jobs, so they are replayed once `outbox_lease_seconds` pass.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        integrations: Optional[IntegrationSet] = None,
+    ):
+        self.config = config
+        self.integrations = integrations
+        self.num_workers = config.actor_workers
+        self.queue_size = config.actor_queue_size
+        self.timeout_seconds = config.actor_timeout_seconds
+        self.max_retries = config.actor_max_retries
+        self.backoff_seconds = config.actor_retry_backoff_seconds
+        self.outbox: Optional[Outbox] = None
+        if config.outbox_path is not None:
+            self.outbox = Outbox(
+                config.outbox_path,
+                sync_mode=config.outbox_sync_mode,
+                retention_seconds=config.outbox_retention_seconds,
+                lease_seconds=config.outbox_lease_seconds,
+            )
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        # Renewing this worker's leases in the outbox, and replaying abandoned jobs
+        self._outbox_tasks: List[asyncio.Task] = []
+        # Attempts that outlived the timeout, and the jobs they finish
+        self._overdue: Set[asyncio.Task] = set()
+
+        ACTOR_QUEUE_DEPTH.set_function(
+            lambda: self._queue.qsize() if self._queue is not None else 0
+        )
+
+    def _ensure_started(self) -> asyncio.Queue:
+        # Workers belong to the event loop that serves requests, normally started
+        # from the app lifespan, but also started on first use without one
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue(self.queue_size)
+            self._workers = [
+                loop.create_task(self._work()) for _ in range(self.num_workers)
+            ]
+        return self._queue
+
+    def _get_actor(self, cls_name: str) -> ResponseActor:
+        response_actor = get_integration(self.config, cls_name, self.integrations)
+        assert isinstance(
+            response_actor, ResponseActor
+        ), f"Must only specify ResponseActor in response_actor_cls"
+        return response_actor
+
+    async def start(self) -> None:
+        self._ensure_started()
+        if self.outbox is not None:
+            self._outbox_tasks = [
+                asyncio.create_task(self._renew_leases()),
+                asyncio.create_task(self._replay_abandoned()),
+            ]
+
+    async def _renew_leases(self) -> None:
+        while True:
+            await asyncio.sleep(self.outbox.lease_seconds / 3)
+            await asyncio.to_thread(self.outbox.renew)
+
+    async def _replay_abandoned(self) -> None:
+        while True:
+            for entry in await asyncio.to_thread(self.outbox.claim_abandoned):
+                job = ActorJob(
+                    self._get_actor(entry.actor),
+                    entry.conv_info,
+                    entry.text_response,
+                    entry.responses_from_vs,
+                    entry.context,
+                    queued_at=time.monotonic(),
+                    key=entry.key,
+                )
+                # Wait for room rather than shedding, these were already accepted
+                await self._queue.put(job)
+                ACTOR_REPLAYED.inc(actor=entry.actor)
+            await asyncio.sleep(self.outbox.lease_seconds)
+
+    async def stop(self, drain_timeout_seconds: float = 10.0) -> None:
+        """Waits up to `drain_timeout_seconds` for queued jobs, then stops workers"""
+        if self._queue is None:
+            return
+
+        for task in self._outbox_tasks:
+            task.cancel()
+        await asyncio.gather(*self._outbox_tasks, return_exceptions=True)
+        self._outbox_tasks = []
+        deadline = time.monotonic() + drain_timeout_seconds
+        try:
+            await asyncio.wait_for(self._queue.join(), drain_timeout_seconds)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %d queued actor jobs", self._queue.qsize())
+        if self._overdue:
+            _, overdue = await asyncio.wait(
+                self._overdue, timeout=max(deadline - time.monotonic(), 0)
+            )
+            if overdue:
+                # Left pending in the outbox, if there is one, to be replayed by the
+                # next worker on it
+                logger.warning("Abandoning %d overdue actor jobs", len(overdue))
+                for task in overdue:
+                    task.cancel()
+                await asyncio.gather(*overdue, return_exceptions=True)
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._loop, self._queue, self._workers = None, None, []
+        if self.outbox is not None:
+            self.outbox.close()
+
+    async def submit(
+        self,
+        conv_info: Any,
+        text_response: str,
+        responses_from_vs: str,
+        context: str,
+        idempotency_key: Optional[str] = None,
+    ) -> None:
+        """
+        Queues a job per configured ResponseActor. Returns once they are in the
+        outbox, if there is one, without waiting for the actors to run.
+        `idempotency_key` identifies redeliveries of the request, if it can tell.
+        """
+        queue = self._ensure_started()
+        response_id = idempotency_key or response_key(
+            conv_info, text_response, context
+        )
+        jobs = [
+            ActorJob(
+                self._get_actor(cls_name),
+                conv_info,
+                text_response,
+                responses_from_vs,
+                context,
+                queued_at=time.monotonic(),
+                key=f"{response_id}:{cls_name}",
+                trace=current_span(),
+            )
+            for cls_name in self.config.response_actor_cls
+        ]
+
+        if self.outbox is not None:
+            added = await self.outbox.append(
+                [
+                    OutboxEntry(
+                        job.key,
+                        type(job.actor).__name__,
+                        conv_info,
+                        text_response,
+                        responses_from_vs,
+                        context,
+                        created_at=time.time(),
+                    )
+                    for job in jobs
+                ]
+            )
+            # The others were submitted before, and are done or on their way
+            jobs = [job for job in jobs if job.key in added]
+
+        for job in jobs:
+            cls_name = type(job.actor).__name__
+            try:
+                queue.put_nowait(job)
+            except asyncio.QueueFull:
+                logger.warning("Actor queue is full, shedding %s", cls_name)
+                ACTOR_JOBS.inc(actor=cls_name, result="shed")
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _attempt(self, job: ActorJob, attempt: int) -> None:
+        name = type(job.actor).__name__
+        provider = self.config.llm_provider.value
+        with time_stage("action", provider, name), use_span(job.trace), span(
+            "pipeline.response_action", integration=name, attempt=attempt
+        ):
+            await job.actor.atake_action(
+                job.conv_info,
+                job.text_response,
+                job.responses_from_vs,
+                job.context,
+                idempotency_key=job.key,
+            )
+
+    async def _run(self, job: ActorJob) -> None:
+        name = type(job.actor).__name__
+        for attempt in range(self.max_retries + 1):
+            task = asyncio.create_task(self._attempt(job, attempt))
+            await asyncio.wait([task], timeout=self.timeout_seconds)
+            last = attempt == self.max_retries
+            if not task.done():
+                ACTOR_TIMEOUTS.inc(actor=name)
+                if last or not job.actor.idempotent:
+                    logger.warning("%s is still running after the timeout", name)
+                    overdue = asyncio.create_task(self._finish_overdue(job, task))
+                    self._overdue.add(overdue)
+                    overdue.add_done_callback(self._overdue.discard)
+                    return
+                task.cancel()
+            elif task.exception() is None:
+                await self._finish(job, "done")
+                return
+            elif last:
+                logger.error(
+                    "%s failed after %d attempts",
+                    name,
+                    attempt + 1,
+                    exc_info=task.exception(),
+                )
+                await self._finish(job, "failed")
+                return
+
+            ACTOR_RETRIES.inc(actor=name)
+            delay = self.backoff_seconds * 2**attempt
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+    async def _finish_overdue(self, job: ActorJob, task: asyncio.Task) -> None:
+        try:
+            await task
+        except Exception:
+            logger.exception("%s failed after the timeout", type(job.actor).__name__)
+            await self._finish(job, "failed")
+        else:
+            await self._finish(job, "done")
+
+    async def _finish(self, job: ActorJob, status: str) -> None:
+        name = type(job.actor).__name__
+        result = "succeeded" if status == "done" else "failed"
+        ACTOR_JOBS.inc(actor=name, result=result)
+        ACTOR_SECONDS.observe(time.monotonic() - job.queued_at, actor=name)
+        if self.outbox is not None:
+            await asyncio.to_thread(self.outbox.mark, job.key, status)
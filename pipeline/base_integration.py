@@ -1,10 +1,16 @@
 import abc
-from typing import Dict, List, Type
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Type
 
 from .config import Config
 
 integrations_registry: Dict[str, Type["BaseIntegration"]] = {}
 
+# Runs the sync integration methods of a request side by side
+integration_executor = ThreadPoolExecutor(
+    max_workers=16, thread_name_prefix="integration"
+)
+
 
 class BaseIntegration(metaclass=abc.ABCMeta):
     required_fields: List[str]  # A list of config fields needed for this integration
@@ -17,3 +23,55 @@ class BaseIntegration(metaclass=abc.ABCMeta):
 
     def __init__(self, config: Config):
         self.config = config
+
+    async def startup(self) -> None:
+        """Called once per worker before serving requests, e.g. to open clients"""
+
+    async def shutdown(self) -> None:
+        """Called once per worker when the app stops, release what startup acquired"""
+
+
+class IntegrationSet:
+    """
+    One instance of every integration named in config, shared by all the requests a
+    worker serves, so integrations can keep clients and caches between requests.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.instances: Dict[str, BaseIntegration] = {}
+        cls_names = (
+            config.response_decider_cls
+            + config.user_context_creator_cls
+            + config.response_actor_cls
+        )
+        for cls_name in cls_names:
+            if cls_name not in self.instances:
+                self.instances[cls_name] = integrations_registry[cls_name](config)
+
+    def get(self, cls_name: str) -> BaseIntegration:
+        return self.instances[cls_name]
+
+    async def startup(self) -> None:
+        for integration in self.instances.values():
+            await integration.startup()
+
+    async def shutdown(self) -> None:
+        # Stop in reverse order, and stop every integration even if one fails
+        error = None
+        for integration in reversed(list(self.instances.values())):
+            try:
+                await integration.shutdown()
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+
+def get_integration(
+    config: Config, cls_name: str, integrations: Optional[IntegrationSet] = None
+) -> BaseIntegration:
+    """The shared instance from `integrations` if given, else a new instance"""
+    if integrations is not None:
+        return integrations.get(cls_name)
+    return integrations_registry[cls_name](config)
@@ -1,6 +1,6 @@
 import os
 from enum import Enum
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 from pydantic import BaseModel, model_validator
 import yaml
@@ -25,6 +25,18 @@ SENSITIVE_FIELDS = [
 class LLMProvider(str, Enum):
     OpenAI = "openai"
     Google = "google"
+    Fake = "fake"  # Offline stand-in for tests and benchmarks, see integrations/fake.py
+
+
+class SessionBackendType(str, Enum):
+    Memory = "memory"
+    SQLite = "sqlite"
+    Astra = "astra"
+
+
+class VectorStoreType(str, Enum):
+    Astra = "astra"
+    Local = "local"  # Memory-mapped NumPy matrix, see chatbot_api/vector_store.py
 
 
 class Config(BaseModel):
@@ -43,6 +55,47 @@ class Config(BaseModel):
     user_context_creator_cls: List[str]
     response_actor_cls: List[str]
 
+    # Deciders and context creators of a request run concurrently, each within these
+    response_decider_timeout_seconds: float = 10.0
+    user_context_timeout_seconds: float = 10.0
+    user_context_token_budget: Optional[int] = 1000
+
+    # ResponseActors run in the background once a response has finished streaming
+    actor_workers: int = 4
+    actor_queue_size: int = 1000
+    actor_timeout_seconds: float = 30.0
+    actor_max_retries: int = 2
+    actor_retry_backoff_seconds: float = 1.0
+    actor_drain_timeout_seconds: float = 10.0
+
+    # Answer /chat with 202 once the response decision is made, and generate the
+    # response in the background, for webhooks that expect a fast acknowledgement
+    fast_ack_enabled: bool = False
+    fast_ack_workers: int = 4
+    fast_ack_queue_size: int = 100
+
+    # Answer redelivered webhooks from the first delivery's response, across workers if
+    # a SQLite path is set
+    idempotency_enabled: bool = True
+    idempotency_sqlite_path: Optional[str] = None
+    idempotency_ttl_seconds: int = 86400
+    idempotency_lease_seconds: int = 300
+
+    # Journal response actions to a SQLite outbox in this directory, to replay those
+    # left pending by a restart. Workers on a host can share it: each replays only the
+    # actions of workers that stopped, or crashed outbox_lease_seconds ago
+    outbox_path: Optional[str] = None
+    outbox_sync_mode: Literal["entry", "group"] = "group"
+    outbox_retention_seconds: int = 86400
+    outbox_lease_seconds: float = 60.0
+
+    # Trace this fraction of requests, exporting spans to an OTLP/HTTP collector if an
+    # endpoint is set, e.g. http://localhost:4318, or else to a JSONL file
+    tracing_sample_rate: float = 0.0
+    tracing_jsonl_path: Optional[str] = "traces.jsonl"
+    tracing_otlp_endpoint: Optional[str] = None
+    tracing_service_name: str = "ai-chatbot-starter"
+
     # Integration specific fields for LLM Providers and Integrations
     # TODO: Move these down one level further into sub-Models that can be defined
     #       in the corresponding integrations file
@@ -55,20 +108,97 @@ class Config(BaseModel):
     google_embeddings_model: str = "textembedding-gecko@latest"
     google_textgen_model: str = "TODO"
 
+    # Timing of the fake provider, a tokens_per_second of 0 streams without delay
+    fake_embeddings_dimension: int = 1536
+    fake_embeddings_delay_seconds: float = 0.0
+    fake_ttft_seconds: float = 0.0
+    fake_tokens_per_second: float = 0.0
+
     bot_intercom_id: Optional[str] = None
     intercom_token: Optional[str] = None
     intercom_client_secret: Optional[str] = None
     intercom_include_response: bool = True
     intercom_include_context: bool = True
+    # Pooled client for the Intercom API, retrying connection errors and 429s, and the
+    # 5xxs and timeouts of idempotent requests
+    intercom_api_url: str = "https://api.intercom.io"
+    intercom_timeout_seconds: float = 10.0
+    intercom_connect_timeout_seconds: float = 5.0
+    intercom_max_connections: int = 20
+    intercom_max_retries: int = 3
+    intercom_retry_backoff_seconds: float = 0.5
+    intercom_max_retry_delay_seconds: float = 30.0
+
+    # Cache contact lookups, serving them up to stale_seconds past the TTL while they
+    # refresh in the background. Contact webhooks to /chat invalidate them
+    intercom_contact_cache_enabled: bool = True
+    intercom_contact_cache_max_entries: int = 10000
+    intercom_contact_cache_ttl_seconds: int = 300
+    intercom_contact_cache_stale_seconds: int = 0
 
     bugsnag_api_key: Optional[str] = None
 
     slack_webhook_url: Optional[str] = None
 
-    # Credentials for Astra DB
-    astra_db_application_token: str
-    astra_db_api_endpoint: str
+    # Credentials for Astra DB, needed if the vector store or sessions are kept there
+    astra_db_application_token: Optional[str] = None
+    astra_db_api_endpoint: Optional[str] = None
     astra_db_table_name: str = "data"
+    # Version stamps of the collections, renewed by each ingestion
+    collection_versions_astra_collection: str = "collection_versions"
+
+    # Where documents are retrieved from. The local store keeps a directory per
+    # collection under local_vector_store_path. float16 halves its size, but each
+    # query converts it back to float32, which takes longer than the search itself
+    vector_store_backend: VectorStoreType = VectorStoreType.Astra
+    local_vector_store_path: str = "vector_store"
+    local_vector_store_dtype: Literal["float32", "float16"] = "float32"
+    # An ivf index searches the nprobe nearest of ivf_lists clusters instead of every
+    # vector, once the collection has 32 * ivf_lists of them. More probes find more
+    # of the exact top k, at the cost of latency
+    local_vector_store_index: Literal["flat", "ivf"] = "flat"
+    local_vector_store_ivf_lists: int = 1024
+    local_vector_store_ivf_nprobe: int = 32
+
+    # Also search a BM25 index of the same chunks, built by data/compile_documents.py
+    # in a directory per collection under lexical_index_path, and merge the top
+    # hybrid_candidates of both searches with reciprocal rank fusion
+    hybrid_search_enabled: bool = False
+    lexical_index_path: str = "lexical_index"
+    hybrid_candidates: int = 20
+    hybrid_rrf_k: int = 60
+
+    # Per-conversation chat history, use sqlite or astra to share it across workers
+    session_backend: SessionBackendType = SessionBackendType.Memory
+    session_max_sessions: int = 10000
+    session_ttl_seconds: int = 3600
+    session_max_messages: int = 20
+    session_token_limit: int = 2000
+    session_sqlite_path: str = "sessions.db"
+    session_astra_collection: str = "chat_sessions"
+
+    # Exact-match cache of complete answers, persisted to a SQLite file if a path is set
+    response_cache_enabled: bool = False
+    response_cache_max_entries: int = 1000
+    response_cache_ttl_seconds: int = 86400
+    response_cache_path: Optional[str] = None
+
+    # Serve cached answers to paraphrased questions above a cosine similarity threshold
+    semantic_cache_enabled: bool = False
+    semantic_cache_threshold: float = 0.95
+    semantic_cache_max_entries: int = 10000
+    semantic_cache_version_check_seconds: int = 60
+    semantic_cache_dtype: Literal["float16", "float32"] = "float16"
+
+    # Query and document embeddings, shared with data/compile_documents.py if a path
+    # is set
+    embedding_cache_enabled: bool = True
+    embedding_cache_max_entries: int = 10000
+    embedding_cache_path: Optional[str] = None
+
+    # Prompt tokens for retrieved documents after deduplication, None for no limit
+    context_token_budget: Optional[int] = 3000
+    context_dedupe_threshold: float = 0.9
 
     @model_validator(mode="after")
     def check_llm_creds(self):
@@ -81,11 +211,28 @@ class Config(BaseModel):
             assert (
                 self.google_project_id is not None
             ), "google_project_id must be included"
+        elif self.llm_provider == LLMProvider.Fake:
+            pass  # Needs no credentials
         else:
             raise ValueError(f"Unrecognized llm_provider {self.llm_provider}")
 
         return self
 
+    @model_validator(mode="after")
+    def check_astra_creds(self):
+        if (
+            self.vector_store_backend == VectorStoreType.Astra
+            or self.session_backend == SessionBackendType.Astra
+        ):
+            assert (
+                self.astra_db_application_token is not None
+            ), "astra_db_application_token must be included"
+            assert (
+                self.astra_db_api_endpoint is not None
+            ), "astra_db_api_endpoint must be included"
+
+        return self
+
     @model_validator(mode="after")
     def check_integration_creds(self):
         """Validates that any integrations being used have credentials present"""
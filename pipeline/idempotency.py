@@ -0,0 +1,188 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
+
+from .config import Config
+from .metrics import Counter
+
+IDEMPOTENCY_REQUESTS = Counter(
+    "chatbot_idempotency_requests_total",
+    "Requests with an idempotency key: new, a duplicate of a finished request, or "
+    "a duplicate that waited for one in flight",
+    ["result"],
+)
+
+
+class IdempotencyStore(ABC):
+    """
+    Single flight for requests that carry an idempotency key. The first request with
+    a key does the work and records its result, duplicates get that result instead,
+    waiting for it if the first request is still in flight.
+    """
+
+    @abstractmethod
+    async def acquire(self, key: str) -> Optional[str]:
+        """
+        Returns the result recorded for the key, or None if the caller should do the
+        work, in which case it must then call complete() or release().
+        """
+
+    @abstractmethod
+    async def complete(self, key: str, result: str) -> None:
+        pass
+
+    @abstractmethod
+    async def release(self, key: str) -> None:
+        """Gives up on the work, so the next request with this key does it instead"""
+
+
+class InMemoryIdempotencyStore(IdempotencyStore):
+    """A process local store, for single worker deployments"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # Key to (recorded at, result), or to the future of a request in flight
+        self._entries: "OrderedDict[str, Union[Tuple[float, str], asyncio.Future]]" = (
+            OrderedDict()
+        )
+
+    async def acquire(self, key: str) -> Optional[str]:
+        waited = False
+        while True:
+            entry = self._entries.get(key)
+            if isinstance(entry, asyncio.Future):
+                waited = True
+                result = await asyncio.shield(entry)
+                if result is None:
+                    continue  # Released, whoever gets here first does the work
+                IDEMPOTENCY_REQUESTS.inc(result="waited")
+                return result
+
+            if entry is not None and time.time() - entry[0] <= self.ttl_seconds:
+                IDEMPOTENCY_REQUESTS.inc(result="waited" if waited else "duplicate")
+                return entry[1]
+
+            self._entries[key] = asyncio.get_running_loop().create_future()
+            self._entries.move_to_end(key)
+            IDEMPOTENCY_REQUESTS.inc(result="new")
+            return None
+
+    def _finish(self, key: str, result: Optional[str]) -> None:
+        future = self._entries.pop(key, None)
+        if result is not None:
+            self._entries[key] = (time.time(), result)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                if isinstance(self._entries[oldest], asyncio.Future):
+                    break
+                del self._entries[oldest]
+        if isinstance(future, asyncio.Future) and not future.done():
+            future.set_result(result)
+
+    async def complete(self, key: str, result: str) -> None:
+        self._finish(key, result)
+
+    async def release(self, key: str) -> None:
+        self._finish(key, None)
+
+
+class SQLiteIdempotencyStore(IdempotencyStore):
+    """
+    A store shared by the workers on a host through a SQLite file. Duplicates poll
+    for the result of a request in flight, and take over its key if it hasn't
+    finished within `lease_seconds`, e.g. because its worker died.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl_seconds: float,
+        lease_seconds: float = 300.0,
+        poll_seconds: float = 0.25,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency (key TEXT PRIMARY KEY, "
+                "result TEXT, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "DELETE FROM idempotency WHERE updated_at < ?",
+                (time.time() - max(ttl_seconds, lease_seconds),),
+            )
+
+    def _try_acquire(self, key: str) -> Tuple[bool, Optional[str]]:
+        """Returns (acquired, result), claiming the key if it's free or stale"""
+        now = time.time()
+        with self._lock, self._conn:
+            # Holds the write lock from the read, so no other worker claims the key
+            # between this one finding it free and claiming it
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute(
+                "SELECT result, updated_at FROM idempotency WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                result, updated_at = row
+                if result is not None and now - updated_at <= self.ttl_seconds:
+                    return False, result
+                if result is None and now - updated_at <= self.lease_seconds:
+                    return False, None
+
+            self._conn.execute(
+                "INSERT OR REPLACE INTO idempotency VALUES (?, NULL, ?)", (key, now)
+            )
+            return True, None
+
+    async def acquire(self, key: str) -> Optional[str]:
+        waited = False
+        while True:
+            acquired, result = await asyncio.to_thread(self._try_acquire, key)
+            if acquired:
+                IDEMPOTENCY_REQUESTS.inc(result="new")
+                return None
+            if result is not None:
+                IDEMPOTENCY_REQUESTS.inc(result="waited" if waited else "duplicate")
+                return result
+
+            waited = True
+            await asyncio.sleep(self.poll_seconds)
+
+    def _write(self, key: str, result: Optional[str]) -> None:
+        with self._lock, self._conn:
+            if result is None:
+                self._conn.execute("DELETE FROM idempotency WHERE key = ?", (key,))
+            else:
+                self._conn.execute(
+                    "UPDATE idempotency SET result = ?, updated_at = ? WHERE key = ?",
+                    (result, time.time(), key),
+                )
+
+    async def complete(self, key: str, result: str) -> None:
+        await asyncio.to_thread(self._write, key, result)
+
+    async def release(self, key: str) -> None:
+        await asyncio.to_thread(self._write, key, None)
+
+
+def create_idempotency_store(config: Config) -> Optional[IdempotencyStore]:
+    """Build the IdempotencyStore configured for the app, or None if it's disabled"""
+    if not config.idempotency_enabled:
+        return None
+
+    if config.idempotency_sqlite_path is not None:
+        return SQLiteIdempotencyStore(
+            config.idempotency_sqlite_path,
+            ttl_seconds=config.idempotency_ttl_seconds,
+            lease_seconds=config.idempotency_lease_seconds,
+        )
+    return InMemoryIdempotencyStore(config.idempotency_ttl_seconds)
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from .metrics import Counter, Gauge, Histogram
+from .tracing import current_span, use_span
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_DEPTH = Gauge(
+    "chatbot_job_queue_depth", "Jobs waiting for a worker", ["queue"]
+)
+JOB_QUEUE_WAIT_SECONDS = Histogram(
+    "chatbot_job_queue_wait_seconds",
+    "Time jobs spent queued before a worker picked them up",
+    ["queue"],
+)
+JOB_PROCESSING_SECONDS = Histogram(
+    "chatbot_job_processing_seconds", "Time workers spent running a job", ["queue"]
+)
+JOBS = Counter(
+    "chatbot_jobs_total",
+    "Jobs by outcome: succeeded, failed or shed because the queue was full",
+    ["queue", "result"],
+)
+
+Job = Callable[[], Awaitable[None]]
+
+
+class JobQueue:
+    """
+    A bounded in-process queue of async jobs, run by `num_workers` worker tasks.
+    Jobs that don't fit in `max_size` are refused, so callers can shed load rather
+    than wait. A job runs under the span that was current when it was submitted.
+    """
+
+    def __init__(self, name: str, num_workers: int, max_size: int):
+        self.name = name
+        self.num_workers = num_workers
+        self.max_size = max_size
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+        JOB_QUEUE_DEPTH.set_function(
+            lambda: self._queue.qsize() if self._queue is not None else 0, queue=name
+        )
+
+    def _ensure_started(self) -> asyncio.Queue:
+        # Started from the app lifespan, or on first use without one
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue(self.max_size)
+            self._workers = [
+                loop.create_task(self._work()) for _ in range(self.num_workers)
+            ]
+        return self._queue
+
+    async def start(self) -> None:
+        self._ensure_started()
+
+    async def stop(self, drain_timeout_seconds: float = 10.0) -> None:
+        """Waits up to `drain_timeout_seconds` for queued jobs, then stops workers"""
+        if self._queue is None:
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.join(), drain_timeout_seconds)
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %d queued %s jobs", self._queue.qsize(), self.name)
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._loop, self._queue, self._workers = None, None, []
+
+    def submit(self, job: Job) -> bool:
+        """Queues the job, or returns False if the queue is full"""
+        try:
+            self._ensure_started().put_nowait((time.monotonic(), job, current_span()))
+            return True
+        except asyncio.QueueFull:
+            JOBS.inc(queue=self.name, result="shed")
+            return False
+
+    async def _work(self) -> None:
+        while True:
+            queued_at, job, trace = await self._queue.get()
+            started_at = time.monotonic()
+            JOB_QUEUE_WAIT_SECONDS.observe(started_at - queued_at, queue=self.name)
+            try:
+                with use_span(trace):
+                    await job()
+                JOBS.inc(queue=self.name, result="succeeded")
+            except Exception:
+                logger.exception("%s job failed", self.name)
+                JOBS.inc(queue=self.name, result="failed")
+            finally:
+                JOB_PROCESSING_SECONDS.observe(
+                    time.monotonic() - started_at, queue=self.name
+                )
+                self._queue.task_done()
@@ -0,0 +1,243 @@
+import asyncio
+import dataclasses
+import hashlib
+import importlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, List, Literal, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+SyncMode = Literal["entry", "group"]
+
+
+@dataclass
+class OutboxEntry:
+    key: str  # Idempotency key, one per response and ResponseActor
+    actor: str  # Class name of the ResponseActor
+    conv_info: Any
+    text_response: str
+    responses_from_vs: str
+    context: str
+    created_at: float
+
+
+def _encode_conv_info(conv_info: Any) -> Tuple[Any, Optional[str]]:
+    """conv_info as JSON, with the class to rebuild it from if it's a dataclass"""
+    if dataclasses.is_dataclass(conv_info):
+        cls = type(conv_info)
+        return dataclasses.asdict(conv_info), f"{cls.__module__}:{cls.__qualname__}"
+    return conv_info, None
+
+
+def _dump(entry: OutboxEntry) -> str:
+    conv_info, conv_info_type = _encode_conv_info(entry.conv_info)
+    fields = dict(vars(entry), conv_info=conv_info, conv_info_type=conv_info_type)
+    return json.dumps(fields)
+
+
+def _load(data: str) -> OutboxEntry:
+    fields = json.loads(data)
+    conv_info_type = fields.pop("conv_info_type")
+    if conv_info_type is not None:
+        module, name = conv_info_type.split(":")
+        cls = getattr(importlib.import_module(module), name)
+        if not dataclasses.is_dataclass(cls):
+            raise TypeError(f"{conv_info_type} is not a dataclass")
+        fields["conv_info"] = cls(**fields["conv_info"])
+    return OutboxEntry(**fields)
+
+
+def response_key(conv_info: Any, text_response: str, context: str) -> str:
+    """The same for every delivery of a response to a conversation"""
+    conv_info, _ = _encode_conv_info(conv_info)
+    key_parts = [conv_info, text_response, context]
+    return hashlib.sha256(
+        json.dumps(key_parts, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+class Outbox:
+    """
+    A SQLite journal of the response actions still to be taken, so a restart or crash
+    doesn't lose answers the LLM already generated. Appends are fsynced before they
+    return. With sync_mode "entry" each append is its own transaction, with "group"
+    every append that arrives while the previous commit is in progress shares the
+    next one, so concurrent requests pay for one fsync between them.
+
+    Entries are stored as JSON, so their conv_info must be JSON or a dataclass of
+    JSON fields. An entry whose key is already in the outbox is not added again.
+
+    Workers on a host may share the outbox. Each holds a lease on the entries it
+    added or claimed, which it renews while it runs and gives up on close(). Only
+    entries whose lease ran out, because their worker stopped or crashed, can be
+    claimed by another worker to replay, so no entry is taken by two at once.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        sync_mode: SyncMode = "group",
+        retention_seconds: float = 86400,
+        lease_seconds: float = 60.0,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "outbox.db")
+        self.sync_mode = sync_mode
+        self.lease_seconds = lease_seconds
+        # This worker, the holder of the leases it takes
+        self.owner = uuid.uuid4().hex
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox (key TEXT PRIMARY KEY, "
+                "status TEXT NOT NULL, entry TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "owner TEXT NOT NULL, leased_until REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "DELETE FROM outbox WHERE status != 'pending' AND updated_at < ?",
+                (time.time() - retention_seconds,),
+            )
+
+        self._requests: "queue.Queue" = queue.Queue()
+        self._writer = threading.Thread(
+            target=self._write_loop, name="outbox-writer", daemon=True
+        )
+        self._writer.start()
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = [self._requests.get()]
+            if batch[0] is None:
+                return
+            if self.sync_mode == "group":
+                while not self._requests.empty():
+                    batch.append(self._requests.get_nowait())
+
+            stop = batch[-1] is None
+            batch = [request for request in batch if request is not None]
+            try:
+                with self._lock, self._conn:
+                    results = [self._insert(rows) for rows, _, _ in batch]
+                error = None
+            except Exception as e:
+                results, error = [None] * len(batch), e
+
+            for (_, loop, future), result in zip(batch, results):
+                loop.call_soon_threadsafe(_resolve, future, result, error)
+            if stop:
+                return
+
+    def _insert(self, rows: List[Tuple[str, str]]) -> Set[str]:
+        """Adds the rows that are new, in the caller's transaction, and their keys"""
+        now = time.time()
+        added = set()
+        for key, data in rows:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO outbox VALUES (?, 'pending', ?, ?, ?, ?)",
+                (key, data, now, self.owner, now + self.lease_seconds),
+            )
+            if cursor.rowcount:
+                added.add(key)
+        return added
+
+    async def append(self, entries: List[OutboxEntry]) -> Set[str]:
+        """
+        Returns the keys of the entries that were added, once they are on disk,
+        leaving out those already in the outbox
+        """
+        rows = [(entry.key, _dump(entry)) for entry in entries]
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._requests.put((rows, loop, future))
+        return await future
+
+    def mark(self, key: str, status: Literal["done", "failed"]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, updated_at = ? WHERE key = ?",
+                (status, time.time(), key),
+            )
+
+    def renew(self) -> None:
+        """Extends the leases on this worker's pending entries"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET leased_until = ? "
+                "WHERE owner = ? AND status = 'pending'",
+                (time.time() + self.lease_seconds, self.owner),
+            )
+
+    def claim_abandoned(self) -> List[OutboxEntry]:
+        """
+        Leases the pending entries whose lease ran out to this worker, and returns
+        them oldest first. Those that can't be read back are marked failed instead.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            rows = self._conn.execute(
+                "SELECT key, entry FROM outbox "
+                "WHERE status = 'pending' AND leased_until < ? ORDER BY updated_at",
+                (now,),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE outbox SET owner = ?, leased_until = ? WHERE key = ?",
+                [(self.owner, now + self.lease_seconds, key) for key, _ in rows],
+            )
+        return self._read(rows)
+
+    def pending(self) -> List[OutboxEntry]:
+        """
+        Entries that were never marked done or failed, whichever worker holds them,
+        oldest first. Those that can't be read back are marked failed instead.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, entry FROM outbox WHERE status = 'pending' "
+                "ORDER BY updated_at"
+            ).fetchall()
+        return self._read(rows)
+
+    def _read(self, rows: List[Tuple[str, str]]) -> List[OutboxEntry]:
+        entries = []
+        for key, data in rows:
+            try:
+                entries.append(_load(data))
+            except Exception:
+                logger.exception("Can't read outbox entry %s, marking it failed", key)
+                self.mark(key, "failed")
+        return entries
+
+    def close(self) -> None:
+        """Stops writing, and gives up the leases of the entries still pending"""
+        self._requests.put(None)
+        self._writer.join()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE outbox SET leased_until = 0 "
+                "WHERE owner = ? AND status = 'pending'",
+                (self.owner,),
+            )
+        self._conn.close()
+
+
+def _resolve(
+    future: asyncio.Future, result: Optional[Set[str]], error: Optional[Exception]
+) -> None:
+    if future.done():
+        return
+    if error is None:
+        future.set_result(result)
+    else:
+        future.set_exception(error)
@@ -0,0 +1,40 @@
+from typing import Any, Dict, Iterator, Mapping, Optional
+
+import orjson
+
+
+class RequestBody(Mapping[str, Any]):
+    """
+    A JSON request body that keeps the raw bytes it arrived as, so signatures can be
+    checked against exactly what was sent, and is only parsed once a field is read.
+    Requests rejected before that, e.g. for a bad signature, are never parsed.
+    """
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self._data: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RequestBody":
+        body = cls(orjson.dumps(data))
+        body._data = data
+        return body
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        if self._data is None:
+            self._data = orjson.loads(self.raw)
+        return self._data
+
+    @property
+    def is_parsed(self) -> bool:
+        return self._data is not None
+
+    def __getitem__(self, key: str) -> Any:
+        return self.data[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
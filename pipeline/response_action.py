@@ -1,8 +1,11 @@
 import abc
-from typing import Any
+import asyncio
+from typing import Any, Optional
 
-from .base_integration import BaseIntegration, integrations_registry
+from .base_integration import BaseIntegration, IntegrationSet, get_integration
 from .config import Config
+from .metrics import time_stage
+from .tracing import span
 
 
 class ResponseActor(BaseIntegration, metaclass=abc.ABCMeta):
@@ -12,6 +15,11 @@ class ResponseActor(BaseIntegration, metaclass=abc.ABCMeta):
     until we find a valid response
     """
 
+    # Whether taking the same action twice is harmless, e.g. because it records
+    # idempotency_key and skips keys it has seen. The ActorEngine only retries an
+    # attempt that timed out, and may still be running, if it is
+    idempotent: bool = False
+
     @abc.abstractmethod
     def take_action(
         self,
@@ -19,8 +27,30 @@ class ResponseActor(BaseIntegration, metaclass=abc.ABCMeta):
         text_response: str,
         responses_from_vs: str,
         context: str,
+        idempotency_key: Optional[str] = None,
+    ) -> None:
+        """
+        idempotency_key is the same for every attempt at the action for a response,
+        including retries, redeliveries of the request and replays from the outbox
+        """
+
+    async def atake_action(
+        self,
+        conv_info: Any,
+        text_response: str,
+        responses_from_vs: str,
+        context: str,
+        idempotency_key: Optional[str] = None,
     ) -> None:
-        pass
+        """Override with a native async version, defaults to running in a thread"""
+        await asyncio.to_thread(
+            self.take_action,
+            conv_info,
+            text_response,
+            responses_from_vs,
+            context,
+            idempotency_key,
+        )
 
 
 def take_all_actions(
@@ -29,11 +59,39 @@ def take_all_actions(
     text_response: str,
     responses_from_vs: str,
     context: str,
+    integrations: Optional[IntegrationSet] = None,
 ) -> None:
     """Runs all ResponseActors specified in config to take response actions"""
     for cls_name in config.response_actor_cls:
-        response_actor = integrations_registry[cls_name](config)
+        response_actor = get_integration(config, cls_name, integrations)
+        assert isinstance(
+            response_actor, ResponseActor
+        ), f"Must only specify ResponseActor in response_actor_cls"
+        with time_stage("action", config.llm_provider.value, cls_name), span(
+            "pipeline.response_action", integration=cls_name
+        ):
+            response_actor.take_action(
+                conv_info, text_response, responses_from_vs, context
+            )
+
+
+async def atake_all_actions(
+    config: Config,
+    conv_info: Any,
+    text_response: str,
+    responses_from_vs: str,
+    context: str,
+    integrations: Optional[IntegrationSet] = None,
+) -> None:
+    """The async version of take_all_actions"""
+    for cls_name in config.response_actor_cls:
+        response_actor = get_integration(config, cls_name, integrations)
         assert isinstance(
             response_actor, ResponseActor
         ), f"Must only specify ResponseActor in response_actor_cls"
-        response_actor.take_action(conv_info, text_response, responses_from_vs, context)
+        with time_stage("action", config.llm_provider.value, cls_name), span(
+            "pipeline.response_action", integration=cls_name
+        ):
+            await response_actor.atake_action(
+                conv_info, text_response, responses_from_vs, context
+            )
@@ -1,9 +1,19 @@
 import abc
+import asyncio
+import contextvars
+import time
 from dataclasses import dataclass
-from typing import Any, Dict, Mapping, Optional
+from typing import Any, Dict, List, Mapping, Optional
 
-from .base_integration import BaseIntegration, integrations_registry
+from .base_integration import (
+    BaseIntegration,
+    IntegrationSet,
+    get_integration,
+    integration_executor,
+)
 from .config import Config
+from .metrics import time_stage
+from .tracing import span
 
 
 @dataclass
@@ -18,6 +28,10 @@ class ResponseDecision:
     response_dict: Optional[Dict[str, Any]] = None
     response_code: Optional[int] = None
     conversation_info: Optional[Any] = None
+    idempotency_key: Optional[str] = None  # Identifies redeliveries of a request
+    # The question to answer, if known, so retrieval can start alongside the
+    # UserContextCreators
+    user_question: Optional[str] = None
 
 
 class ResponseDecider(BaseIntegration, metaclass=abc.ABCMeta):
@@ -31,20 +45,138 @@ class ResponseDecider(BaseIntegration, metaclass=abc.ABCMeta):
     ) -> ResponseDecision:
         pass
 
+    async def amake_response_decision(
+        self,
+        request_body: Mapping[str, Any],
+        request_headers: Mapping[str, str],
+    ) -> ResponseDecision:
+        """Override with a native async version, defaults to running in a thread"""
+        return await asyncio.to_thread(
+            self.make_response_decision, request_body, request_headers
+        )
 
-def make_all_response_decisions(
-    config: Config,
+
+def _timed_decision(
+    decider: ResponseDecider,
     request_body: Mapping[str, Any],
     request_headers: Mapping[str, str],
 ) -> ResponseDecision:
-    """Runs all ResponseDeciders specified in config to return ResponseDecision's"""
-    # TODO: Some aggregation strategy that allows for multiple response deciders present
+    name, provider = type(decider).__name__, decider.config.llm_provider.value
+    with time_stage("decision", provider, name), span(
+        "pipeline.response_decision", integration=name
+    ):
+        return decider.make_response_decision(request_body, request_headers)
+
+
+async def _atimed_decision(
+    decider: ResponseDecider,
+    request_body: Mapping[str, Any],
+    request_headers: Mapping[str, str],
+) -> ResponseDecision:
+    name, provider = type(decider).__name__, decider.config.llm_provider.value
+    with time_stage("decision", provider, name), span(
+        "pipeline.response_decision", integration=name
+    ):
+        return await decider.amake_response_decision(request_body, request_headers)
+
+
+def _merge_decisions(decisions: List[ResponseDecision]) -> ResponseDecision:
+    """Combines decisions to continue, the first one with each field set wins"""
+    conversation_info = next(
+        (d.conversation_info for d in decisions if d.conversation_info is not None),
+        None,
+    )
+    idempotency_key = next(
+        (d.idempotency_key for d in decisions if d.idempotency_key is not None), None
+    )
+    user_question = next(
+        (d.user_question for d in decisions if d.user_question is not None), None
+    )
+    return ResponseDecision(
+        should_return_early=False,
+        conversation_info=conversation_info,
+        idempotency_key=idempotency_key,
+        user_question=user_question,
+    )
+
+
+def _get_deciders(
+    config: Config, integrations: Optional[IntegrationSet]
+) -> List[ResponseDecider]:
+    deciders = []
     for cls_name in config.response_decider_cls:
-        response_actor = integrations_registry[cls_name](config)
+        response_decider = get_integration(config, cls_name, integrations)
         assert isinstance(
-            response_actor, ResponseDecider
+            response_decider, ResponseDecider
         ), f"Must only specify ResponseDecider in response_decider_cls"
-        return response_actor.make_response_decision(request_body, request_headers)
+        deciders.append(response_decider)
+    return deciders
+
+
+def make_all_response_decisions(
+    config: Config,
+    request_body: Mapping[str, Any],
+    request_headers: Mapping[str, str],
+    integrations: Optional[IntegrationSet] = None,
+) -> ResponseDecision:
+    """
+    Runs all ResponseDeciders specified in config concurrently. The first decider, in
+    config order, that returns early decides the response, and the ones after it are
+    not waited for. Deciders that take longer than response_decider_timeout_seconds
+    fail the request rather than being skipped, since they may be guarding it.
+    """
+    deadline = time.monotonic() + config.response_decider_timeout_seconds
+    futures = [
+        integration_executor.submit(
+            contextvars.copy_context().run,
+            _timed_decision,
+            decider,
+            request_body,
+            request_headers,
+        )
+        for decider in _get_deciders(config, integrations)
+    ]
+
+    decisions = []
+    for future in futures:
+        decision = future.result(timeout=max(deadline - time.monotonic(), 0))
+        if decision.should_return_early:
+            for pending in futures:
+                pending.cancel()
+            return decision
+        decisions.append(decision)
+
+    # No response decider returned early, so just keep going
+    return _merge_decisions(decisions)
+
+
+async def amake_all_response_decisions(
+    config: Config,
+    request_body: Mapping[str, Any],
+    request_headers: Mapping[str, str],
+    integrations: Optional[IntegrationSet] = None,
+) -> ResponseDecision:
+    """The async version of make_all_response_decisions"""
+    tasks = [
+        asyncio.create_task(
+            asyncio.wait_for(
+                _atimed_decision(decider, request_body, request_headers),
+                config.response_decider_timeout_seconds,
+            )
+        )
+        for decider in _get_deciders(config, integrations)
+    ]
+
+    decisions = []
+    try:
+        for task in tasks:
+            decision = await task
+            if decision.should_return_early:
+                return decision
+            decisions.append(decision)
+    finally:
+        for task in tasks:
+            task.cancel()
 
-    # No response deciders present, so just keep going
-    return ResponseDecision(should_return_early=False)
+    # No response decider returned early, so just keep going
+    return _merge_decisions(decisions)
@@ -0,0 +1,14 @@
+from typing import Callable
+
+
+def truncate_tokens(
+    text: str, max_tokens: int, count_tokens: Callable[[str], int]
+) -> str:
+    """The longest prefix of text, cut at a space, of at most `max_tokens` tokens"""
+    cut = len(text) * max_tokens // max(count_tokens(text), 1)
+    while cut > 0:
+        truncated = text[:cut].rsplit(" ", 1)[0]
+        if count_tokens(truncated) <= max_tokens:
+            return truncated
+        cut = cut * 9 // 10
+    return ""
@@ -0,0 +1,351 @@
+"""
+Lightweight request tracing. A sampled request starts a trace with `start_trace`, and
+the code it runs records child spans with `span(...)`. The current span lives in a
+context variable, so it follows the request through awaits, tasks and
+asyncio.to_thread, and `span` does nothing for requests that aren't sampled. Ended
+spans are exported in batches from a background thread, to a JSONL file or to an
+OpenTelemetry collector over OTLP/HTTP.
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Dict, Iterator, List, Optional
+
+import httpx
+
+from .config import Config
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+TRACE_SPANS = Counter(
+    "chatbot_trace_spans_total",
+    "Ended spans: exported, or dropped because the export queue was full or the "
+    "export failed",
+    ["result"],
+)
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Span:
+    """A timed operation of a trace, ended once with `end()`"""
+
+    def __init__(
+        self,
+        tracer: "Tracer",
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str],
+        attributes: Dict[str, Any],
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    @property
+    def traceparent(self) -> str:
+        """The W3C traceparent header that makes a downstream service's spans ours"""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.tracer.export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class SpanExporter(ABC):
+    @abstractmethod
+    def export(self, spans: List[Span]) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        pass
+
+
+class JSONLSpanExporter(SpanExporter):
+    """Appends a JSON object per span to a file, e.g. to read with jq"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]) -> None:
+        lines = [json.dumps(span.to_dict(), default=str) + "\n" for span in spans]
+        with open(self.path, "a") as file:
+            file.writelines(lines)
+
+
+class OTLPSpanExporter(SpanExporter):
+    """Posts spans to an OpenTelemetry collector with OTLP/HTTP, JSON encoded"""
+
+    def __init__(self, endpoint: str, service_name: str, timeout_seconds: float = 5.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self._client = httpx.Client(timeout=timeout_seconds)
+
+    def export(self, spans: List[Span]) -> None:
+        response = self._client.post(self.url, json=self.payload(spans))
+        response.raise_for_status()
+
+    def shutdown(self) -> None:
+        self._client.close()
+
+    def payload(self, spans: List[Span]) -> Dict[str, Any]:
+        resource = {"attributes": _otlp_attributes({"service.name": self.service_name})}
+        return {
+            "resourceSpans": [
+                {
+                    "resource": resource,
+                    "scopeSpans": [
+                        {"scope": {"name": __name__}, "spans": list(map(_otlp, spans))}
+                    ],
+                }
+            ]
+        }
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items()]
+
+
+def _otlp(span: Span) -> Dict[str, Any]:
+    otlp_span = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": _otlp_attributes(span.attributes),
+        "status": {"code": 2, "message": span.error} if span.error else {},
+    }
+    if span.parent_id is not None:
+        otlp_span["parentSpanId"] = span.parent_id
+    return otlp_span
+
+
+class Tracer:
+    """
+    Samples traces at `sample_rate` and hands ended spans to `exporter` from a
+    background thread, in batches of up to `batch_size` every `flush_seconds`. Spans
+    that don't fit in `max_queue_size` are dropped rather than slow the request down.
+    """
+
+    def __init__(
+        self,
+        exporter: SpanExporter,
+        sample_rate: float,
+        max_queue_size: int = 2048,
+        batch_size: int = 512,
+        flush_seconds: float = 1.0,
+    ):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._queue: queue.Queue = queue.Queue(max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start_trace(
+        self, name: str, traceparent: Optional[str] = None, **attributes: Any
+    ) -> Optional[Span]:
+        """
+        The root span of a new trace, or None if it isn't sampled. A valid incoming
+        traceparent header continues the caller's trace, and its sampling decision.
+        """
+        match = _TRACEPARENT.match(traceparent or "")
+        if match is not None:
+            trace_id, parent_id, flags = match.groups()
+            if not int(flags, 16) & 1:
+                return None
+        elif random.random() < self.sample_rate:
+            trace_id, parent_id = os.urandom(16).hex(), None
+        else:
+            return None
+        return Span(self, name, trace_id, parent_id, attributes)
+
+    def export(self, span: Span) -> None:
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            TRACE_SPANS.inc(result="dropped")
+
+    def shutdown(self, timeout_seconds: float = 5.0) -> None:
+        """Exports the spans still queued, waiting up to `timeout_seconds`"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout_seconds)
+        self.exporter.shutdown()
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._export_loop, name="span-exporter", daemon=True
+                )
+                self._thread.start()
+
+    def _export_loop(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    span = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if span is None:
+                    stopping = True
+                    break
+                batch.append(span)
+
+            if not batch:
+                continue
+            try:
+                self.exporter.export(batch)
+                TRACE_SPANS.inc(len(batch), result="exported")
+            except Exception:
+                logger.warning("Dropping %d spans", len(batch), exc_info=True)
+                TRACE_SPANS.inc(len(batch), result="dropped")
+
+
+def create_tracer(config: Config) -> Optional[Tracer]:
+    """Build the Tracer configured for the app, or None if tracing is disabled"""
+    if config.tracing_sample_rate <= 0:
+        return None
+
+    if config.tracing_otlp_endpoint is not None:
+        exporter: SpanExporter = OTLPSpanExporter(
+            config.tracing_otlp_endpoint, config.tracing_service_name
+        )
+    elif config.tracing_jsonl_path is not None:
+        exporter = JSONLSpanExporter(config.tracing_jsonl_path)
+    else:
+        return None
+    return Tracer(exporter, config.tracing_sample_rate)
+
+
+_tracer: Optional[Tracer] = None
+_NO_SPAN = nullcontext(None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+def set_tracer(tracer: Optional[Tracer]) -> None:
+    """Installs the Tracer that start_trace samples with, None turns tracing off"""
+    global _tracer
+    _tracer = tracer
+
+
+def start_trace(
+    name: str, traceparent: Optional[str] = None, **attributes: Any
+) -> Optional[Span]:
+    """The root span of a request, or None if it isn't traced. See Tracer.start_trace"""
+    if _tracer is None:
+        return None
+    return _tracer.start_trace(name, traceparent, **attributes)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_span(name: str, **attributes: Any) -> Optional[Span]:
+    """
+    A child of the current span that the caller ends, e.g. for a stream consumed after
+    the function that opened it returns. None outside of a traced request.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    return Span(parent.tracer, name, parent.trace_id, parent.span_id, attributes)
+
+
+@contextmanager
+def use_span(
+    span: Optional[Span], end_on_exit: bool = False
+) -> Iterator[Optional[Span]]:
+    """Makes `span` the current span in the with block, if there is one"""
+    if span is None:
+        yield None
+        return
+
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        if end_on_exit:
+            span.end(e)
+        raise
+    finally:
+        _reset(token)
+        if end_on_exit:
+            span.end()
+
+
+def span(name: str, **attributes: Any) -> ContextManager[Optional[Span]]:
+    """Records the with block as a child of the current span, if there is one"""
+    child = start_span(name, **attributes)
+    if child is None:
+        return _NO_SPAN
+    return use_span(child, end_on_exit=True)
+
+
+def _reset(token: contextvars.Token) -> None:
+    try:
+        _current_span.reset(token)
+    except ValueError:
+        # An async generator closed from another task, e.g. when it's garbage
+        # collected, runs its cleanup in a different context than it started in
+        pass
@@ -1,9 +1,27 @@
 import abc
+import asyncio
+import concurrent.futures
+import contextvars
+import dataclasses
+import logging
+import time
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Callable, List, Optional
 
-from .base_integration import BaseIntegration, integrations_registry
+from llama_index.core.utils import get_tokenizer
+
+from .base_integration import (
+    BaseIntegration,
+    IntegrationSet,
+    get_integration,
+    integration_executor,
+)
 from .config import Config
+from .metrics import time_stage
+from .tokens import truncate_tokens
+from .tracing import span
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -15,6 +33,7 @@ class UserContext:
     user_question: str
     persona: str
     context_str: str
+    session_id: Optional[str] = None  # Keys the chat history of the conversation
 
 
 class UserContextCreator(BaseIntegration, metaclass=abc.ABCMeta):
@@ -27,18 +46,139 @@ class UserContextCreator(BaseIntegration, metaclass=abc.ABCMeta):
     def create_user_context(self, conv_info: Any) -> UserContext:
         pass
 
+    async def acreate_user_context(self, conv_info: Any) -> UserContext:
+        """Override with a native async version, defaults to running in a thread"""
+        return await asyncio.to_thread(self.create_user_context, conv_info)
 
-def create_all_user_context(
-    config: Config,
-    conv_info: Any,
-) -> UserContext:
-    """Runs all ResponseActors specified in config to take response actions"""
-    # TODO: Some aggregation strategy that allows for multiple user_context_creators
+
+def _get_creators(
+    config: Config, integrations: Optional[IntegrationSet]
+) -> List[UserContextCreator]:
+    creators = []
     for cls_name in config.user_context_creator_cls:
-        user_context_creator = integrations_registry[cls_name](config)
+        user_context_creator = get_integration(config, cls_name, integrations)
         assert isinstance(
             user_context_creator, UserContextCreator
         ), f"Must only specify UserContextCreator in user_context_creator_cls"
-        return user_context_creator.create_user_context(conv_info)
+        creators.append(user_context_creator)
+
+    if not creators:
+        raise ValueError(f"No UserContextCreator found - must specify one")
+    return creators
+
+
+def _timed_user_context(creator: UserContextCreator, conv_info: Any) -> UserContext:
+    name, provider = type(creator).__name__, creator.config.llm_provider.value
+    with time_stage("user_context", provider, name), span(
+        "pipeline.user_context", integration=name
+    ):
+        return creator.create_user_context(conv_info)
+
+
+async def _atimed_user_context(
+    creator: UserContextCreator, conv_info: Any
+) -> UserContext:
+    name, provider = type(creator).__name__, creator.config.llm_provider.value
+    with time_stage("user_context", provider, name), span(
+        "pipeline.user_context", integration=name
+    ):
+        return await creator.acreate_user_context(conv_info)
+
+
+def merge_user_contexts(
+    contexts: List[Optional[UserContext]],
+    token_budget: Optional[int],
+    tokenizer: Optional[Callable[[str], List[Any]]] = None,
+) -> UserContext:
+    """
+    The first context, from the first configured creator, supplies the question,
+    persona and session. The context strings of all of them are joined in config
+    order until `token_budget` tokens, missing ones (None) are skipped.
+    """
+    primary = contexts[0]
+    assert primary is not None, "The first UserContextCreator must create a context"
+    context_strs = [c.context_str for c in contexts if c is not None and c.context_str]
+
+    if token_budget is not None:
+        tokenizer = tokenizer or get_tokenizer()
+
+        def count_tokens(text: str) -> int:
+            return len(tokenizer(text))
+
+        kept, used = [], 0
+        for context_str in context_strs:
+            tokens = count_tokens(context_str)
+            if used + tokens > token_budget:
+                context_str = truncate_tokens(
+                    context_str, token_budget - used, count_tokens
+                )
+                if context_str:
+                    kept.append(context_str)
+                break
+            kept.append(context_str)
+            used += tokens
+        context_strs = kept
+
+    return dataclasses.replace(primary, context_str="\n".join(context_strs))
+
+
+def create_all_user_context(
+    config: Config,
+    conv_info: Any,
+    integrations: Optional[IntegrationSet] = None,
+) -> UserContext:
+    """
+    Runs all UserContextCreators specified in config concurrently and merges their
+    contexts, see merge_user_contexts. Creators other than the first one are skipped
+    if they take longer than user_context_timeout_seconds.
+    """
+    creators = _get_creators(config, integrations)
+    deadline = time.monotonic() + config.user_context_timeout_seconds
+    futures = [
+        integration_executor.submit(
+            contextvars.copy_context().run, _timed_user_context, creator, conv_info
+        )
+        for creator in creators
+    ]
+
+    contexts = []
+    for i, future in enumerate(futures):
+        try:
+            contexts.append(future.result(timeout=max(deadline - time.monotonic(), 0)))
+        except concurrent.futures.TimeoutError:
+            if i == 0:
+                raise
+            logger.warning("%s timed out, skipping it", type(creators[i]).__name__)
+            contexts.append(None)
+
+    return merge_user_contexts(contexts, config.user_context_token_budget)
+
+
+async def acreate_all_user_context(
+    config: Config,
+    conv_info: Any,
+    integrations: Optional[IntegrationSet] = None,
+) -> UserContext:
+    """The async version of create_all_user_context"""
+    creators = _get_creators(config, integrations)
+    results = await asyncio.gather(
+        *[
+            asyncio.wait_for(
+                _atimed_user_context(creator, conv_info),
+                config.user_context_timeout_seconds,
+            )
+            for creator in creators
+        ],
+        return_exceptions=True,
+    )
+
+    contexts = []
+    for i, result in enumerate(results):
+        if isinstance(result, asyncio.TimeoutError) and i > 0:
+            logger.warning("%s timed out, skipping it", type(creators[i]).__name__)
+            result = None
+        elif isinstance(result, BaseException):
+            raise result
+        contexts.append(result)
 
-    raise ValueError(f"No UserContextCreator found - must specify one")
+    return merge_user_contexts(contexts, config.user_context_token_budget)
@@ -5,7 +5,7 @@ from integrations.google import init_gcp
 from pipeline.config import load_config
 
 
-@pytest.fixture(scope="module", autouse=True)
+@pytest.fixture(scope="module")
 def init_config():
     load_dotenv(".env")
     config = load_config("config.yml")
@@ -0,0 +1,16 @@
+from pipeline.config import Config
+
+
+def make_config(**overrides) -> Config:
+    """A Config with no integrations or Astra DB, that needs no config.yml"""
+    fields = {
+        "company": "Acme",
+        "doc_pages": [],
+        "response_decider_cls": [],
+        "user_context_creator_cls": [],
+        "response_actor_cls": [],
+        "openai_api_key": "key",
+        "vector_store_backend": "local",
+    }
+    fields.update(overrides)
+    return Config(**fields)
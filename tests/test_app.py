@@ -1,12 +1,11 @@
 import json
 import os
 import logging
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from fastapi.testclient import TestClient
 import hashlib
 import hmac
-from llama_index.core.response.schema import StreamingResponse
 import pytest
 import requests
 
@@ -14,7 +13,7 @@ import requests
 def get_headers(body):
     """Helper to get necessary request headers for successful POST
 
-    NOTE: Keys in `body` must be specified (recursively) in alphabetical order
+    NOTE: The signature covers the body exactly as get_text_response sends it
     """
     intercom_secret = os.getenv("INTERCOM_CLIENT_SECRET")
 
@@ -51,16 +50,26 @@ def standard_request():
 def mock_assistant():
     """Mocks the AssistantBison object to prevent any real LLM queries being made"""
     with patch("app.assistant") as mock_bison:
-        response_gen = (s for s in ["Mocked", "response"])
-        mock_bison.get_response = MagicMock(
-            return_value=(StreamingResponse(response_gen), [], [])
-        )
+
+        async def response_gen():
+            for s in ["Mocked", "response"]:
+                yield s
+
+        bot_response = MagicMock()
+        bot_response.async_response_gen = response_gen
+        mock_bison.aprefetch = AsyncMock(return_value=None)
+        mock_bison.aget_response = AsyncMock(return_value=(bot_response, "", ""))
+        mock_bison.asave_turn = AsyncMock()
         yield mock_bison
 
 
 def get_text_response(client, data, headers, assert_created=True):
     # r = httpx.post("http://127.0.0.1:5010/chat", json=user_data, headers=headers)
-    response = client.post("/chat", json=data, headers=headers)
+    response = client.post(
+        "/chat",
+        content=json.dumps(data),
+        headers={"Content-Type": "application/json", **headers},
+    )
 
     if assert_created:
         assert (
@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+from chatbot_api.cache import CachedResponse, ResponseCache, SemanticCache
+from chatbot_api.streaming import ReplayedChatResponse, stream_tokens
+
+
+def make_entry(text="An answer.", created_at=None):
+    return CachedResponse(
+        tokens=text.split(" "),
+        responses_from_vs="- doc",
+        context="prompt",
+        generation_seconds=1.5,
+        created_at=created_at or time.time(),
+    )
+
+
+def test_key_normalizes_question():
+    key = ResponseCache.make_key("What is SAI?", "default", "", "v1", "gpt-4")
+    assert key == ResponseCache.make_key("what  is sai", "default", "", "v1", "gpt-4")
+    assert key != ResponseCache.make_key("What is SAI?", "default", "", "v2", "gpt-4")
+    assert key != ResponseCache.make_key("What is SAI?", "default", "me", "v1", "gpt-4")
+
+
+def test_lru_and_ttl_eviction():
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+    cache.put("a", make_entry())
+    cache.put("b", make_entry())
+    cache.get("a")
+    cache.put("c", make_entry())
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+
+    cache.put("old", make_entry(created_at=time.time() - 120))
+    assert cache.get("old") is None
+
+
+def test_disk_persistence(tmp_path):
+    path = str(tmp_path / "cache.db")
+    ResponseCache(max_entries=10, ttl_seconds=60, path=path).put("a", make_entry())
+
+    reloaded = ResponseCache(max_entries=10, ttl_seconds=60, path=path)
+    assert reloaded.get("a").tokens == ["An", "answer."]
+
+
+def test_replay_matches_tokens():
+    async def collect():
+        return [t async for t in stream_tokens(ReplayedChatResponse(["a", " b"]))]
+
+    assert asyncio.run(collect()) == ["a", " b"]
+
+
+def test_semantic_cache_threshold_partition_and_version():
+    version = ["v1"]
+    cache = SemanticCache(3, max_entries=2, threshold=0.95, version_fn=lambda: version[0])
+    cache.version_check_seconds = 0
+    cache.add([1.0, 0.0, 0.0], "a" * 64, make_entry())
+
+    assert cache.search([0.99, 0.05, 0.0], "a" * 64) is not None
+    assert cache.search([0.5, 0.5, 0.0], "a" * 64) is None
+    assert cache.search([1.0, 0.0, 0.0], "b" * 64) is None
+
+    version[0] = "v2"
+    assert cache.search([1.0, 0.0, 0.0], "a" * 64) is None
+    assert len(cache) == 0
+
+
+def test_semantic_cache_evicts_least_recently_used():
+    cache = SemanticCache(2, max_entries=2, threshold=0.95, dtype="float32")
+    cache.add([1.0, 0.0], "a" * 64, make_entry("x"))
+    cache.add([0.0, 1.0], "a" * 64, make_entry("y"))
+    cache.search([1.0, 0.0], "a" * 64)
+    cache.add([-1.0, 0.0], "a" * 64, make_entry("z"))
+
+    assert cache.search([1.0, 0.0], "a" * 64).tokens == ["x"]
+    assert cache.search([0.0, 1.0], "a" * 64) is None
@@ -0,0 +1,53 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from chatbot_api.context_packer import ContextPacker
+
+
+def words(text):
+    return text.split()
+
+
+def node(text, score, source=None, start=None):
+    metadata = {"source": source} if source else {}
+    end = start + len(text) if start is not None else None
+    return NodeWithScore(
+        node=TextNode(
+            text=text, metadata=metadata, start_char_idx=start, end_char_idx=end
+        ),
+        score=score,
+    )
+
+
+def test_drops_near_duplicates_and_merges_same_source():
+    packer = ContextPacker(token_budget=None, tokenizer=words)
+    packed = packer.pack(
+        [
+            node("one two three four", 0.5, "a", start=0),
+            node("one two three four", 0.4, "b"),
+            node("four five six", 0.9, "a", start=14),
+            node("unrelated text here", 0.7),
+        ]
+    )
+
+    assert packed.text == (
+        "- one two three four five six\nPrevious document was from URL link: a"
+        "\n\n- unrelated text here"
+    )
+    assert packed.nodes_before == 4
+    assert packed.nodes_after == 3
+    assert packed.tokens_after < packed.tokens_before
+
+
+def test_fits_budget_by_score():
+    packer = ContextPacker(token_budget=12, tokenizer=words)
+    packed = packer.pack(
+        [
+            node("low " * 5, 0.1),
+            node("high " * 5, 0.9),
+            node("mid " * 20, 0.5),
+        ]
+    )
+
+    assert packed.text.startswith("- high high")
+    assert "low" not in packed.text
+    assert packed.tokens_after <= 12
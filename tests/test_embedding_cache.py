@@ -0,0 +1,76 @@
+import asyncio
+from typing import List
+
+from langchain.embeddings.base import Embeddings
+
+from chatbot_api.embedding_cache import CachedEmbeddings, EmbeddingStore
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.texts = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.texts.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def test_only_misses_reach_the_model():
+    inner = CountingEmbeddings()
+    cached = CachedEmbeddings(inner, "model", max_entries=10)
+
+    assert cached.embed_documents(["a", "bb", "a"]) == [
+        [1.0, 1.0],
+        [2.0, 1.0],
+        [1.0, 1.0],
+    ]
+    assert cached.embed_documents(["bb", "ccc"])[1] == [3.0, 1.0]
+    assert inner.texts == ["a", "bb", "ccc"]
+
+    # Queries are cached separately from documents
+    assert asyncio.run(cached.aembed_query("a")) == [1.0, 1.0]
+    assert cached.embed_query("a") == [1.0, 1.0]
+    assert inner.texts == ["a", "bb", "ccc", "a"]
+
+
+def test_lru_eviction_tracks_bytes():
+    cached = CachedEmbeddings(CountingEmbeddings(), "model", max_entries=2)
+    cached.embed_documents(["a", "b", "c"])
+    assert len(cached._entries) == 2
+    assert cached.memory_bytes == 2 * 2 * 4
+
+
+def test_store_is_shared_across_instances(tmp_path):
+    first = CountingEmbeddings()
+    CachedEmbeddings(
+        first, "model", 10, store=EmbeddingStore(str(tmp_path), "model")
+    ).embed_documents(["a", "bb"])
+
+    second = CountingEmbeddings()
+    cached = CachedEmbeddings(
+        second, "model", 10, store=EmbeddingStore(str(tmp_path), "model")
+    )
+    assert cached.embed_documents(["bb", "a", "ccc"]) == [
+        [2.0, 1.0],
+        [1.0, 1.0],
+        [3.0, 1.0],
+    ]
+    assert second.texts == ["ccc"]
+    assert cached.store.nbytes > 0
+
+
+def test_async_queries_use_the_store(tmp_path):
+    first = CachedEmbeddings(
+        CountingEmbeddings(), "model", 10, store=EmbeddingStore(str(tmp_path), "model")
+    )
+    assert asyncio.run(first.aembed_query("abc")) == [3.0, 1.0]
+
+    second = CountingEmbeddings()
+    cached = CachedEmbeddings(
+        second, "model", 10, store=EmbeddingStore(str(tmp_path), "model")
+    )
+    assert asyncio.run(cached.aembed_query("abc")) == [3.0, 1.0]
+    assert second.texts == []
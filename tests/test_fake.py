@@ -0,0 +1,89 @@
+import asyncio
+import time
+import numpy as np
+from llama_index.core.schema import TextNode
+from chatbot_api.assistant import AssistantBison
+from chatbot_api.streaming import stream_tokens
+from integrations.fake import FAKE_RESPONSE, FakeEmbeddings
+from tests.helpers import make_config
+
+
+def test_fake_embeddings_are_deterministic_unit_vectors():
+    embeddings = FakeEmbeddings(dimension=8)
+    vector = embeddings.embed_query("What is SAI?")
+    assert len(vector) == 8
+    assert np.isclose(np.linalg.norm(vector), 1.0)
+    assert FakeEmbeddings(dimension=8).embed_documents(["What is SAI?"]) == [vector]
+    assert embeddings.embed_query("What is CQL?") != vector
+
+
+def test_assistant_streams_the_fake_answer_offline(tmp_path):
+    config = make_config(
+        llm_provider="fake",
+        fake_embeddings_dimension=16,
+        fake_ttft_seconds=0.1,
+        fake_tokens_per_second=1000,
+        local_vector_store_path=str(tmp_path),
+    )
+    assistant = AssistantBison(config)
+    assert assistant.embedding_dimension == 16
+
+    async def run():
+        start = time.perf_counter()
+        bot_response, _, _ = await assistant.aget_response(
+            user_input="What is SAI?", persona="default"
+        )
+        tokens = [token async for token in stream_tokens(bot_response)]
+        return tokens, time.perf_counter() - start
+
+    tokens, elapsed = asyncio.run(run())
+    assert "".join(tokens) == FAKE_RESPONSE
+    assert len(tokens) == len(FAKE_RESPONSE.split(" "))
+    assert elapsed >= 0.1
+
+
+def test_hybrid_search_finds_exact_terms(tmp_path):
+    config = make_config(
+        llm_provider="fake",
+        fake_embeddings_dimension=16,
+        fake_embeddings_delay_seconds=0.05,
+        local_vector_store_path=str(tmp_path / "vectors"),
+        hybrid_search_enabled=True,
+        lexical_index_path=str(tmp_path / "lexical"),
+    )
+    assistant = AssistantBison(config)
+    texts = [f"Chunk number {i} about Cassandra." for i in range(10)]
+    texts[7] = "Error code ERR_4012 means the keyspace doesn't exist."
+    embeddings = FakeEmbeddings(dimension=16).embed_documents(texts)
+    nodes = [
+        TextNode(id_=str(i), text=text, embedding=embedding)
+        for i, (text, embedding) in enumerate(zip(texts, embeddings))
+    ]
+    assistant.vectorstore.add(nodes)
+    assistant.lexical_index.add(nodes)
+    assistant.lexical_index.save()
+
+    results = assistant.retrieve("What is ERR_4012?")
+    assert len(results) == 4
+    assert results[0].node.node_id == "7"
+    results = asyncio.run(assistant.aretrieve("What is ERR_4012?"))
+    assert results[0].node.node_id == "7"
+
+    # Prefetching starts the lexical search before the embedding is back
+    events = []
+    lexical_search, aembed_query = assistant.lexical_search, assistant.aembed_query
+
+    def recording_lexical_search(query):
+        events.append("lexical_search")
+        return lexical_search(query)
+
+    async def recording_aembed_query(query):
+        embedding = await aembed_query(query)
+        events.append("embedding")
+        return embedding
+
+    assistant.lexical_search = recording_lexical_search
+    assistant.aembed_query = recording_aembed_query
+    retrieval = asyncio.run(assistant.aprefetch("What does ERR_4012 mean?"))
+    assert retrieval.results[0].node.node_id == "7"
+    assert events == ["lexical_search", "embedding"]
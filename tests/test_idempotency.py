@@ -0,0 +1,102 @@
+import asyncio
+import threading
+
+from pipeline.idempotency import InMemoryIdempotencyStore, SQLiteIdempotencyStore
+
+
+async def generate_once(store, key, calls, result="An answer."):
+    previous = await store.acquire(key)
+    if previous is not None:
+        return previous
+    calls.append(key)
+    await asyncio.sleep(0.05)
+    await store.complete(key, result)
+    return result
+
+
+def test_duplicates_wait_for_the_request_in_flight():
+    async def run(store):
+        calls = []
+        results = await asyncio.gather(
+            *[generate_once(store, "k1", calls) for _ in range(5)]
+        )
+        return calls, results
+
+    for store in [
+        InMemoryIdempotencyStore(ttl_seconds=60),
+        SQLiteIdempotencyStore(":memory:", ttl_seconds=60, poll_seconds=0.01),
+    ]:
+        calls, results = asyncio.run(run(store))
+        assert calls == ["k1"]
+        assert results == ["An answer."] * 5
+
+
+def test_release_lets_the_next_duplicate_do_the_work():
+    async def run(store):
+        assert await store.acquire("k1") is None
+        waiter = asyncio.create_task(store.acquire("k1"))
+        await asyncio.sleep(0.02)
+        await store.release("k1")
+        # The waiter now owns the key
+        assert await waiter is None
+        await store.complete("k1", "Second try.")
+        return await store.acquire("k1")
+
+    for store in [
+        InMemoryIdempotencyStore(ttl_seconds=60),
+        SQLiteIdempotencyStore(":memory:", ttl_seconds=60, poll_seconds=0.01),
+    ]:
+        assert asyncio.run(run(store)) == "Second try."
+
+
+def test_results_expire_after_ttl():
+    async def run(store):
+        assert await store.acquire("k1") is None
+        await store.complete("k1", "An answer.")
+        await asyncio.sleep(0.05)
+        return await store.acquire("k1")
+
+    for store in [
+        InMemoryIdempotencyStore(ttl_seconds=0.01),
+        SQLiteIdempotencyStore(":memory:", ttl_seconds=0.01),
+    ]:
+        assert asyncio.run(run(store)) is None
+
+
+def test_sqlite_takes_over_an_expired_lease(tmp_path):
+    path = str(tmp_path / "idempotency.db")
+
+    async def run():
+        # A worker that died after acquiring the key never completes it
+        crashed = SQLiteIdempotencyStore(path, ttl_seconds=60, lease_seconds=0.1)
+        assert await crashed.acquire("k1") is None
+
+        store = SQLiteIdempotencyStore(
+            path, ttl_seconds=60, lease_seconds=0.1, poll_seconds=0.02
+        )
+        assert await store.acquire("k1") is None
+        await store.complete("k1", "An answer.")
+        return await crashed.acquire("k1")
+
+    assert asyncio.run(run()) == "An answer."
+
+
+def test_sqlite_workers_never_claim_the_same_key(tmp_path):
+    path = str(tmp_path / "idempotency.db")
+    stores = [SQLiteIdempotencyStore(path, ttl_seconds=60) for _ in range(4)]
+    barrier = threading.Barrier(len(stores))
+    claims = []
+
+    def claim_all(store):
+        barrier.wait()
+        for i in range(50):
+            acquired, _ = store._try_acquire(f"k{i}")
+            if acquired:
+                claims.append(f"k{i}")
+
+    threads = [threading.Thread(target=claim_all, args=(s,)) for s in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claims) == sorted(f"k{i}" for i in range(50))
@@ -0,0 +1,261 @@
+import asyncio
+from email.utils import formatdate
+import hashlib
+import hmac
+import json
+import time
+
+import httpx
+import pytest
+
+from integrations.intercom import (
+    ContactCache,
+    IntercomClient,
+    IntercomConversationInfo,
+    IntercomResponseActor,
+    IntercomResponseDecider,
+    IntercomUserContextCreator,
+    _retry_delay,
+)
+from pipeline import RequestBody
+from tests.helpers import make_config
+
+
+def make_intercom_config():
+    return make_config(
+        bot_intercom_id="bot",
+        intercom_token="token",
+        intercom_client_secret="secret",
+        intercom_api_url="http://intercom.test",
+        intercom_retry_backoff_seconds=0.01,
+    )
+
+
+def mock_intercom(client, statuses):
+    """Answers with each of `statuses` in turn, then 200, recording the requests"""
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        status = statuses[len(requests) - 1] if len(requests) <= len(statuses) else 200
+        if isinstance(status, type):
+            raise status("Intercom is unreachable", request=request)
+        return httpx.Response(status, headers={"Retry-After": "0"}, json={"id": "1"})
+
+    client._client_kwargs["transport"] = httpx.MockTransport(handler)
+    return requests
+
+
+def test_client_retries_throttled_and_failed_requests():
+    client = IntercomClient(make_intercom_config())
+    requests = mock_intercom(client, [429, 503])
+    response = client.request("GET", "/contacts/1")
+    assert response.status_code == 200
+    assert len(requests) == 3
+    assert requests[0].headers["Authorization"] == "Bearer token"
+
+    # Gives up after intercom_max_retries and raises for the last response
+    client = IntercomClient(make_intercom_config())
+    requests = mock_intercom(client, [500] * 10)
+    with pytest.raises(httpx.HTTPStatusError):
+        client.request("GET", "/contacts/1")
+    assert len(requests) == 4
+
+    # Client errors are not retried
+    client = IntercomClient(make_intercom_config())
+    requests = mock_intercom(client, [404])
+    assert asyncio.run(client.arequest("GET", "/contacts/1")).status_code == 404
+    assert len(requests) == 1
+
+
+def test_client_only_retries_posts_that_were_not_processed():
+    # Never sent, or throttled, so safe to send again
+    client = IntercomClient(make_intercom_config())
+    requests = mock_intercom(client, [httpx.ConnectError, 429])
+    assert client.request("POST", "/conversations/1/reply").status_code == 200
+    assert len(requests) == 3
+
+    # Intercom may have posted the reply already
+    for failure in [httpx.ReadTimeout, httpx.RemoteProtocolError]:
+        client = IntercomClient(make_intercom_config())
+        requests = mock_intercom(client, [failure])
+        with pytest.raises(failure):
+            asyncio.run(client.arequest("POST", "/conversations/1/reply"))
+        assert len(requests) == 1
+
+    client = IntercomClient(make_intercom_config())
+    requests = mock_intercom(client, [503])
+    with pytest.raises(httpx.HTTPStatusError):
+        client.request("POST", "/conversations/1/reply")
+    assert len(requests) == 1
+
+
+def test_client_closes_the_pool_of_a_previous_event_loop():
+    client = IntercomClient(make_intercom_config())
+    mock_intercom(client, [])
+    asyncio.run(client.arequest("GET", "/contacts/1"))
+    first = client._async_client
+
+    async def run():
+        await client.arequest("GET", "/contacts/1")
+        await asyncio.sleep(0)  # Lets the replaced client close
+        assert first.is_closed
+        await client.aclose()
+
+    asyncio.run(run())
+    assert client._async_client is None and client._client is None
+
+
+def test_retry_delay_honors_retry_after():
+    def response(retry_after):
+        return httpx.Response(429, headers={"Retry-After": retry_after})
+
+    assert _retry_delay(response("2"), 0, 0.5, 30.0) == 2.0
+    assert _retry_delay(response("120"), 0, 0.5, 30.0) == 30.0
+    http_date = formatdate(time.time() + 10, usegmt=True)
+    assert 8.0 < _retry_delay(response(http_date), 0, 0.5, 30.0) <= 10.0
+    # Without Retry-After, back off exponentially with jitter
+    assert 1.0 <= _retry_delay(None, 2, 0.5, 30.0) <= 2.0
+
+
+def test_actor_replies_through_the_async_client():
+    actor = IntercomResponseActor(make_intercom_config())
+    requests = mock_intercom(actor.intercom, [])
+    conv_info = IntercomConversationInfo(
+        conversation_id="c1",
+        contact={},
+        user_question="How do I create an index?",
+        is_user=False,
+        debug_mode=False,
+        source_url="https://example.com",
+    )
+
+    async def run():
+        await actor.atake_action(conv_info, "An answer.", "", "")
+        await actor.shutdown()
+
+    asyncio.run(run())
+    assert [request.url.path for request in requests] == ["/conversations/c1/reply"]
+    assert b'"message_type":"note"' in requests[0].content.replace(b" ", b"")
+
+
+def test_actor_skips_replies_it_already_posted():
+    actor = IntercomResponseActor(make_intercom_config())
+    posted = []
+
+    def handler(request):
+        if request.method == "POST":
+            posted.append(json.loads(request.content)["body"])
+            return httpx.Response(200, json={"id": "c1"})
+        assert request.url.params["display_as"] == "plaintext"
+        parts = [
+            {"part_type": "note", "author": {"id": "bot"}, "body": body}
+            for body in posted
+        ]
+        return httpx.Response(
+            200, json={"conversation_parts": {"conversation_parts": parts}}
+        )
+
+    actor.intercom._client_kwargs["transport"] = httpx.MockTransport(handler)
+    conv_info = IntercomConversationInfo("c1", {}, "What is SAI?", False, False, "")
+
+    async def run():
+        # A replay of the same job, e.g. after its worker crashed having posted it
+        await actor.atake_action(conv_info, "An answer.", "", "", "key")
+        await actor.shutdown()
+
+    actor.take_action(conv_info, "An answer.", "", "", "key")
+    actor.take_action(conv_info, "Another answer.", "", "", "key")
+    asyncio.run(run())
+    assert posted == [
+        "Assistant Suggested Response: An answer.",
+        "Assistant Suggested Response: Another answer.",
+    ]
+
+
+def test_contact_cache_serves_stale_contacts_while_refreshing():
+    fetched = []
+
+    async def fetch(contact_id):
+        fetched.append(contact_id)
+        await asyncio.sleep(0.01)
+        return {"type": "contact", "id": contact_id, "version": len(fetched)}
+
+    async def run():
+        cache = ContactCache(max_entries=10, ttl_seconds=0.05, stale_seconds=10)
+        assert (await cache.aget("u1", fetch))["version"] == 1
+        assert (await cache.aget("u1", fetch))["version"] == 1
+        assert fetched == ["u1"]
+
+        # Past the TTL the stale contact is served at once, and refreshed only once
+        await asyncio.sleep(0.06)
+        stale = await asyncio.gather(*[cache.aget("u1", fetch) for _ in range(3)])
+        assert [contact["version"] for contact in stale] == [1, 1, 1]
+        await asyncio.sleep(0.05)
+        assert (await cache.aget("u1", fetch))["version"] == 2
+        assert fetched == ["u1", "u1"]
+
+    asyncio.run(run())
+
+
+def test_contact_webhooks_invalidate_the_cache():
+    config = make_intercom_config()
+    decider = IntercomResponseDecider(config)
+    decider.contact_cache.put("u1", {"type": "contact", "id": "u1"}, time.time())
+
+    raw = b'{"topic":"contact.user.updated","data":{"item":{"id":"u1"}}}'
+    digest = hmac.new(b"secret", raw, hashlib.sha1).hexdigest()
+    decision = decider.make_response_decision(
+        RequestBody(raw), {"X-Hub-Signature": f"sha1={digest}"}
+    )
+    assert decision.should_return_early and decision.response_code == 200
+
+    fetched = []
+
+    def fetch(contact_id):
+        fetched.append(contact_id)
+        return {"type": "error.list"}
+
+    assert decider.contact_cache.get("u1", fetch) == {"type": "error.list"}
+    assert fetched == ["u1"]
+    # Errors aren't cached, the next lookup tries again
+    decider.contact_cache.get("u1", fetch)
+    assert fetched == ["u1", "u1"]
+
+
+def test_contact_is_looked_up_while_creating_the_user_context():
+    config = make_intercom_config()
+    decider = IntercomResponseDecider(config)
+    creator = IntercomUserContextCreator(config)
+    requests = mock_intercom(creator.intercom, [])
+
+    author = {"email": "a@example.com", "id": "u2", "type": "user"}
+    raw = json.dumps(
+        {
+            "delivery_attempts": 1,
+            "data": {
+                "item": {
+                    "type": "conversation",
+                    "id": "c1",
+                    "conversation_parts": {"conversation_parts": []},
+                    "source": {
+                        "author": author,
+                        "body": "<p>How do I create an index?</p>",
+                        "delivered_as": "customer_initiated",
+                        "url": "https://example.com",
+                    },
+                }
+            },
+        }
+    ).encode("utf-8")
+    digest = hmac.new(b"secret", raw, hashlib.sha1).hexdigest()
+    decision = decider.make_response_decision(
+        RequestBody(raw), {"X-Hub-Signature": f"sha1={digest}"}
+    )
+    # The question is known without waiting on Intercom
+    assert decision.user_question == "How do I create an index?"
+    assert requests == []
+
+    asyncio.run(creator.acreate_user_context(decision.conversation_info))
+    assert decision.conversation_info.contact == {"id": "1"}
+    assert [request.url.path for request in requests] == ["/contacts/u2"]
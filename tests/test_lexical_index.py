@@ -0,0 +1,105 @@
+from llama_index.core.schema import (
+    NodeRelationship,
+    NodeWithScore,
+    RelatedNodeInfo,
+    TextNode,
+)
+
+from chatbot_api.lexical_index import BM25Index, reciprocal_rank_fusion, tokenize
+
+CHUNKS = [
+    "Create a Storage-Attached Index with CREATE CUSTOM INDEX.",
+    "Error code ERR_4012 means the keyspace doesn't exist.",
+    "The text-embedding-ada-002 model returns 1536 dimensions.",
+    "Cassandra stores data in tables, tables live in a keyspace.",
+]
+
+
+def make_nodes(texts, start=0):
+    return [TextNode(id_=str(i), text=text) for i, text in enumerate(texts, start)]
+
+
+def test_tokenize_keeps_codes_and_their_parts():
+    assert tokenize("What is ERR_4012 in text-embedding-ada-002?") == [
+        "err_4012",
+        "err",
+        "4012",
+        "text-embedding-ada-002",
+        "text",
+        "embedding",
+        "ada",
+        "002",
+    ]
+
+
+def test_search_ranks_exact_terms(tmp_path):
+    index = BM25Index(str(tmp_path))
+    index.add(make_nodes(CHUNKS))
+    assert index.search("keyspace", 5) == []  # Not searchable before save()
+    index.save()
+
+    results = index.search("what does ERR_4012 mean", 2)
+    assert [result.node.node_id for result in results] == ["1"]
+    assert results[0].node.text == CHUNKS[1]
+
+    results = index.search("keyspace tables", 5)
+    assert [result.node.node_id for result in results] == ["3", "1"]
+    assert results[0].score > results[1].score
+    assert [r.node.node_id for r in index.search("ada-002 dimensions", 1)] == ["2"]
+    assert index.search("nothing matches", 5) == []
+
+
+def test_saves_merge_with_the_previous_generation(tmp_path):
+    index = BM25Index(str(tmp_path))
+    index.add(make_nodes(CHUNKS[:2]))
+    index.save()
+    reader = BM25Index(str(tmp_path))
+    assert len(reader) == 2
+
+    writer = BM25Index(str(tmp_path))
+    writer.add(make_nodes(CHUNKS[2:], start=2))
+    writer.save()
+    assert len(reader) == 4
+    assert [r.node.node_id for r in reader.search("keyspace", 5)] == ["3", "1"]
+    assert sorted(name for name in tmp_path.iterdir() if name.suffix == ".npy") == [
+        tmp_path / f"{name}-2.npy"
+        for name in ("frequencies", "lengths", "offsets", "postings", "weights")
+    ]
+
+
+def test_deleted_and_replaced_chunks_are_not_returned(tmp_path):
+    index = BM25Index(str(tmp_path))
+    nodes = make_nodes(CHUNKS)
+    for node in nodes:
+        node.relationships = {
+            NodeRelationship.SOURCE: RelatedNodeInfo(node_id=f"doc-{node.node_id}")
+        }
+    index.add(nodes)
+    index.save()
+
+    reader = BM25Index(str(tmp_path))
+    index.delete("doc-3")
+    assert len(reader) == 3
+    assert [r.node.node_id for r in reader.search("keyspace", 5)] == ["1"]
+
+    # Re-adding a node replaces it, whether it was saved or not
+    index.add(make_nodes(["Keyspaces hold tables."], start=1))
+    index.add(make_nodes(["Tables hold rows."], start=1))
+    index.save()
+    assert len(reader) == 3
+    assert reader.search("keyspace", 5) == []
+    assert [r.node.text for r in reader.search("tables", 5)] == ["Tables hold rows."]
+
+
+def test_reciprocal_rank_fusion_favors_nodes_in_both_rankings():
+    a, b, c = (TextNode(id_=id, text=id) for id in "abc")
+    fused = reciprocal_rank_fusion(
+        [
+            [NodeWithScore(node=a, score=0.9), NodeWithScore(node=b, score=0.8)],
+            [NodeWithScore(node=c, score=12.0), NodeWithScore(node=b, score=3.0)],
+        ],
+        top_k=2,
+        k=60,
+    )
+    assert [result.node.node_id for result in fused] == ["b", "a"]
+    assert fused[0].score == 2 / 62
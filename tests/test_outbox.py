@@ -0,0 +1,129 @@
+import asyncio
+import sqlite3
+import time
+
+from integrations.intercom import IntercomConversationInfo
+from pipeline import ActorEngine, IntegrationSet, ResponseActor
+from pipeline.outbox import Outbox, OutboxEntry
+from tests.helpers import make_config
+
+
+class RecordingActor(ResponseActor):
+    required_fields = []
+    responses = []
+    keys = []
+
+    def take_action(
+        self, conv_info, text_response, responses_from_vs, context, idempotency_key=None
+    ):
+        self.responses.append((conv_info["conversation_id"], text_response))
+        self.keys.append(idempotency_key)
+
+
+def make_entry(key, text="An answer."):
+    return OutboxEntry(
+        key, "RecordingActor", {"conversation_id": "c1"}, text, "", "", time.time()
+    )
+
+
+def test_pending_entries_survive_a_restart(tmp_path):
+    for sync_mode in ["entry", "group"]:
+        directory = str(tmp_path / sync_mode)
+        outbox = Outbox(directory, sync_mode=sync_mode)
+
+        async def append():
+            return await asyncio.gather(
+                outbox.append([make_entry("a"), make_entry("b")]),
+                outbox.append([make_entry("c")]),
+                outbox.append([make_entry("a", "Duplicate key, ignored.")]),
+            )
+
+        assert asyncio.run(append()) == [{"a", "b"}, {"c"}, set()]
+        outbox.mark("b", "done")
+        outbox.close()
+
+        reopened = Outbox(directory, sync_mode=sync_mode)
+        pending = reopened.pending()
+        assert sorted(entry.key for entry in pending) == ["a", "c"]
+        assert {entry.text_response for entry in pending} == {"An answer."}
+        reopened.close()
+
+
+def test_workers_only_claim_abandoned_entries(tmp_path):
+    worker = Outbox(str(tmp_path), lease_seconds=0.2)
+    other = Outbox(str(tmp_path), lease_seconds=0.2)
+    asyncio.run(worker.append([make_entry("a"), make_entry("b")]))
+    assert other.claim_abandoned() == []
+
+    # The worker renews its lease on "a", but "b"'s runs out, as if it had crashed
+    time.sleep(0.3)
+    worker.renew()
+    with sqlite3.connect(worker.path) as conn:
+        conn.execute("UPDATE outbox SET leased_until = 0 WHERE key = 'b'")
+    assert [entry.key for entry in other.claim_abandoned()] == ["b"]
+    assert worker.claim_abandoned() == []
+
+    # Closing gives up the lease on "a", for the other worker to replay
+    worker.close()
+    assert [entry.key for entry in other.claim_abandoned()] == ["a"]
+    other.close()
+
+
+def test_engine_replays_pending_actions_on_startup(tmp_path):
+    outbox = Outbox(str(tmp_path))
+    asyncio.run(outbox.append([make_entry("crashed:RecordingActor")]))
+    outbox.close()
+
+    config = make_config(
+        response_actor_cls=["RecordingActor"], outbox_path=str(tmp_path)
+    )
+    RecordingActor.responses = []
+
+    async def run():
+        engine = ActorEngine(config, IntegrationSet(config))
+        await engine.start()
+        await engine.submit({"conversation_id": "c2"}, "New answer.", "", "")
+        await asyncio.sleep(0.1)
+        await engine.stop()
+
+    asyncio.run(run())
+    assert sorted(RecordingActor.responses) == [
+        ("c1", "An answer."),
+        ("c2", "New answer."),
+    ]
+    assert Outbox(str(tmp_path)).pending() == []
+
+
+def test_entries_are_json_and_unreadable_ones_fail(tmp_path):
+    conv_info = IntercomConversationInfo("c1", None, "What is SAI?", True, False, "")
+    entry = OutboxEntry("a", "IntercomResponseActor", conv_info, "", "", "", 0.0)
+    outbox = Outbox(str(tmp_path))
+    asyncio.run(outbox.append([entry, make_entry("b")]))
+    with sqlite3.connect(outbox.path) as conn:
+        conn.execute("UPDATE outbox SET entry = 'not json' WHERE key = 'b'")
+
+    assert outbox.pending() == [entry]
+    assert outbox.pending() == [entry]  # b was marked failed, not left pending
+    outbox.close()
+
+
+def test_engine_takes_each_action_once_per_response(tmp_path):
+    config = make_config(
+        response_actor_cls=["RecordingActor"], outbox_path=str(tmp_path)
+    )
+    RecordingActor.responses, RecordingActor.keys = [], []
+
+    async def run():
+        engine = ActorEngine(config, IntegrationSet(config))
+        await engine.start()
+        # Redeliveries of the same request, then of the same response
+        for _ in range(2):
+            await engine.submit({"conversation_id": "c1"}, "A.", "", "", "request")
+        for _ in range(2):
+            await engine.submit({"conversation_id": "c2"}, "B.", "", "")
+        await engine.stop()
+
+    asyncio.run(run())
+    assert RecordingActor.responses == [("c1", "A."), ("c2", "B.")]
+    assert RecordingActor.keys[0] == "request:RecordingActor"
+    assert RecordingActor.keys[1].endswith(":RecordingActor")
@@ -0,0 +1,272 @@
+import asyncio
+import hashlib
+import hmac
+import time
+
+import pytest
+
+from integrations.intercom import IntercomResponseDecider
+from pipeline import (
+    ActorEngine,
+    IntegrationSet,
+    JobQueue,
+    RequestBody,
+    ResponseActor,
+    ResponseDecider,
+    ResponseDecision,
+    UserContext,
+    UserContextCreator,
+    acreate_all_user_context,
+    create_all_user_context,
+)
+from pipeline.actor_engine import ACTOR_JOBS
+from pipeline.metrics import STAGE_SECONDS, render_metrics
+from pipeline.response_decision import amake_all_response_decisions
+from pipeline.user_context import merge_user_contexts
+from tests.helpers import make_config
+
+
+class LifecycleDecider(ResponseDecider):
+    required_fields = []
+    events = []
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.events.append("init")
+
+    async def startup(self):
+        self.events.append("startup")
+
+    async def shutdown(self):
+        self.events.append("shutdown")
+
+    def make_response_decision(self, request_body, request_headers):
+        return ResponseDecision(
+            should_return_early=True, response_dict={"id": id(self)}
+        )
+
+
+def test_integrations_are_shared_between_requests():
+    config = make_config(response_decider_cls=["LifecycleDecider"])
+    integrations = IntegrationSet(config)
+
+    async def run():
+        await integrations.startup()
+        decisions = [
+            await amake_all_response_decisions(config, {}, {}, integrations)
+            for _ in range(3)
+        ]
+        await integrations.shutdown()
+        return decisions
+
+    decisions = asyncio.run(run())
+    assert len({decision.response_dict["id"] for decision in decisions}) == 1
+    assert LifecycleDecider.events == ["init", "startup", "shutdown"]
+
+
+def test_stages_are_timed_per_integration():
+    config = make_config(response_decider_cls=["LifecycleDecider"])
+    config.user_context_creator_cls = ["PrimaryContextCreator"]
+    labels = {"integration": "PrimaryContextCreator", "llm_provider": "openai"}
+    before = STAGE_SECONDS.count(stage="user_context", **labels)
+
+    asyncio.run(acreate_all_user_context(config, None))
+    create_all_user_context(config, None)
+    assert STAGE_SECONDS.count(stage="user_context", **labels) == before + 2
+    assert (
+        'chatbot_stage_seconds_count{stage="user_context",'
+        'integration="PrimaryContextCreator",llm_provider="openai"}'
+    ) in render_metrics()
+
+
+class SlowContextCreator(UserContextCreator):
+    required_fields = []
+    delay = 0.0
+
+    def create_user_context(self, conv_info):
+        time.sleep(self.delay)
+        return UserContext("question", "default", "From the CRM.")
+
+
+class PrimaryContextCreator(UserContextCreator):
+    required_fields = []
+
+    def create_user_context(self, conv_info):
+        time.sleep(0.2)
+        return UserContext("question", "default", "From the ticket.", session_id="s")
+
+
+def test_context_creators_run_concurrently_and_merge():
+    config = make_config(response_decider_cls=["LifecycleDecider"])
+    config.user_context_creator_cls = ["PrimaryContextCreator", "SlowContextCreator"]
+    config.user_context_token_budget = None
+    SlowContextCreator.delay = 0.2
+
+    start = time.monotonic()
+    user_context = asyncio.run(acreate_all_user_context(config, None))
+    assert time.monotonic() - start < 0.35
+    assert user_context.context_str == "From the ticket.\nFrom the CRM."
+    assert user_context.session_id == "s"
+
+    # Secondary sources that time out are left out
+    config.user_context_timeout_seconds = 0.3
+    SlowContextCreator.delay = 0.5
+    assert create_all_user_context(config, None).context_str == "From the ticket."
+
+
+def test_context_token_budget():
+    contexts = [
+        UserContext("q", "default", "one two three"),
+        None,
+        UserContext("q", "default", "four five six"),
+    ]
+    merged = merge_user_contexts(contexts, token_budget=5, tokenizer=str.split)
+    assert merged.context_str == "one two three\nfour"
+
+
+class FlakyActor(ResponseActor):
+    required_fields = []
+    failures = 0
+    delay = 0.0
+    calls = []
+
+    async def atake_action(
+        self, conv_info, text_response, responses_from_vs, context, idempotency_key=None
+    ):
+        self.calls.append(text_response)
+        await asyncio.sleep(self.delay)
+        if len(self.calls) <= self.failures:
+            raise RuntimeError("Intercom is down")
+
+    def take_action(
+        self, conv_info, text_response, responses_from_vs, context, idempotency_key=None
+    ):
+        pass
+
+
+def make_engine(**overrides):
+    config = make_config()
+    config.response_actor_cls = ["FlakyActor"]
+    config.actor_retry_backoff_seconds = 0.01
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    return ActorEngine(config, IntegrationSet(config))
+
+
+def test_actor_engine_retries_then_gives_up():
+    engine = make_engine(actor_max_retries=1)
+    FlakyActor.calls, FlakyActor.failures = [], 1
+
+    async def run():
+        await engine.submit(None, "first", "", "")
+        await engine.stop()
+
+    asyncio.run(run())
+    assert FlakyActor.calls == ["first", "first"]
+
+    FlakyActor.calls, FlakyActor.failures = [], 5
+    asyncio.run(run())
+    assert FlakyActor.calls == ["first", "first"]
+
+
+class SlowActor(ResponseActor):
+    required_fields = []
+    delay = 0.3
+    calls = []
+
+    def take_action(
+        self, conv_info, text_response, responses_from_vs, context, idempotency_key=None
+    ):
+        self.calls.append("started")
+        time.sleep(self.delay)
+        self.calls.append("finished")
+
+
+def test_actor_engine_does_not_repeat_timed_out_actions():
+    engine = make_engine(
+        response_actor_cls=["SlowActor"], actor_max_retries=2, actor_timeout_seconds=0.1
+    )
+    SlowActor.calls = []
+    before = ACTOR_JOBS.value(actor="SlowActor", result="succeeded")
+
+    async def run():
+        await engine.submit(None, "slow", "", "")
+        await engine.stop()
+
+    asyncio.run(run())
+    # The attempt ran on past the timeout and counts as the success it was
+    assert SlowActor.calls == ["started", "finished"]
+    assert ACTOR_JOBS.value(actor="SlowActor", result="succeeded") == before + 1
+
+    # An idempotent actor is retried instead, after its attempt is cancelled
+    FlakyActor.calls, FlakyActor.failures = [], 0
+    FlakyActor.idempotent, FlakyActor.delay = True, 0.2
+    engine = make_engine(actor_max_retries=1, actor_timeout_seconds=0.1)
+    try:
+        asyncio.run(run())
+    finally:
+        FlakyActor.idempotent, FlakyActor.delay = False, 0.0
+    assert FlakyActor.calls == ["slow", "slow"]
+
+
+def test_actor_engine_sheds_when_full():
+    engine = make_engine(actor_queue_size=2)
+    FlakyActor.calls, FlakyActor.failures = [], 0
+
+    async def run():
+        # Workers only get to run once submit yields, so the third job doesn't fit
+        for text in ["a", "b", "c"]:
+            await engine.submit(None, text, "", "")
+        await engine.stop()
+
+    asyncio.run(run())
+    assert FlakyActor.calls == ["a", "b"]
+
+
+def test_job_queue_runs_jobs_and_sheds_when_full():
+    job_queue = JobQueue("test", num_workers=2, max_size=2)
+    done = []
+
+    async def job(i):
+        await asyncio.sleep(0.01)
+        done.append(i)
+
+    async def run():
+        accepted = [job_queue.submit(lambda i=i: job(i)) for i in range(3)]
+        await job_queue.stop()
+        return accepted
+
+    assert asyncio.run(run()) == [True, True, False]
+    assert sorted(done) == [0, 1]
+
+
+def test_intercom_signature_covers_the_raw_body():
+    config = make_config()
+    config.bot_intercom_id, config.intercom_token = "bot", "token"
+    config.intercom_client_secret = "secret"
+    decider = IntercomResponseDecider(config)
+
+    # Compact separators, which re-encoding the parsed body wouldn't reproduce
+    raw = b'{"delivery_attempts":1,"data":{"item":{"type":"ping"}}}'
+    digest = hmac.new(b"secret", raw, hashlib.sha1).hexdigest()
+    body = RequestBody(raw)
+    decision = decider.make_response_decision(
+        body, {"X-Hub-Signature": f"sha1={digest}"}
+    )
+    assert decision.response_code == 200
+
+    # Requests with a bad signature are turned away without parsing the body
+    body = RequestBody(raw)
+    decision = decider.make_response_decision(
+        body, {"X-Hub-Signature": "sha1=" + "0" * 40}
+    )
+    assert decision.response_code == 401
+    assert not body.is_parsed
+
+
+def test_astra_creds_are_only_required_when_astra_is_used():
+    assert make_config().astra_db_application_token is None
+    with pytest.raises(ValueError, match="astra_db_application_token"):
+        make_config(vector_store_backend="astra")
+    with pytest.raises(ValueError, match="astra_db_api_endpoint"):
+        make_config(session_backend="astra", astra_db_application_token="token")
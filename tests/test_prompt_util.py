@@ -0,0 +1,36 @@
+import os
+
+from chatbot_api.prompt_util import PromptRegistry
+
+PROMPT = """_type: prompt
+input_variables: [company, custom_rules, user_question, user_context, vector_search_results]
+template: "{company} {{literal}} {custom_rules}|{user_question}|{user_context}|{vector_search_results}"
+"""
+
+
+def test_compiled_prompt_fills_static_fields_once(tmp_path):
+    (tmp_path / "default.yaml").write_text(PROMPT)
+    registry = PromptRegistry(str(tmp_path))
+
+    prompt = registry.get_compiled("default", "Acme", ["- a", "- b"])
+    assert registry.get_compiled("default", "Acme", ["- a", "- b"]) is prompt
+    assert (
+        prompt.format(user_question="{q}", user_context="ctx", vector_search_results="")
+        == "Acme {literal} - a\n- b|{q}|ctx|"
+    )
+
+
+def test_reloads_when_the_file_changes(tmp_path):
+    path = tmp_path / "default.yaml"
+    path.write_text(PROMPT)
+    registry = PromptRegistry(str(tmp_path))
+    version = registry.get_version("default")
+
+    path.write_text(PROMPT.replace("{company} ", "{company}! "))
+    os.utime(path, (0, os.stat(path).st_mtime + 1))
+
+    assert registry.get_version("default") != version
+    prompt = registry.get_compiled("default", "Acme", [])
+    assert prompt.format(
+        user_question="q", user_context="c", vector_search_results="v"
+    ).startswith("Acme! ")
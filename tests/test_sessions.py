@@ -0,0 +1,84 @@
+import threading
+import time
+
+from llama_index.core.llms import MessageRole
+
+from chatbot_api.sessions import (
+    InMemorySessionBackend,
+    SQLiteSessionBackend,
+    SessionStore,
+)
+
+
+def word_tokenizer(text):
+    return text.split()
+
+
+def test_history_is_per_conversation():
+    store = SessionStore(InMemorySessionBackend(max_sessions=10, ttl_seconds=60))
+    store.append_turn("conv-1", "What is SAI?", "An index.")
+
+    history = store.get_history("conv-1")
+    assert [m.role for m in history] == [MessageRole.USER, MessageRole.ASSISTANT]
+    assert history[0].content == "What is SAI?"
+    assert store.get_history("conv-2") == []
+    assert store.get_history(None) == []
+
+
+def test_history_is_token_capped():
+    store = SessionStore(
+        InMemorySessionBackend(max_sessions=10, ttl_seconds=60),
+        max_messages=100,
+        token_limit=10,
+        tokenizer=word_tokenizer,
+    )
+    for i in range(20):
+        store.append_turn("conv", f"question {i}", f"answer number {i}")
+
+    history = store.get_history("conv")
+    assert sum(len(m.content.split()) for m in history) <= 10
+    assert history[-1].content == "answer number 19"
+    assert history[0].role == MessageRole.USER
+
+
+def test_lru_and_ttl_eviction():
+    backend = InMemorySessionBackend(max_sessions=2, ttl_seconds=60)
+    backend.save("a", [])
+    backend.save("b", [])
+    backend.load("a")
+    backend.save("c", [])
+    assert backend.load("b") is None
+    assert backend.load("a") == []
+
+    backend.ttl_seconds = 0.01
+    time.sleep(0.02)
+    assert backend.load("a") is None
+
+
+def test_sqlite_backend(tmp_path):
+    backend = SQLiteSessionBackend(
+        str(tmp_path / "sessions.db"), max_sessions=2, ttl_seconds=60
+    )
+    for session_id in ["a", "b", "c"]:
+        backend.save(session_id, [{"role": "user", "content": session_id}])
+
+    assert backend.load("a") is None
+    assert backend.load("c") == [{"role": "user", "content": "c"}]
+
+
+def test_concurrent_turns_are_all_kept(tmp_path):
+    backend = SQLiteSessionBackend(
+        str(tmp_path / "sessions.db"), max_sessions=10, ttl_seconds=60
+    )
+    store = SessionStore(backend, max_messages=100, tokenizer=word_tokenizer)
+    threads = [
+        threading.Thread(target=store.append_turn, args=("conv", f"q{i}", f"a{i}"))
+        for i in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    history = store.get_history("conv")
+    assert sorted(m.content for m in history[::2]) == [f"q{i}" for i in range(8)]
@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import httpx
+
+from pipeline.tracing import (
+    JSONLSpanExporter,
+    OTLPSpanExporter,
+    Tracer,
+    current_span,
+    set_tracer,
+    span,
+    start_trace,
+    use_span,
+)
+
+
+async def handle_request(traceparent=None):
+    trace = start_trace("request", traceparent, route="/chat")
+    with use_span(trace, end_on_exit=True):
+        with span("decision", integration="ExampleResponseDecider"):
+            await asyncio.sleep(0)
+
+        def search():
+            with span("vector_search"):
+                pass
+
+        async def retrieve():
+            with span("retrieval"):
+                await asyncio.to_thread(search)
+
+        await asyncio.gather(retrieve())
+    return trace
+
+
+def test_spans_follow_the_request_across_tasks_and_threads(tmp_path):
+    path = str(tmp_path / "traces.jsonl")
+    tracer = Tracer(JSONLSpanExporter(path), sample_rate=1.0, flush_seconds=0.01)
+    set_tracer(tracer)
+    try:
+        trace = asyncio.run(handle_request())
+    finally:
+        set_tracer(None)
+        tracer.shutdown()
+
+    with open(path) as file:
+        spans = {span["name"]: span for span in map(json.loads, file)}
+    assert set(spans) == {"request", "decision", "retrieval", "vector_search"}
+    assert {span["trace_id"] for span in spans.values()} == {trace.trace_id}
+    assert spans["request"]["parent_id"] is None
+    assert spans["decision"]["parent_id"] == trace.span_id
+    assert spans["decision"]["attributes"] == {"integration": "ExampleResponseDecider"}
+    assert spans["retrieval"]["parent_id"] == trace.span_id
+    assert spans["vector_search"]["parent_id"] == spans["retrieval"]["span_id"]
+    assert current_span() is None
+
+
+def test_unsampled_requests_record_nothing(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(JSONLSpanExporter(str(path)), sample_rate=0.0)
+    set_tracer(tracer)
+    try:
+        assert asyncio.run(handle_request()) is None
+        # The caller's sampling decision wins over the sample rate
+        unsampled = "00-" + "1" * 32 + "-" + "2" * 16 + "-00"
+        assert asyncio.run(handle_request(unsampled)) is None
+    finally:
+        set_tracer(None)
+        tracer.shutdown()
+    assert not path.exists()
+
+
+def test_otlp_exporter_continues_the_callers_trace():
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        return httpx.Response(200, json={})
+
+    exporter = OTLPSpanExporter("http://collector.test:4318/", "chatbot")
+    exporter._client = httpx.Client(transport=httpx.MockTransport(handler))
+    tracer = Tracer(exporter, sample_rate=0.0, flush_seconds=0.01)
+    set_tracer(tracer)
+    traceparent = "00-" + "1" * 32 + "-" + "2" * 16 + "-01"
+    try:
+        trace = asyncio.run(handle_request(traceparent))
+    finally:
+        set_tracer(None)
+        tracer.shutdown()
+
+    assert trace.trace_id == "1" * 32
+    assert trace.traceparent == f"00-{'1' * 32}-{trace.span_id}-01"
+    resource_spans = requests[0]["resourceSpans"][0]
+    assert resource_spans["resource"]["attributes"] == [
+        {"key": "service.name", "value": {"stringValue": "chatbot"}}
+    ]
+    spans = {
+        span["name"]: span
+        for request in requests
+        for span in request["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    }
+    assert spans["request"]["parentSpanId"] == "2" * 16
+    assert spans["decision"]["parentSpanId"] == trace.span_id
@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from chatbot_api.vector_store import LocalVectorStore
+
+
+def make_nodes(vectors, doc="doc"):
+    return [
+        TextNode(
+            id_=f"{doc}-{i}",
+            text=f"chunk {i} of {doc}",
+            embedding=list(vector),
+            metadata={"source": doc},
+            relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=doc)},
+        )
+        for i, vector in enumerate(vectors)
+    ]
+
+
+def query(store, vector, k=2):
+    return store.query(
+        VectorStoreQuery(query_embedding=list(vector), similarity_top_k=k)
+    )
+
+
+def test_query_returns_the_nearest_nodes_in_order(tmp_path):
+    store = LocalVectorStore(str(tmp_path), 3)
+    assert store and len(store) == 0
+    store.add(make_nodes([[1, 0, 0], [0, 2, 0], [1, 1, 0], [0, 0, 1]]))
+
+    result = query(store, [2, 1, 0])
+    assert result.ids == ["doc-2", "doc-0"]
+    assert result.similarities == pytest.approx(
+        [3 / np.sqrt(10), 2 / np.sqrt(5)], rel=1e-6
+    )
+    assert result.nodes[0].text == "chunk 2 of doc"
+    assert result.nodes[0].metadata == {"source": "doc"}
+
+
+def test_deleted_documents_are_not_returned(tmp_path):
+    store = LocalVectorStore(str(tmp_path), 2)
+    store.add(make_nodes([[1, 0], [0, 1]], doc="a"))
+    store.add(make_nodes([[1, 0.1]], doc="b"))
+    version = store.version
+
+    store.delete("a")
+    assert len(store) == 1
+    assert store.version != version
+    assert query(store, [1, 0], k=5).ids == ["b-0"]
+
+    # Re-adding a node replaces it
+    store.add(make_nodes([[0, 1]], doc="b"))
+    assert len(store) == 1
+    assert query(store, [1, 0], k=5).ids == ["b-0"]
+    assert query(store, [1, 0], k=5).similarities == pytest.approx([0.0], abs=1e-6)
+
+    # Re-ingesting as many nodes is a new version too
+    store = LocalVectorStore(str(tmp_path / "reingested"), 2)
+    store.add(make_nodes([[1, 0]]))
+    version = store.version
+    store.clear()
+    store.add(make_nodes([[1, 0]]))
+    assert store.version != version
+
+
+def test_grows_and_is_read_back_by_another_instance(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2500, 8)).astype(np.float32)
+    store = LocalVectorStore(str(tmp_path), 8, dtype="float16")
+    for start in range(0, len(vectors), 1000):
+        store.add(make_nodes(vectors[start : start + 1000], doc=str(start)))
+
+    reader = LocalVectorStore(str(tmp_path), 8, dtype="float16")
+    assert len(reader) == 2500
+    assert query(reader, vectors[1234], k=1).ids == ["1000-234"]
+
+    # Writes by one instance are visible to the other's next query
+    new = rng.standard_normal(8)
+    store.add(make_nodes([new], doc="new"))
+    assert query(reader, new, k=1).ids == ["new-0"]
+    assert len(reader) == 2501
+
+
+def test_ivf_index_is_trained_persisted_and_kept_up_to_date(tmp_path):
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((16, 8))
+    vectors = centers[rng.integers(16, size=700)] + 0.1 * rng.standard_normal((700, 8))
+    store = LocalVectorStore(str(tmp_path), 8, index="ivf", n_lists=16, nprobe=2)
+    store.add(make_nodes(vectors[:300], doc="a"))
+    assert store._centroids is None  # Exact until there are train_size = 512 nodes
+    store.add(make_nodes(vectors[300:600], doc="b"))
+    assert store._centroids is not None
+
+    # Added after training, so assigned to their list on insert
+    store.add(make_nodes(vectors[600:], doc="c"))
+    reader = LocalVectorStore(str(tmp_path), 8, index="ivf", n_lists=16, nprobe=2)
+    assert query(reader, vectors[650], k=1).ids == ["c-50"]
+
+    exact = LocalVectorStore(str(tmp_path), 8)
+    reader.nprobe = 16
+    for vector in vectors[::50]:
+        assert query(reader, vector, k=5).ids == query(exact, vector, k=5).ids
+
+    # The rows are grouped by list on add(), not by the first query after it
+    def assert_grouped(count):
+        lists = np.load(tmp_path / "lists.npy")[:count]
+        rows = np.load(tmp_path / "list_rows.npy")
+        assert np.array_equal(rows, np.argsort(lists, kind="stable"))
+
+    assert_grouped(700)
+    store.clear()
+    store.add(make_nodes(vectors[:100], doc="d"))
+    assert_grouped(100)
+    assert query(store, vectors[50], k=1).ids == ["d-50"]
+
+    # The grouping is never rebuilt on the query path
+    (tmp_path / "list_rows.npy").unlink()
+    with pytest.raises(RuntimeError, match="list_rows.npy"):
+        LocalVectorStore(str(tmp_path), 8, index="ivf", n_lists=16)